@@ -7,6 +7,7 @@ import logging
 
 # project
 from ottd_ctrl.const import AdminUpdateType as AUT, AdminUpdateFrequency as AUF
+from ottd_ctrl.log import start_background_logging, stop_background_logging
 from ottd_ctrl.session import Session
 
 WEBSITE = 'https://github.com/pedrudehuere/ottd_ctrl'
@@ -22,6 +23,7 @@ def parse_args():
     ap.add_argument('--server-host', default='localhost')
     ap.add_argument('--server-port', default=3977)
     ap.add_argument('--verbose', action='store_true')
+    ap.add_argument('--background-logging', action='store_true', help='Formats and writes logs in a thread')
     return ap.parse_args()
 
 
@@ -36,6 +38,7 @@ if __name__ == '__main__':
     fmt = '%(asctime)s %(levelname)s %(name)s %(message)s'
     date_fmt = '%Y-%m-%d_%H:%M:%S'
     logging.basicConfig(filename=None, level=log_level, format=fmt, datefmt=date_fmt)
+    log_listener = start_background_logging() if args.background_logging else None
     log = logging.getLogger('ottd')
     log.info('start')
 
@@ -53,3 +56,5 @@ if __name__ == '__main__':
         session.main_loop()
 
     log.info('end')
+    if log_listener is not None:
+        stop_background_logging(log_listener)
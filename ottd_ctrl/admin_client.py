@@ -4,13 +4,24 @@
 from collections import defaultdict
 from contextlib import contextmanager
 import logging
+import math
+from select import select
 import socket
+import time
 
 # project
+from ottd_ctrl.capture import DIRECTION_RECEIVED, DIRECTION_SENT, CaptureRecorder
 from ottd_ctrl.const import PacketTypesStr
+from ottd_ctrl.dedup import DEFAULT_DEDUP_PACKET_TYPES, PacketDeduplicator
+from ottd_ctrl.dispatch import InboundQueue
+from ottd_ctrl.metrics import DEFAULT_BUCKETS_NS, ClientMetrics
+from ottd_ctrl.outbound import OutboundQueue
+from ottd_ctrl.profiler import DEFAULT_SLOW_THRESHOLD_S, DEFAULT_WARNING_INTERVAL_S, CallbackProfiler
 from ottd_ctrl import packet
 
 DEFAULT_SOCKET_TIMEOUT_S = 5
+# maximum number of packets read ahead from the socket when dispatching by priority
+PRIORITY_BATCH_SIZE = 256
 
 
 class CallbackPrepend:
@@ -29,17 +40,39 @@ class AdminClient:
     def __init__(self, server_host, server_port, timeout_s=None, callbacks=None):
         """
 
-        :param server_host: Admin server host
-        :param server_port: Admin server port
+        :param server_host: Admin server host, or path of a Unix socket if server_port is None
+        :param server_port: Admin server port, None to connect to a Unix socket (e.g. an AdminProxy)
         """
         self.host = server_host
         self.port = server_port
         self.timeout_s = timeout_s if timeout_s is not None else DEFAULT_SOCKET_TIMEOUT_S
         self.socket = None
         self.log = logging.getLogger("admin-client")
-        self.log.setLevel(logging.DEBUG)
         self.callbacks = defaultdict(list)
+        # {packet_type: {key: [callback, ...], ...}, ...} see register_keyed_callback()
+        self.keyed_callbacks = defaultdict(dict)
         self.register_callbacks(callbacks or {})
+        # drops unchanged packets before decoding, see enable_deduplication()
+        self.deduplicator = None
+        # received packets waiting to be dispatched, see enable_priority_dispatch()
+        self.inbound_queue = None
+        # set when the peer closed the connection while reading ahead
+        self._closed_by_peer = False
+        # packets waiting to be sent, see enable_outbound_scheduler()
+        self.outbound_queue = None
+        # see set_socket_options()
+        self.nonblocking = False
+        self.tcp_nodelay = None
+        self.send_buffer_size = None
+        self.receive_buffer_size = None
+        # bytes not yet accepted by a non-blocking socket
+        self._send_buffer = bytearray()
+        # records sent and received raw packets, see start_capture()
+        self.recorder = None
+        # per packet type counters and histograms, see enable_metrics()
+        self.metrics = None
+        # callback execution times, see enable_profiling()
+        self.profiler = None
 
     def register_callbacks(self, callbacks, position=CallbackAppend):
         """
@@ -58,16 +91,163 @@ class AdminClient:
         :param callback: A callable with a packet as only argument
         :param position: An integer or one of CallbackAppend, CallbackPrepend
         """
+        self.callbacks[packet_type] = self._insert_callback(self.callbacks[packet_type], callback, position)
+
+    def register_keyed_callback(self, packet_type, key, callback, position=CallbackAppend):
+        """
+        Registers callbacks for packets of given type about a given client or company,
+        these are called after the callbacks registered with register_callback()
+        :param packet_type: A PacketType const.PacketTypes, its packet class must have a key_field
+        :param key: Value of the key field (client_id or company_id)
+        :param callback: A callable with a packet as only argument
+        :param position: An integer or one of CallbackAppend, CallbackPrepend
+        """
+        class_ = packet.packet_map.get(packet_type)
+        if class_ is None or getattr(class_, 'key_field', None) is None:
+            raise Exception('Packet type %s has no key field' % PacketTypesStr.get(packet_type, packet_type))
+        by_key = self.keyed_callbacks[packet_type]
+        by_key[key] = self._insert_callback(by_key.get(key, []), callback, position)
+
+    @staticmethod
+    def _insert_callback(callbacks, callback, position):
+        """Returns a new list with callback (or sequence of callbacks) inserted at position"""
         if position is CallbackAppend:
-            position = len(self.callbacks[packet_type])
+            position = len(callbacks)
         elif position is CallbackPrepend:
             position = 0
         if isinstance(callback, (tuple, list)):
-            self.callbacks[packet_type] = (self.callbacks[packet_type][:position] +
-                                           list(callback) +
-                                           self.callbacks[packet_type][position:])
+            return callbacks[:position] + list(callback) + callbacks[position:]
+        callbacks = list(callbacks)
+        callbacks.insert(position, callback)
+        return callbacks
+
+    def enable_deduplication(self, packet_types=DEFAULT_DEDUP_PACKET_TYPES, use_hash=False):
+        """
+        Received packets with the same payload as the previous one of the same type
+        and for the same client or company are dropped before being decoded,
+        receive_packet() returns None for these
+        :param packet_types: Packet types to deduplicate
+        :param use_hash: If True only payload hashes are kept
+        """
+        self.deduplicator = PacketDeduplicator(packet_types, use_hash)
+
+    def enable_priority_dispatch(self, priorities=None):
+        """
+        Packets available on the socket are read ahead and dispatched by priority,
+        control packets (pong, rcon, errors...) are dispatched before bulk packets (console...)
+        :param priorities: {packet_type: dispatch.PacketPriority, ...}
+        """
+        self.inbound_queue = InboundQueue(priorities)
+
+    def enable_outbound_scheduler(self, priorities=None, rates=None):
+        """
+        Sent packets are queued by priority class and sent according to per class rate limits,
+        queued packets are sent by flush_outbound()
+        :param priorities: {packet_type: outbound.OutboundPriority, ...}
+        :param rates: {outbound.OutboundPriority: (packets per second, burst) or None, ...}
+        """
+        self.outbound_queue = OutboundQueue(priorities, rates)
+
+    def enable_metrics(self, buckets=DEFAULT_BUCKETS_NS):
+        """
+        Records per packet type and direction counts, bytes, encode/decode times
+        and callback times, see metrics.ClientMetrics
+        :param buckets: Upper bounds of the histogram buckets, in nanoseconds
+        """
+        if self.metrics is None:
+            self.metrics = ClientMetrics(buckets)
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def enable_profiling(self, slow_threshold_s=DEFAULT_SLOW_THRESHOLD_S,
+                         warning_interval_s=DEFAULT_WARNING_INTERVAL_S):
+        """
+        Times every callback, see profiler.CallbackProfiler, e.g. print(client.profiler.report())
+        :param slow_threshold_s: Callbacks running longer are logged as slow
+        :param warning_interval_s: Minimum interval between two warnings for the same callback
+        """
+        self.profiler = CallbackProfiler(slow_threshold_s, warning_interval_s)
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def start_capture(self, path_prefix, compression=None, **kwargs):
+        """
+        Records all raw packets sent and received to capture files
+        :param path_prefix: Capture segments are written to <path_prefix>-<number>.cap
+        :param compression: None, 'zlib' or 'lzma'
+        :param kwargs: Other capture.CaptureRecorder parameters
+        """
+        self.stop_capture()
+        self.recorder = CaptureRecorder(path_prefix, compression, **kwargs)
+
+    def stop_capture(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def set_socket_options(self, nonblocking=False, tcp_nodelay=None,
+                           send_buffer_size=None, receive_buffer_size=None):
+        """
+        Sets options applied to the socket when connecting
+        :param nonblocking: If True the socket is non-blocking, data which cannot be sent
+                            right away is buffered and sent when the socket is writable
+        :param tcp_nodelay: If not None, value of the TCP_NODELAY option
+        :param send_buffer_size: If not None, value of the SO_SNDBUF option
+        :param receive_buffer_size: If not None, value of the SO_RCVBUF option
+        """
+        self.nonblocking = nonblocking
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+        if self.socket is not None:
+            self._apply_socket_options()
+
+    def _apply_socket_options(self):
+        if self.tcp_nodelay is not None and self.socket.family in (socket.AF_INET, socket.AF_INET6):
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.tcp_nodelay))
+        if self.send_buffer_size is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+        if self.receive_buffer_size is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+        if self.nonblocking:
+            self.socket.setblocking(False)
         else:
-            self.callbacks[packet_type].insert(position, callback)
+            self.socket.settimeout(self.timeout_s)
+
+    def has_unsent_data(self):
+        """Returns True if data is waiting for the non-blocking socket to be writable"""
+        return len(self._send_buffer) > 0
+
+    def has_pending_packets(self):
+        """Returns True if received packets are waiting to be dispatched"""
+        return self.inbound_queue is not None and len(self.inbound_queue) > 0
+
+    def unregister_callback(self, packet_type, callback):
+        """
+        Unregisters a callback for a given packet type
+        :param packet_type: A PacketType const.PacketTypes
+        :param callback: A callable previously registered for this packet type
+        """
+        self.callbacks[packet_type].remove(callback)
+
+    def unregister_keyed_callback(self, packet_type, key, callback):
+        """
+        Unregisters a callback for a given packet type and key
+        :param packet_type: A PacketType const.PacketTypes
+        :param key: Value of the key field given to register_keyed_callback()
+        :param callback: A callable previously registered for this packet type and key
+        """
+        by_key = self.keyed_callbacks.get(packet_type, {})
+        # ValueError as for unregister_callback() if not registered
+        by_key.get(key, []).remove(callback)
+        if len(by_key[key]) == 0:
+            del by_key[key]
+        if len(by_key) == 0:
+            del self.keyed_callbacks[packet_type]
 
     @property
     def is_connected(self):
@@ -82,11 +262,32 @@ class AdminClient:
             self.disconnect()
 
     def connect(self):
+        if self.port is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(self.timeout_s)
+            try:
+                self.socket.connect(self.host)
+            except OSError:
+                self.socket.close()
+                self.socket = None
+                raise
+            self._apply_socket_options()
+            self.log.info("Connected to %s", self.host)
+            return
         self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout_s)
+        self._apply_socket_options()
         self.log.info("Connected to %s:%s", self.host, self.port)
 
     def disconnect(self):
         if self.socket is not None:
+            if self.has_unsent_data():
+                # e.g. the quit packet, we wait for it to be sent
+                try:
+                    self.socket.settimeout(self.timeout_s)
+                    self.socket.sendall(self._send_buffer)
+                except OSError as e:
+                    self.log.error('Sending buffered data: %s', e)
+            self._send_buffer.clear()
             try:
                 # if the server already disconnected we have Errno 107
                 self.socket.shutdown(socket.SHUT_RDWR)
@@ -95,16 +296,140 @@ class AdminClient:
             self.socket.close()
             self.socket = None
             self.log.info("Disconnected")
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.outbound_queue is not None and len(self.outbound_queue) > 0:
+            self.log.warning('Dropped %s packets not sent', self.outbound_queue.clear())
+        if self.deduplicator is not None:
+            # the server sends everything again to a new connection
+            self.deduplicator.reset()
 
     def send_packet(self, pkt):
-        self.log.debug('Sending %s', str(pkt))
+        # the packet is only formatted if the record is emitted
+        self.log.debug('Sending %s', pkt)
+        if self.socket is None:
+            raise Exception("Cannot send if not connected")
+        if self.outbound_queue is not None:
+            self.outbound_queue.push(pkt)
+            self.flush_outbound()
+        else:
+            # TODO handle socket errors
+            self._send_raw(self._encode_packets([pkt]))
+
+    def send_packets(self, pkts):
+        """Sends given packets in a single write"""
+        if self.log.isEnabledFor(logging.DEBUG):
+            for pkt in pkts:
+                self.log.debug('Sending %s', pkt)
+        if self.socket is None:
+            raise Exception("Cannot send if not connected")
+        if self.outbound_queue is not None:
+            for pkt in pkts:
+                self.outbound_queue.push(pkt)
+            self.flush_outbound()
+        else:
+            self._send_raw(self._encode_packets(pkts))
+
+    def flush_outbound(self):
+        """
+        Sends the queued packets allowed by the rate limits,
+        returns the number of seconds until the next queued packet can be sent.
+        Not connected, the packets stay queued until disconnect() drops them
+        """
+        if self.outbound_queue is None or self.socket is None:
+            return math.inf
+        pkts = self.outbound_queue.pop_ready()
+        if pkts:
+            self._send_raw(self._encode_packets(pkts))
+        return self.outbound_queue.time_until_ready()
+
+    def _encode_packets(self, pkts):
+        """Returns the concatenated raw packets"""
+        if self.metrics is None:
+            return b''.join(pkt.encoded() for pkt in pkts)
+        res = []
+        for pkt in pkts:
+            start_ns = time.perf_counter_ns()
+            raw_data = pkt.encoded()
+            self.metrics.on_sent(pkt.type_, len(raw_data), time.perf_counter_ns() - start_ns)
+            res.append(raw_data)
+        return b''.join(res)
+
+    def send_frame(self, raw_data):
+        """Sends an already encoded packet as is, e.g. a forwarded one, the outbound queue is bypassed"""
         if self.socket is None:
             raise Exception("Cannot send if not connected")
-        # TODO handle socket errors
-        self.socket.sendall(pkt.encoded())
+        self._send_raw(raw_data)
+
+    def _send_raw(self, data):
+        if self.recorder is not None:
+            self.recorder.record(DIRECTION_SENT, data)
+        if self.nonblocking:
+            self._send_buffer += data
+            self._flush_send_buffer()
+        else:
+            self.socket.sendall(data)
+
+    def _flush_send_buffer(self):
+        """Sends as much buffered data as the non-blocking socket accepts"""
+        while self._send_buffer:
+            try:
+                nb_sent = self.socket.send(self._send_buffer)
+            except BlockingIOError:
+                break
+            del self._send_buffer[:nb_sent]
+
+    def _wait_io(self, timeout_s):
+        """
+        Waits until the socket is readable, sending buffered data meanwhile,
+        returns False if the socket is not readable after timeout_s
+        """
+        end_time = time.monotonic() + timeout_s
+        while True:
+            wlist = [self.socket] if self.has_unsent_data() else []
+            rlist, wlist, xlist = select([self.socket], wlist, [], max(0, end_time - time.monotonic()))
+            if len(wlist) > 0:
+                self._flush_send_buffer()
+            if len(rlist) > 0:
+                return True
+            if len(wlist) == 0:
+                return False
 
     def receive_packet(self):
         """Receives packet from network, calls registered callbacks"""
+        packet_size, raw_data = self.receive_frame()
+        return self.process_frame(packet_size, raw_data)
+
+    def receive_frame(self):
+        """Receives a packet from network without decoding it, returns its size and raw data"""
+        if self.inbound_queue is None:
+            return self._read_frame()
+        self._fill_inbound_queue()
+        return self.inbound_queue.pop()
+
+    def _fill_inbound_queue(self):
+        """Reads the packets available on the socket into the inbound queue"""
+        if len(self.inbound_queue) == 0:
+            if self._closed_by_peer:
+                # all packets received before the connection was closed have been dispatched
+                self._closed_by_peer = False
+                raise ConnectionClosedByPeer()
+            # waiting for at least one packet
+            self.inbound_queue.push(*self._read_frame())
+        nb_read = 0
+        while nb_read < PRIORITY_BATCH_SIZE and self.socket is not None:
+            rlist, wlist, xlist = select([self.socket], [], [], 0)
+            if len(rlist) == 0:
+                break
+            try:
+                self.inbound_queue.push(*self._read_frame())
+            except ConnectionClosedByPeer:
+                self._closed_by_peer = True
+                break
+            nb_read += 1
+
+    def _read_frame(self):
+        """Reads a packet from network, returns its size and raw data (including size bytes)"""
         if self.socket is None:
             raise Exception("Cannot receive if not connected")
         # reading packet size
@@ -114,21 +439,61 @@ class AdminClient:
             # reading bytes from socket
             raw_data = raw_size + self._read_bytes(packet_size - packet.size_len)
         except ConnectionClosedByPeer:
+            self.socket.close()
             self.socket = None
             raise
-        # getting packet
-        pkt = packet.ServerPacket.decode(packet_size, raw_data)
+        if self.recorder is not None:
+            self.recorder.record(DIRECTION_RECEIVED, raw_data)
+        return packet_size, raw_data
+
+    def process_frame(self, packet_size, raw_data):
+        """
+        Decodes a raw packet and calls registered callbacks, returns the packet
+        or None if the packet has been dropped as duplicate
+        """
+        if self.metrics is not None:
+            return self._process_frame_measured(packet_size, raw_data)
+        pkt = self.decode_frame(packet_size, raw_data)
+        if pkt is not None:
+            self.dispatch_packet(pkt)
+        return pkt
+
+    def _process_frame_measured(self, packet_size, raw_data):
+        """process_frame() feeding the metrics"""
+        start_ns = time.perf_counter_ns()
+        pkt = self.decode_frame(packet_size, raw_data)
+        decoded_ns = time.perf_counter_ns()
+        callbacks_ns = None
+        if pkt is not None:
+            self.dispatch_packet(pkt)
+            callbacks_ns = time.perf_counter_ns() - decoded_ns
+        self.metrics.on_received(raw_data[packet.size_len], packet_size, decoded_ns - start_ns, callbacks_ns)
+        return pkt
+
+    def decode_frame(self, packet_size, raw_data):
+        """Returns the packet decoded from raw data, None if it has been dropped as duplicate"""
+        if self.deduplicator is not None:
+            payload = raw_data[packet.size_len + packet.type_len:packet_size]
+            if self.deduplicator.is_duplicate(raw_data[packet.size_len], payload):
+                return None
+        return packet.ServerPacket.decode(packet_size, raw_data)
+
+    def dispatch_packet(self, pkt):
+        """Calls the callbacks registered for given packet"""
         # calling generic callbacks (for all received packets)
         generic_callbacks = self.callbacks.get(None, [])
         for cb in generic_callbacks:
             self._call_callback(cb, pkt)
         # callbacks for specific packet
         callbacks = self.callbacks.get(pkt.type_, [])
-        if len(callbacks) == 0:
+        # callbacks for specific packet and client or company, looked up by key
+        keyed_callbacks = self.keyed_callbacks.get(pkt.type_)
+        if keyed_callbacks:
+            callbacks = callbacks + keyed_callbacks.get(getattr(pkt, pkt.key_field), [])
+        elif len(callbacks) == 0:
             self.log.warning('No callback for packet type %s', PacketTypesStr[pkt.type_])
         for cb in callbacks:
             self._call_callback(cb, pkt)
-        return pkt
 
     def _read_bytes(self, nb):
         """
@@ -136,7 +501,12 @@ class AdminClient:
         """
         res = b''
         while nb > 0:
-            recvd = self.socket.recv(nb)
+            try:
+                recvd = self.socket.recv(nb)
+            except BlockingIOError:
+                if not self._wait_io(self.timeout_s):
+                    raise socket.timeout('timed out')
+                continue
             if len(recvd) == 0:
                 # TODO investigate this case further
                 raise ConnectionClosedByPeer()
@@ -146,11 +516,19 @@ class AdminClient:
 
     def _call_callback(self, cb, *args, **kwargs):
         """Calls callback"""
+        profiler = self.profiler
+        if profiler is not None:
+            start_ns = time.perf_counter_ns()
         try:
             cb(*args, **kwargs)
         except Exception as e:
+            if self.metrics is not None:
+                self.metrics.on_callback_error()
             args_str = ','.join(repr(a) for a in args)
             kwargs_str = ','.join('{}={}'.format(k, repr(v)) for k, v in kwargs.items())
             args_kwargs_str = ','.join([e for e in (args_str, kwargs_str) if e != ''])
             cb_str = '{}({})'.format(cb.__name__, args_kwargs_str)
             self.log.exception('Error while executing callback %s', cb_str)
+        if profiler is not None:
+            profiler.record(cb, getattr(args[0], 'type_', None) if args else None,
+                            time.perf_counter_ns() - start_ns)
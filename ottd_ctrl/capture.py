@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Capture of the raw admin traffic
+
+A capture is made of segment files named <prefix>-<number>.cap, each segment
+starts with a header (magic, compression, wall clock and monotonic start times)
+followed by the records, compressed as a single stream if compression is used.
+A record is a direction byte, a monotonic timestamp in nanoseconds, the data size
+and the data, which is one or more packets as sent over the wire.
+"""
+
+# standard library
+import glob
+import logging
+import lzma
+import re
+from struct import Struct
+import time
+import zlib
+
+MAGIC = b'OTTDCAP1'
+SEGMENT_SUFFIX = '.cap'
+# what follows the prefix in the name of a segment, other files are ignored
+SEGMENT_NAME_RE = re.compile(r'-(\d{6,})' + re.escape(SEGMENT_SUFFIX))
+
+DIRECTION_RECEIVED = 0
+DIRECTION_SENT = 1
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+COMPRESSIONS = {None: COMPRESSION_NONE, 'zlib': COMPRESSION_ZLIB, 'lzma': COMPRESSION_LZMA}
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# magic, compression, wall clock start time (ns), monotonic start time (ns)
+header_fmt = Struct('<8sBQQ')
+# direction, monotonic timestamp (ns), data size
+record_fmt = Struct('<BQI')
+
+
+class CaptureError(Exception):
+    pass
+
+
+class CaptureRecorder:
+    def __init__(self, path_prefix, compression=None,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_segment_size=DEFAULT_MAX_SEGMENT_SIZE):
+        """
+        Appends raw packets to segmented capture files
+        :param path_prefix: Segments are written to <path_prefix>-<number>.cap
+        :param compression: None, 'zlib' or 'lzma', the records of an lzma segment can only be read
+                            once the segment is closed, flush() makes the other ones readable
+        :param buffer_size: Records are written once this many bytes are buffered
+        :param max_segment_size: A new segment is started once this many (uncompressed) bytes are written
+        """
+        if compression not in COMPRESSIONS:
+            raise CaptureError('Unknown compression %s' % compression)
+        self.path_prefix = path_prefix
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.max_segment_size = max_segment_size
+        self.log = logging.getLogger('capture')
+        self.nb_records = 0
+        self._buffer = bytearray()
+        self._file = None
+        self._compressor = None
+        self._segment_size = 0
+        self._segment_number = self._last_segment_number() + 1
+
+    def _last_segment_number(self):
+        segments = numbered_segment_paths(self.path_prefix)
+        return segments[-1][0] if segments else -1
+
+    def _open_segment(self):
+        path = '{}-{:06d}{}'.format(self.path_prefix, self._segment_number, SEGMENT_SUFFIX)
+        self._segment_number += 1
+        self._file = open(path, 'xb')
+        self._file.write(header_fmt.pack(MAGIC, COMPRESSIONS[self.compression],
+                                         time.time_ns(), time.monotonic_ns()))
+        if self.compression == 'zlib':
+            self._compressor = zlib.compressobj()
+        elif self.compression == 'lzma':
+            self._compressor = lzma.LZMACompressor()
+        self._segment_size = 0
+        self.log.debug('Capturing to %s', path)
+
+    def record(self, direction, data):
+        """Buffers a record, data is one or more raw packets"""
+        self._buffer += record_fmt.pack(direction, time.monotonic_ns(), len(data))
+        self._buffer += data
+        self.nb_records += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered records, an lzma compressor keeps them until the segment is closed"""
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._open_segment()
+        self._segment_size += len(self._buffer)
+        if self.compression == 'zlib':
+            # the records written so far can be decompressed, e.g. after a crash
+            self._file.write(self._compressor.compress(bytes(self._buffer)) +
+                             self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        elif self._compressor is not None:
+            self._file.write(self._compressor.compress(bytes(self._buffer)))
+        else:
+            self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+        if self._segment_size >= self.max_segment_size:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._close_segment()
+
+
+def numbered_segment_paths(path_prefix):
+    """Returns [(number, path), ...] of the segments of a capture, in order"""
+    pattern = glob.escape(path_prefix) + '-[0-9]*' + SEGMENT_SUFFIX
+    segments = []
+    for path in glob.glob(pattern):
+        match = SEGMENT_NAME_RE.fullmatch(path[len(path_prefix):])
+        if match is not None:
+            segments.append((int(match.group(1)), path))
+    return sorted(segments)
+
+
+def segment_paths(path_prefix):
+    """Returns the paths of the segments of a capture, in order"""
+    return [path for _, path in numbered_segment_paths(path_prefix)]
+
+
+def segment_data(buffer):
+    """
+    Returns (header, records data) of a segment given its content,
+    header is (compression, wall clock start ns, monotonic start ns),
+    records data is a bytes-like object (decompressed if needed)
+    """
+    if len(buffer) < header_fmt.size:
+        raise CaptureError('Segment too short')
+    magic, compression, wall_start_ns, monotonic_start_ns = header_fmt.unpack_from(buffer)
+    if magic != MAGIC:
+        raise CaptureError('Not a capture segment')
+    data = memoryview(buffer)[header_fmt.size:]
+    if compression == COMPRESSION_ZLIB:
+        data = zlib.decompressobj().decompress(data)
+    elif compression == COMPRESSION_LZMA:
+        data = lzma.LZMADecompressor().decompress(data)
+    elif compression != COMPRESSION_NONE:
+        raise CaptureError('Unknown compression %s' % compression)
+    return (compression, wall_start_ns, monotonic_start_ns), data
+
+
+def iter_records(data):
+    """
+    Yields (direction, monotonic timestamp ns, data) for the records in given records data,
+    a truncated last record (e.g. capture still being written) is ignored
+    """
+    index = 0
+    end = len(data)
+    while index + record_fmt.size <= end:
+        direction, timestamp_ns, size = record_fmt.unpack_from(data, index)
+        index += record_fmt.size
+        if index + size > end:
+            break
+        yield direction, timestamp_ns, bytes(data[index:index + size])
+        index += size
+
+
+def read_capture(path_prefix):
+    """Yields (direction, monotonic timestamp ns, data) for all the records of a capture"""
+    for path in segment_paths(path_prefix):
+        with open(path, 'rb') as f:
+            header, data = segment_data(f.read())
+        yield from iter_records(data)
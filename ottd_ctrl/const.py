@@ -164,3 +164,38 @@ AdminCompanyRemoveReasonStr = enum_str(AdminCompanyRemoveReason)
 NetworkVehicleTypeStr = enum_str(NetworkVehicleType)
 PacketTypesStr = enum_str(PacketTypes)
 
+
+# Update type an admin must register a frequency for to receive a given server packet
+PacketUpdateTypes = {
+    PacketTypes.ADMIN_PACKET_SERVER_DATE:           AdminUpdateType.ADMIN_UPDATE_DATE,
+    PacketTypes.ADMIN_PACKET_SERVER_CLIENT_JOIN:    AdminUpdateType.ADMIN_UPDATE_CLIENT_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_CLIENT_INFO:    AdminUpdateType.ADMIN_UPDATE_CLIENT_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_CLIENT_UPDATE:  AdminUpdateType.ADMIN_UPDATE_CLIENT_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_CLIENT_QUIT:    AdminUpdateType.ADMIN_UPDATE_CLIENT_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_CLIENT_ERROR:   AdminUpdateType.ADMIN_UPDATE_CLIENT_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_NEW:    AdminUpdateType.ADMIN_UPDATE_COMPANY_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_INFO:   AdminUpdateType.ADMIN_UPDATE_COMPANY_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_UPDATE: AdminUpdateType.ADMIN_UPDATE_COMPANY_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_REMOVE: AdminUpdateType.ADMIN_UPDATE_COMPANY_INFO,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_ECONOMY: AdminUpdateType.ADMIN_UPDATE_COMPANY_ECONOMY,
+    PacketTypes.ADMIN_PACKET_SERVER_COMPANY_STATS:  AdminUpdateType.ADMIN_UPDATE_COMPANY_STATS,
+    PacketTypes.ADMIN_PACKET_SERVER_CHAT:           AdminUpdateType.ADMIN_UPDATE_CHAT,
+    PacketTypes.ADMIN_PACKET_SERVER_CONSOLE:        AdminUpdateType.ADMIN_UPDATE_CONSOLE,
+    PacketTypes.ADMIN_PACKET_SERVER_CMD_NAMES:      AdminUpdateType.ADMIN_UPDATE_CMD_NAMES,
+    PacketTypes.ADMIN_PACKET_SERVER_CMD_LOGGING:    AdminUpdateType.ADMIN_UPDATE_CMD_LOGGING,
+    PacketTypes.ADMIN_PACKET_SERVER_GAMESCRIPT:     AdminUpdateType.ADMIN_UPDATE_GAMESCRIPT,
+}
+
+
+def date_update_frequencies(date):
+    """Returns the AdminUpdateFrequency flags of the periodic updates sent when the game reaches date"""
+    frequencies = AdminUpdateFrequency.ADMIN_FREQUENCY_DAILY
+    if date.weekday() == 0:
+        frequencies |= AdminUpdateFrequency.ADMIN_FREQUENCY_WEEKLY
+    if date.day == 1:
+        frequencies |= AdminUpdateFrequency.ADMIN_FREQUENCY_MONTHLY
+        if date.month % 3 == 1:
+            frequencies |= AdminUpdateFrequency.ADMIN_FREQUENCY_QUARTERLY
+        if date.month == 1:
+            frequencies |= AdminUpdateFrequency.ADMIN_FREQUENCY_ANUALLY
+    return frequencies
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from collections import defaultdict
+
+# project
+from ottd_ctrl.const import PacketTypes as PT, PacketTypesStr
+from ottd_ctrl.packet import packet_map
+
+# packet types often repeating identical payloads
+DEFAULT_DEDUP_PACKET_TYPES = (
+    PT.ADMIN_PACKET_SERVER_CLIENT_INFO,
+    PT.ADMIN_PACKET_SERVER_CLIENT_UPDATE,
+    PT.ADMIN_PACKET_SERVER_COMPANY_INFO,
+    PT.ADMIN_PACKET_SERVER_COMPANY_UPDATE,
+    PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY,
+    PT.ADMIN_PACKET_SERVER_COMPANY_STATS,
+)
+
+
+class PacketDeduplicator:
+    def __init__(self, packet_types=DEFAULT_DEDUP_PACKET_TYPES, use_hash=False):
+        """
+        Detects packets whose payload did not change since the last packet
+        of the same type about the same client or company, before decoding them
+        :param packet_types: Packet types to deduplicate, their class must have a key_field
+        :param use_hash: If True only the hash of the last payloads is kept instead of the bytes
+        """
+        # {packet_type: size of the key field}
+        self._key_sizes = {}
+        for packet_type in packet_types:
+            key_type = packet_map[packet_type].key_type()
+            if key_type is None:
+                raise Exception('Packet type %s has no key field' % PacketTypesStr[packet_type])
+            self._key_sizes[packet_type] = key_type.struct.size
+        self.use_hash = use_hash
+        # {(packet_type, raw key): payload or hash of payload}
+        self._last_payloads = {}
+        # per packet type counters
+        self.nb_received = defaultdict(int)
+        self.nb_dropped = defaultdict(int)
+
+    def is_duplicate(self, packet_type, payload):
+        """
+        Returns True if payload is the same as the last one received for the same entity
+        :param packet_type: A const.PacketTypes
+        :param payload: Raw packet data without size and type
+        """
+        key_size = self._key_sizes.get(packet_type)
+        if key_size is None:
+            return False
+        self.nb_received[packet_type] += 1
+        key = (packet_type, payload[:key_size])
+        value = hash(payload) if self.use_hash else payload
+        if self._last_payloads.get(key) == value:
+            self.nb_dropped[packet_type] += 1
+            return True
+        self._last_payloads[key] = value
+        return False
+
+    def forget(self, key_field, key_value):
+        """Forgets the last payloads about a client or a company, e.g. when it is removed"""
+        for packet_type in self._key_sizes:
+            class_ = packet_map[packet_type]
+            if class_.key_field == key_field:
+                raw_key = class_.key_type()(value=key_value).raw_data
+                self._last_payloads.pop((packet_type, raw_key), None)
+
+    def reset(self):
+        """Forgets all the last payloads, e.g. on new game"""
+        self._last_payloads.clear()
+
+    def hit_rate(self, packet_type):
+        """Returns the ratio of dropped packets for given type"""
+        nb_received = self.nb_received.get(packet_type, 0)
+        return self.nb_dropped.get(packet_type, 0) / nb_received if nb_received else 0.0
+
+    def stats(self):
+        """Returns {packet type name: {'received': x, 'dropped': y, 'hit_rate': z}, ...}"""
+        return {PacketTypesStr[packet_type]: {'received': nb_received,
+                                              'dropped': self.nb_dropped[packet_type],
+                                              'hit_rate': self.hit_rate(packet_type)}
+                for packet_type, nb_received in self.nb_received.items()}
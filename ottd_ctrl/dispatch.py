@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from collections import deque
+import time
+
+# project
+from ottd_ctrl.const import PacketTypes as PT, enum_str
+from ottd_ctrl.packet import size_len
+
+
+class PacketPriority:
+    CONTROL = 0     # replies to our requests and connection state, never wait behind other packets
+    STATE = 1       # game state updates
+    BULK = 2        # high volume, low value packets
+
+
+PacketPriorityStr = enum_str(PacketPriority)
+
+# packet types not listed here have the STATE priority, e.g. NEWGAME and SHUTDOWN
+# which must not overtake the state updates of the game they end
+DEFAULT_PACKET_PRIORITIES = {
+    PT.ADMIN_PACKET_SERVER_FULL:        PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_BANNED:      PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_ERROR:       PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_PROTOCOL:    PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_WELCOME:     PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_RCON:        PacketPriority.CONTROL,  # same class as RCON_END to keep order
+    PT.ADMIN_PACKET_SERVER_RCON_END:    PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_PONG:        PacketPriority.CONTROL,
+    PT.ADMIN_PACKET_SERVER_CONSOLE:     PacketPriority.BULK,
+    PT.ADMIN_PACKET_SERVER_CMD_NAMES:   PacketPriority.BULK,
+    PT.ADMIN_PACKET_SERVER_CMD_LOGGING: PacketPriority.BULK,
+    PT.ADMIN_PACKET_SERVER_GAMESCRIPT:  PacketPriority.BULK,
+}
+
+
+class QueueWaitStats:
+    """Time spent by packets in the inbound queue"""
+    def __init__(self):
+        self.count = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def add(self, wait_s):
+        self.count += 1
+        self.total_wait_s += wait_s
+        if wait_s > self.max_wait_s:
+            self.max_wait_s = wait_s
+
+    @property
+    def mean_wait_s(self):
+        return self.total_wait_s / self.count if self.count else 0.0
+
+
+class InboundQueue:
+    def __init__(self, priorities=None, clock=time.monotonic):
+        """
+        Received raw packets waiting to be dispatched, by priority,
+        packets of the same priority are dispatched in arrival order
+        :param priorities: {packet_type: PacketPriority, ...}, defaults to DEFAULT_PACKET_PRIORITIES
+        :param clock: A callable returning the current time in seconds
+        """
+        self.priorities = priorities if priorities is not None else DEFAULT_PACKET_PRIORITIES
+        self.clock = clock
+        nb_priorities = len(PacketPriorityStr)
+        self._queues = [deque() for _ in range(nb_priorities)]
+        self.wait_stats = [QueueWaitStats() for _ in range(nb_priorities)]
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    def push(self, packet_size, raw_data):
+        priority = self.priorities.get(raw_data[size_len], PacketPriority.STATE)
+        self._queues[priority].append((self.clock(), packet_size, raw_data))
+
+    def pop(self):
+        """Returns (packet_size, raw_data) of the oldest packet with the highest priority"""
+        for priority, queue in enumerate(self._queues):
+            if queue:
+                enqueue_time, packet_size, raw_data = queue.popleft()
+                self.wait_stats[priority].add(self.clock() - enqueue_time)
+                return packet_size, raw_data
+        raise IndexError('pop from an empty InboundQueue')
+
+    def stats(self):
+        """Returns {priority name: {'count': x, 'mean_wait_s': y, 'max_wait_s': z, 'queued': n}, ...}"""
+        return {PacketPriorityStr[priority]: {'count': stats.count,
+                                              'mean_wait_s': stats.mean_wait_s,
+                                              'max_wait_s': stats.max_wait_s,
+                                              'queued': len(self._queues[priority])}
+                for priority, stats in enumerate(self.wait_stats)}
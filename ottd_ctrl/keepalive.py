@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import logging
+import math
+import time
+
+# project
+from ottd_ctrl.metrics import Histogram
+from ottd_ctrl.packet import AdminPingPacket
+
+DEFAULT_PING_INTERVAL_S = 10
+DEFAULT_PONG_TIMEOUT_S = 30
+# weight of the last round trip time in the moving average
+DEFAULT_RTT_ALPHA = 0.2
+# pings without pong kept to compute round trip times, the oldest ones are forgotten
+MAX_PENDING_PINGS = 64
+
+
+class PingMonitor:
+    def __init__(self, send_packet, interval_s=None,
+                 timeout_s=DEFAULT_PONG_TIMEOUT_S,
+                 alpha=DEFAULT_RTT_ALPHA,
+                 clock=time.perf_counter):
+        """
+        Sends pings numbered in their data field, computes round trip times from the pongs
+        and detects connections which stopped answering
+        :param send_packet: A callable sending a packet
+        :param interval_s: Interval between pings sent by run(), None to only send pings with send_ping()
+        :param timeout_s: A ping without pong after this time means the connection is lost
+        :param alpha: Weight of the last round trip time in rtt_ewma_s
+        :param clock: A callable returning the current time in seconds
+        """
+        self.send_packet = send_packet
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.alpha = alpha
+        self.clock = clock
+        self.log = logging.getLogger('keepalive')
+        # round trip time of the last pong
+        self.rtt_s = None
+        # exponentially weighted moving average of the round trip times
+        self.rtt_ewma_s = None
+        self.rtt_ns = Histogram()
+        self.nb_sent = 0
+        self.nb_received = 0
+        self.nb_timeouts = 0
+        # {ping data: time sent, ...} in sending order
+        self._pending = {}
+        self._next_data = 0
+        self._next_ping_time = None
+
+    def reset(self):
+        """Forgets pings in flight, e.g. on a new connection, the next ping is sent by run() right away"""
+        self._pending.clear()
+        self._next_ping_time = None
+
+    def send_ping(self):
+        """Sends a ping, returns its data"""
+        data = self._next_data
+        self._next_data = (data + 1) & 0xFFFFFFFF
+        if len(self._pending) >= MAX_PENDING_PINGS:
+            del self._pending[next(iter(self._pending))]
+        self._pending[data] = self.clock()
+        self.nb_sent += 1
+        self.send_packet(AdminPingPacket(data=data))
+        return data
+
+    def on_pong(self, data):
+        """Returns the round trip time of the ping, None if the ping is unknown"""
+        sent_time = self._pending.pop(data, None)
+        if sent_time is None:
+            self.log.warning('Received unexpected pong %s', data)
+            return None
+        # pings sent before this one are answered in order, their pong will not come
+        for older in [d for d, t in self._pending.items() if t < sent_time]:
+            del self._pending[older]
+        self.nb_received += 1
+        self.rtt_s = self.clock() - sent_time
+        self.rtt_ewma_s = self.rtt_s if self.rtt_ewma_s is None else \
+            self.alpha * self.rtt_s + (1 - self.alpha) * self.rtt_ewma_s
+        self.rtt_ns.observe(int(self.rtt_s * 1e9))
+        return self.rtt_s
+
+    @property
+    def nb_pending(self):
+        return len(self._pending)
+
+    def oldest_pending_age_s(self):
+        """Returns the time since the oldest ping without pong was sent, None if all pings were answered"""
+        if not self._pending:
+            return None
+        return self.clock() - next(iter(self._pending.values()))
+
+    def timed_out(self):
+        """Returns True if a ping has not been answered within timeout_s"""
+        age_s = self.oldest_pending_age_s()
+        return age_s is not None and age_s > self.timeout_s
+
+    def run(self):
+        """
+        Sends a ping if due, returns the number of seconds until the next ping or pong deadline,
+        math.inf if pings are not sent periodically
+        """
+        if self.interval_s is None:
+            return math.inf
+        now = self.clock()
+        if self._next_ping_time is None or self._next_ping_time <= now:
+            self.send_ping()
+            self._next_ping_time = now + self.interval_s
+        res = self._next_ping_time - now
+        age_s = self.oldest_pending_age_s()
+        if age_s is not None:
+            res = min(res, max(0, self.timeout_s - age_s))
+        return res
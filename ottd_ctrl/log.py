@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Moves log formatting and I/O off the receive loop
+
+    listener = start_background_logging()
+    ...
+    stop_background_logging(listener)
+
+The handlers of the logger (root logger by default) are moved to a QueueListener
+thread, log calls then only enqueue their record.
+"""
+
+# standard library
+import copy
+from datetime import date
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+
+# arguments which cannot change once logged, their formatting can be deferred
+IMMUTABLE_ARG_TYPES = (str, bytes, int, float, type(None), date)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A QueueHandler which does not format records with immutable arguments before enqueuing them,
+    their messages are formatted by the listener thread. Other arguments (e.g. packets, which the
+    session updates in place) are formatted right away, as the listener could see them modified
+    """
+    def prepare(self, record):
+        if record.exc_info or not _immutable_args(record.args):
+            # tracebacks are formatted right away too, they reference frames still in use
+            return super().prepare(record)
+        return copy.copy(record)
+
+
+def _immutable_args(args):
+    # a single mapping argument is kept as is by logging
+    return isinstance(args, tuple) and all(isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in args)
+
+
+def start_background_logging(logger=None, defer_formatting=True):
+    """
+    Replaces the handlers of logger by a queue handler, the handlers are run by a
+    QueueListener thread, returns the started listener
+    :param logger: A logging.Logger, defaults to the root logger
+    :param defer_formatting: If True messages are formatted by the listener thread,
+                             see DeferredQueueHandler
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    handlers = list(logger.handlers)
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = (DeferredQueueHandler if defer_formatting else QueueHandler)(log_queue)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.queue_handler = queue_handler
+    listener.start()
+    return listener
+
+
+def stop_background_logging(listener, logger=None):
+    """Handles the queued records and gives the handlers back to the logger"""
+    logger = logger if logger is not None else logging.getLogger()
+    listener.stop()
+    logger.removeHandler(listener.queue_handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation of an AdminClient, see AdminClient.enable_metrics()
+
+Counters are plain attributes incremented from the receive loop and histograms
+have fixed buckets, recording is a few integer additions without lock, readers
+use snapshot() which copies the current values.
+"""
+
+# standard library
+from bisect import bisect_left
+from collections import defaultdict
+
+# project
+from ottd_ctrl.const import PacketTypesStr
+
+RECEIVED = 'received'
+SENT = 'sent'
+
+# upper bounds (inclusive) of the histogram buckets in nanoseconds, from 1us to 1s,
+# the last bucket holds everything above
+DEFAULT_BUCKETS_NS = (
+    1000, 2000, 5000,
+    10000, 20000, 50000,
+    100000, 200000, 500000,
+    1000000, 2000000, 5000000,
+    10000000, 20000000, 50000000,
+    100000000, 200000000, 500000000,
+    1000000000,
+)
+
+
+class Histogram:
+    def __init__(self, bounds=DEFAULT_BUCKETS_NS):
+        """
+        Counts observed values in fixed buckets
+        :param bounds: Sorted upper bounds (inclusive) of the buckets
+        """
+        self.bounds = bounds
+        # one more bucket for the values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p-th percentile, None if empty or above all bounds"""
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        nb = 0
+        for index, count in enumerate(self.counts):
+            nb += count
+            if nb >= rank and count > 0:
+                return self.bounds[index] if index < len(self.bounds) else None
+        return None
+
+    def snapshot(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts), 'count': self.count, 'sum': self.sum}
+
+
+class PacketMetrics:
+    """Metrics of a packet type in a direction, codec is decode time if received, encode time if sent"""
+    def __init__(self, buckets):
+        self.count = 0
+        self.bytes = 0
+        # received packets dropped as duplicates, see AdminClient.enable_deduplication()
+        self.dropped = 0
+        self.codec_ns = Histogram(buckets)
+        self.callbacks_ns = Histogram(buckets)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'dropped': self.dropped,
+            'codec_ns': self.codec_ns.snapshot(),
+            'callbacks_ns': self.callbacks_ns.snapshot(),
+        }
+
+
+class ClientMetrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS_NS):
+        """
+        Per packet type and direction counts, bytes, codec and callback times of a client
+        :param buckets: Upper bounds of the histogram buckets, in nanoseconds
+        """
+        self.buckets = buckets
+        self.received = defaultdict(lambda: PacketMetrics(self.buckets))
+        self.sent = defaultdict(lambda: PacketMetrics(self.buckets))
+        self.callback_errors = 0
+        # callables called for every packet, e.g. to feed an external exporter,
+        # see add_observer()
+        self.observers = []
+
+    def add_observer(self, observer):
+        """
+        :param observer: A callable with (direction, packet_type, nb_bytes, codec_ns, callbacks_ns)
+                         arguments, callbacks_ns is None for sent and dropped packets
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def on_received(self, packet_type, nb_bytes, decode_ns, callbacks_ns):
+        """callbacks_ns is None if the packet has been dropped"""
+        metrics = self.received[packet_type]
+        metrics.count += 1
+        metrics.bytes += nb_bytes
+        metrics.codec_ns.observe(decode_ns)
+        if callbacks_ns is None:
+            metrics.dropped += 1
+        else:
+            metrics.callbacks_ns.observe(callbacks_ns)
+        for observer in self.observers:
+            observer(RECEIVED, packet_type, nb_bytes, decode_ns, callbacks_ns)
+
+    def on_sent(self, packet_type, nb_bytes, encode_ns):
+        metrics = self.sent[packet_type]
+        metrics.count += 1
+        metrics.bytes += nb_bytes
+        metrics.codec_ns.observe(encode_ns)
+        for observer in self.observers:
+            observer(SENT, packet_type, nb_bytes, encode_ns, None)
+
+    def on_callback_error(self):
+        self.callback_errors += 1
+
+    def reset(self):
+        self.received.clear()
+        self.sent.clear()
+        self.callback_errors = 0
+
+    def snapshot(self):
+        """Returns {'received': {packet type name: {...}, ...}, 'sent': {...}, 'callback_errors': x}"""
+        return {
+            RECEIVED: {PacketTypesStr.get(t, str(t)): m.snapshot() for t, m in list(self.received.items())},
+            SENT: {PacketTypesStr.get(t, str(t)): m.snapshot() for t, m in list(self.sent.items())},
+            'callback_errors': self.callback_errors,
+        }
@@ -0,0 +1,547 @@
+# -*- coding: utf-8 -*-
+
+"""
+A stand-in for the admin interface of an OpenTTD server, for tests and load tests
+
+The server answers JOIN, QUIT, UPDATE_FREQUENCY, POLL, CHAT, RCON and PING packets
+and can be scripted to emit scenarios (clients joining, console floods, fast dates,
+disconnections...), scenario methods can be called from any thread.
+
+    server = MockAdminServer(password='secret')
+    server.start()
+    server.add_clients(250)
+    server.set_game_speed(seconds_per_day=0.01)
+    ...
+    server.stop()
+"""
+
+# standard library
+from argparse import ArgumentParser
+from datetime import date, timedelta
+import logging
+import queue
+from select import select
+import socket
+import threading
+import time
+
+# project
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.const import NetworkErrorCode, PacketTypes as PT, PacketTypesStr, date_update_frequencies
+from ottd_ctrl.packet import ServerChatPacket, ServerClientInfoPacket, ServerClientJoinPacket
+from ottd_ctrl.packet import ServerClientQuitPacket, ServerCompanyEconomyPacket, ServerCompanyInfoPacket
+from ottd_ctrl.packet import ServerCompanyNewPacket, ServerCompanyStatsPacket, ServerConsolePacket
+from ottd_ctrl.packet import ServerDatePacket, ServerErrorPacket, ServerNewGamePacket, ServerPongPacket
+from ottd_ctrl.packet import ServerProtocolPacket, ServerRConEndPacket, ServerRConPacket
+from ottd_ctrl.packet import ServerShutdownPacket, ServerWelcomePacket
+from ottd_ctrl.packet import PacketDecodeError, decode_admin_packet, size_fmt, size_len, type_len
+from ottd_ctrl.poll import POLL_ALL
+from ottd_ctrl.protocol import FieldDecodeError
+
+PROTOCOL_VERSION = 1
+SERVER_CLIENT_ID = 1
+RECV_SIZE = 64 * 1024
+
+# src/network/network_admin.cpp _admin_update_type_frequencies
+DEFAULT_SUPPORTED_UPDATE_FREQS = {
+    AUT.ADMIN_UPDATE_DATE: (AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_DAILY | AUF.ADMIN_FREQUENCY_WEEKLY |
+                            AUF.ADMIN_FREQUENCY_MONTHLY | AUF.ADMIN_FREQUENCY_QUARTERLY |
+                            AUF.ADMIN_FREQUENCY_ANUALLY),
+    AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_AUTOMATIC,
+    AUT.ADMIN_UPDATE_COMPANY_INFO: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_AUTOMATIC,
+    AUT.ADMIN_UPDATE_COMPANY_ECONOMY: (AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_WEEKLY |
+                                       AUF.ADMIN_FREQUENCY_MONTHLY | AUF.ADMIN_FREQUENCY_QUARTERLY |
+                                       AUF.ADMIN_FREQUENCY_ANUALLY),
+    AUT.ADMIN_UPDATE_COMPANY_STATS: (AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_WEEKLY |
+                                     AUF.ADMIN_FREQUENCY_MONTHLY | AUF.ADMIN_FREQUENCY_QUARTERLY |
+                                     AUF.ADMIN_FREQUENCY_ANUALLY),
+    AUT.ADMIN_UPDATE_CHAT: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+    AUT.ADMIN_UPDATE_CONSOLE: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+    AUT.ADMIN_UPDATE_CMD_NAMES: AUF.ADMIN_FREQUENCY_POLL,
+    AUT.ADMIN_UPDATE_CMD_LOGGING: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+    AUT.ADMIN_UPDATE_GAMESCRIPT: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+}
+
+
+def default_rcon_handler(command):
+    """Returns the result lines of an rcon command"""
+    return ["Unknown command: '%s'" % command]
+
+
+class AdminConnection:
+    def __init__(self, sock, address):
+        """An admin connected to the mock server"""
+        self.socket = sock
+        self.socket.setblocking(False)
+        self.address = address
+        self.in_buffer = bytearray()
+        self.out_buffer = bytearray()
+        self.joined = False
+        self.name = None
+        # closed once the out buffer has been sent
+        self.closing = False
+        # {AdminUpdateType: AdminUpdateFrequency}
+        self.update_frequencies = {}
+
+    def send(self, data):
+        self.out_buffer += data
+
+    def subscribed(self, update_type, update_frequency):
+        return self.joined and self.update_frequencies.get(update_type, 0) & update_frequency
+
+    def frames(self):
+        """Yields the complete raw packets received, raises PacketDecodeError on a size shorter than a header"""
+        while len(self.in_buffer) >= size_len:
+            packet_size = size_fmt.unpack_from(self.in_buffer)[0]
+            if packet_size < size_len + type_len:
+                # the following bytes cannot be framed anymore
+                self.in_buffer.clear()
+                raise PacketDecodeError('invalid packet size %s' % packet_size)
+            if len(self.in_buffer) < packet_size:
+                break
+            raw_data = bytes(self.in_buffer[:packet_size])
+            del self.in_buffer[:packet_size]
+            yield raw_data
+
+
+class MockAdminServer:
+    def __init__(self, host='127.0.0.1', port=0, password='',
+                 server_name='Mock server',
+                 supported_update_freqs=None,
+                 start_date=date(1950, 1, 1),
+                 rcon_handler=default_rcon_handler):
+        """
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 for any free port, see address
+        :param password: Admin password
+        :param server_name: Server name sent in the WELCOME packet
+        :param supported_update_freqs: {AdminUpdateType: AdminUpdateFrequency, ...} sent in the PROTOCOL packet
+        :param start_date: Initial game date
+        :param rcon_handler: A callable with the command as only argument returning the result lines
+        """
+        self.password = password
+        self.server_name = server_name
+        self.supported_update_freqs = supported_update_freqs or DEFAULT_SUPPORTED_UPDATE_FREQS
+        self.current_date = start_date
+        self.rcon_handler = rcon_handler
+        self.log = logging.getLogger('mock-server')
+
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((host, port))
+        self.listen_socket.listen(16)
+        self.listen_socket.setblocking(False)
+
+        self.connections = []
+        # {client_id: {field: value}}, the server itself is a client
+        self.clients = {SERVER_CLIENT_ID: {'client_address': '', 'client_name': server_name,
+                                           'client_lang': 0, 'join_date': date(1, 1, 1),
+                                           'client_play_as': 255}}
+        self._next_client_id = SERVER_CLIENT_ID + 1
+        # {company_id: {field: value}}
+        self.companies = {}
+        # [(network_action, destination_type, destination, message), ...] sent by admins
+        self.chat_messages = []
+        self.nb_packets_received = 0
+        self.nb_packets_sent = 0
+
+        self.seconds_per_day = None
+        self._next_day_time = None
+        self._actions = queue.Queue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._stop = False
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.listen_socket.getsockname()
+
+    # #### running ###############################################################
+    def start(self):
+        """Serves in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-admin-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for conn in list(self.connections):
+            self._close(conn)
+        self.listen_socket.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn in the server thread"""
+        self._actions.put((fn, args, kwargs))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\x00')
+        except OSError:
+            pass
+
+    def serve_forever(self):
+        while not self._stop:
+            timeout_s = None
+            if self._next_day_time is not None:
+                timeout_s = max(0, self._next_day_time - time.monotonic())
+            rlist = [self.listen_socket, self._wake_r] + [c.socket for c in self.connections]
+            wlist = [c.socket for c in self.connections if c.out_buffer]
+            rlist, wlist, xlist = select(rlist, wlist, [], timeout_s)
+            for sock in rlist:
+                if sock is self.listen_socket:
+                    self._accept()
+                elif sock is self._wake_r:
+                    self._wake_r.recv(RECV_SIZE)
+                else:
+                    self._receive(self._connection(sock))
+            self._run_actions()
+            for sock in wlist:
+                conn = self._connection(sock)
+                if conn is not None:
+                    self._flush(conn)
+            self._tick()
+
+    def _connection(self, sock):
+        for conn in self.connections:
+            if conn.socket is sock:
+                return conn
+        return None
+
+    def _accept(self):
+        try:
+            sock, address = self.listen_socket.accept()
+        except BlockingIOError:
+            return
+        self.connections.append(AdminConnection(sock, address))
+        self.log.debug('Admin connected from %s', address)
+
+    def _receive(self, conn):
+        if conn is None:
+            return
+        try:
+            data = conn.socket.recv(RECV_SIZE)
+        except (BlockingIOError, ConnectionError):
+            data = None
+        if not data:
+            if data is not None:
+                self._close(conn)
+            return
+        if conn.closing:
+            # waiting for the error to be sent
+            return
+        conn.in_buffer += data
+        try:
+            for raw_data in conn.frames():
+                self.nb_packets_received += 1
+                self._handle_packet(conn, raw_data)
+                if conn.closing or conn not in self.connections:
+                    break
+        except PacketDecodeError as e:
+            self.log.warning('Disconnecting admin %s: %s', conn.name, e)
+            self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+
+    def _flush(self, conn):
+        try:
+            nb_sent = conn.socket.send(conn.out_buffer)
+            del conn.out_buffer[:nb_sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(conn)
+            return
+        if conn.closing and not conn.out_buffer:
+            self._close(conn)
+
+    def _close(self, conn):
+        if conn in self.connections:
+            self.connections.remove(conn)
+            conn.socket.close()
+            self.log.debug('Admin %s disconnected', conn.name)
+
+    def _run_actions(self):
+        while True:
+            try:
+                fn, args, kwargs = self._actions.get_nowait()
+            except queue.Empty:
+                return
+            fn(*args, **kwargs)
+
+    def _tick(self):
+        if self._next_day_time is None:
+            return
+        now = time.monotonic()
+        while self._next_day_time <= now:
+            self._advance_day()
+            self._next_day_time += self.seconds_per_day
+
+    # #### sending ###############################################################
+    def _send(self, conn, raw_data):
+        conn.send(raw_data)
+        self.nb_packets_sent += 1
+        self._flush(conn)
+
+    def _broadcast(self, update_type, update_frequency, raw_data):
+        """Sends raw data to all the admins subscribed to given update type with given frequency"""
+        for conn in list(self.connections):
+            if conn.subscribed(update_type, update_frequency):
+                self._send(conn, raw_data)
+
+    def _send_error(self, conn, error):
+        conn.closing = True
+        self._send(conn, ServerErrorPacket.encode(error=error))
+
+    def _client_info(self, client_id):
+        return ServerClientInfoPacket.encode(client_id=client_id, **self.clients[client_id])
+
+    def _company_info(self, company_id):
+        company = self.companies[company_id]
+        return ServerCompanyInfoPacket.encode(company_id=company_id, **company['info'])
+
+    def _company_economy(self, company_id):
+        return ServerCompanyEconomyPacket.encode(company_id=company_id, **self.companies[company_id]['economy'])
+
+    def _company_stats(self, company_id):
+        return ServerCompanyStatsPacket.encode(company_id=company_id, **self.companies[company_id]['stats'])
+
+    # #### admin packets #########################################################
+    def _handle_packet(self, conn, raw_data):
+        try:
+            packet_type, values = decode_admin_packet(raw_data)
+        except FieldDecodeError as e:
+            self.log.warning('Invalid %s from admin %s: %s', PacketTypesStr.get(raw_data[size_len]), conn.name, e)
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        if values is None:
+            self.log.warning('Unknown admin packet type %s', packet_type)
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        if not conn.joined and packet_type != PT.ADMIN_PACKET_ADMIN_JOIN:
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_NOT_EXPECTED)
+        handler = {
+            PT.ADMIN_PACKET_ADMIN_JOIN:             self._on_join,
+            PT.ADMIN_PACKET_ADMIN_QUIT:             self._on_quit,
+            PT.ADMIN_PACKET_ADMIN_UPDATE_FREQUENCY: self._on_update_frequency,
+            PT.ADMIN_PACKET_ADMIN_POLL:             self._on_poll,
+            PT.ADMIN_PACKET_ADMIN_CHAT:             self._on_chat,
+            PT.ADMIN_PACKET_ADMIN_RCON:             self._on_rcon,
+            PT.ADMIN_PACKET_ADMIN_GAMESCRIPT:       self._on_gamescript,
+            PT.ADMIN_PACKET_ADMIN_PING:             self._on_ping,
+        }[packet_type]
+        self.log.debug('Received %s %s', PacketTypesStr[packet_type], values)
+        handler(conn, **values)
+
+    def _on_join(self, conn, password, name, version):
+        if conn.joined:
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_NOT_EXPECTED)
+        if password != self.password:
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_WRONG_PASSWORD)
+        conn.joined = True
+        conn.name = name
+        self._send(conn, ServerProtocolPacket.encode(version=PROTOCOL_VERSION,
+                                                     supported_update_freqs=self.supported_update_freqs))
+        self._send(conn, ServerWelcomePacket.encode(server_name=self.server_name,
+                                                    openttd_revision='mock',
+                                                    is_dedicated=True,
+                                                    map_name='Mock map',
+                                                    generation_seed=0,
+                                                    landscape=0,
+                                                    game_creation_date=self.current_date,
+                                                    map_size_x=256,
+                                                    map_size_y=256))
+
+    def _on_quit(self, conn):
+        self._close(conn)
+
+    def _on_update_frequency(self, conn, update_type, update_frequency):
+        if self.supported_update_freqs.get(update_type, 0) & update_frequency != update_frequency:
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        conn.update_frequencies[update_type] = update_frequency
+
+    def _on_poll(self, conn, update_type, d1):
+        if not self.supported_update_freqs.get(update_type, 0) & AUF.ADMIN_FREQUENCY_POLL:
+            return self._send_error(conn, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        if update_type == AUT.ADMIN_UPDATE_DATE:
+            self._send(conn, ServerDatePacket.encode(date=self.current_date))
+        elif update_type == AUT.ADMIN_UPDATE_CLIENT_INFO:
+            for client_id in (self.clients if d1 == POLL_ALL else [d1]):
+                if client_id in self.clients:
+                    self._send(conn, self._client_info(client_id))
+        else:
+            encoders = {AUT.ADMIN_UPDATE_COMPANY_INFO: self._company_info,
+                        AUT.ADMIN_UPDATE_COMPANY_ECONOMY: self._company_economy,
+                        AUT.ADMIN_UPDATE_COMPANY_STATS: self._company_stats}
+            if update_type in encoders:
+                for company_id in (self.companies if d1 == POLL_ALL else [d1]):
+                    if company_id in self.companies:
+                        self._send(conn, encoders[update_type](company_id))
+
+    def _on_chat(self, conn, network_action, destination_type, destination, message):
+        self.chat_messages.append((network_action, destination_type, destination, message))
+
+    def _on_rcon(self, conn, command):
+        for line in self.rcon_handler(command):
+            self._send(conn, ServerRConPacket.encode(colour=1, result=line))
+        self._send(conn, ServerRConEndPacket.encode(command=command))
+
+    def _on_gamescript(self, conn, json_string):
+        pass
+
+    def _on_ping(self, conn, data):
+        self._send(conn, ServerPongPacket.encode(data=data))
+
+    # #### game ##################################################################
+    def _advance_day(self):
+        self.current_date += timedelta(days=1)
+        d = self.current_date
+        frequencies = date_update_frequencies(d)
+        self._broadcast(AUT.ADMIN_UPDATE_DATE, frequencies, ServerDatePacket.encode(date=d))
+        for company_id in self.companies:
+            self._broadcast(AUT.ADMIN_UPDATE_COMPANY_ECONOMY, frequencies, self._company_economy(company_id))
+            self._broadcast(AUT.ADMIN_UPDATE_COMPANY_STATS, frequencies, self._company_stats(company_id))
+
+    def _add_clients(self, nb, name_prefix):
+        for _ in range(nb):
+            client_id = self._next_client_id
+            self._next_client_id += 1
+            self.clients[client_id] = {'client_address': '10.0.0.%s' % (client_id % 256),
+                                       'client_name': '%s %s' % (name_prefix, client_id),
+                                       'client_lang': 0,
+                                       'join_date': self.current_date,
+                                       'client_play_as': 255}
+            self._broadcast(AUT.ADMIN_UPDATE_CLIENT_INFO, AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                            ServerClientJoinPacket.encode(client_id=client_id))
+            self._broadcast(AUT.ADMIN_UPDATE_CLIENT_INFO, AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                            self._client_info(client_id))
+
+    def _remove_client(self, client_id):
+        if self.clients.pop(client_id, None) is not None:
+            self._broadcast(AUT.ADMIN_UPDATE_CLIENT_INFO, AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                            ServerClientQuitPacket.encode(client_id=client_id))
+
+    def _add_company(self, name):
+        company_id = min(set(range(len(self.companies) + 1)) - set(self.companies))
+        self.companies[company_id] = {
+            'info': {'company_name': name, 'manager_name': 'Manager', 'colour': company_id % 16,
+                     'is_passworded': False, 'inaugurated_year': self.current_date.year, 'is_ai': False,
+                     'months_of_bankruptcy': 0, 'share_owners': [255, 255, 255, 255]},
+            'economy': {'money': 100000, 'current_loan': 100000, 'income': 0, 'delivered_cargo': 0,
+                        'company_value_0': 0, 'performance_history_0': 0, 'delivered_cargo_0': 0,
+                        'company_value_1': 0, 'performance_history_1': 0, 'delivered_cargo_1': 0},
+            'stats': {name: 0 for name, _ in ServerCompanyStatsPacket._fields[1:]},
+        }
+        self._broadcast(AUT.ADMIN_UPDATE_COMPANY_INFO, AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                        ServerCompanyNewPacket.encode(company_id=company_id))
+        self._broadcast(AUT.ADMIN_UPDATE_COMPANY_INFO, AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                        self._company_info(company_id))
+
+    def _console(self, string, origin, nb):
+        raw_data = ServerConsolePacket.encode(origin=origin, string=string)
+        for _ in range(nb):
+            self._broadcast(AUT.ADMIN_UPDATE_CONSOLE, AUF.ADMIN_FREQUENCY_AUTOMATIC, raw_data)
+
+    def _chat(self, client_id, message, network_action, destination_type):
+        raw_data = ServerChatPacket.encode(network_action=network_action, destination_type=destination_type,
+                                           client_id=client_id, message=message, data=0)
+        self._broadcast(AUT.ADMIN_UPDATE_CHAT, AUF.ADMIN_FREQUENCY_AUTOMATIC, raw_data)
+
+    def _set_game_speed(self, seconds_per_day):
+        self.seconds_per_day = seconds_per_day
+        self._next_day_time = time.monotonic() + seconds_per_day if seconds_per_day is not None else None
+
+    def _new_game(self):
+        for conn in self.connections:
+            if conn.joined:
+                self._send(conn, ServerNewGamePacket.encode())
+
+    def _disconnect_admins(self):
+        for conn in list(self.connections):
+            self._close(conn)
+
+    def _shutdown(self):
+        for conn in list(self.connections):
+            conn.closing = True
+            if conn.joined:
+                self._send(conn, ServerShutdownPacket.encode())
+            else:
+                self._close(conn)
+
+    # #### scenarios, these can be called from any thread #######################
+    def add_clients(self, nb=1, name_prefix='Player'):
+        """Clients join the game, admins get CLIENT_JOIN and CLIENT_INFO packets"""
+        self.call(self._add_clients, nb, name_prefix)
+
+    def remove_client(self, client_id):
+        self.call(self._remove_client, client_id)
+
+    def add_company(self, name='Company'):
+        self.call(self._add_company, name)
+
+    def console(self, string, origin='console', nb=1):
+        """Prints nb console lines, e.g. for console floods"""
+        self.call(self._console, string, origin, nb)
+
+    def chat(self, client_id, message, network_action=3, destination_type=0):
+        self.call(self._chat, client_id, message, network_action, destination_type)
+
+    def advance_days(self, nb=1):
+        for _ in range(nb):
+            self.call(self._advance_day)
+
+    def set_game_speed(self, seconds_per_day):
+        """Advances the date every seconds_per_day (2.22s at normal speed), None stops the clock"""
+        self.call(self._set_game_speed, seconds_per_day)
+
+    def new_game(self):
+        self.call(self._new_game)
+
+    def disconnect_admins(self):
+        """Closes all admin connections without notice"""
+        self.call(self._disconnect_admins)
+
+    def shutdown(self):
+        """Sends SHUTDOWN to all admins and closes the connections"""
+        self.call(self._shutdown)
+
+
+def parse_args():
+    ap = ArgumentParser(description='Mock OpenTTD admin server')
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=3977)
+    ap.add_argument('--password', default='')
+    ap.add_argument('--clients', type=int, default=0, help='Number of clients joining at start')
+    ap.add_argument('--companies', type=int, default=0, help='Number of companies at start')
+    ap.add_argument('--seconds-per-day', type=float, default=None, help='2.22 is the normal game speed')
+    ap.add_argument('--console-lines-per-s', type=float, default=0, help='Console flood rate')
+    ap.add_argument('--verbose', action='store_true')
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    server = MockAdminServer(host=args.host, port=args.port, password=args.password).start()
+    server.add_clients(args.clients)
+    for n in range(args.companies):
+        server.add_company('Company %s' % n)
+    if args.seconds_per_day is not None:
+        server.set_game_speed(args.seconds_per_day)
+    try:
+        while True:
+            if args.console_lines_per_s > 0:
+                server.console('flood')
+                time.sleep(1 / args.console_lines_per_s)
+            else:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
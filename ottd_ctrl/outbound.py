@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from collections import deque
+import math
+import time
+
+# project
+from ottd_ctrl.const import PacketTypes as PT, enum_str
+from ottd_ctrl.ratelimit import TokenBucket
+
+
+class OutboundPriority:
+    CONTROL = 0     # join, quit, ping, rcon
+    REQUEST = 1     # update frequencies, polls, gamescript
+    CHAT = 2        # chat messages
+
+
+OutboundPriorityStr = enum_str(OutboundPriority)
+
+DEFAULT_OUTBOUND_PRIORITIES = {
+    PT.ADMIN_PACKET_ADMIN_JOIN:             OutboundPriority.CONTROL,
+    PT.ADMIN_PACKET_ADMIN_QUIT:             OutboundPriority.CONTROL,
+    PT.ADMIN_PACKET_ADMIN_PING:             OutboundPriority.CONTROL,
+    PT.ADMIN_PACKET_ADMIN_RCON:             OutboundPriority.CONTROL,
+    PT.ADMIN_PACKET_ADMIN_UPDATE_FREQUENCY: OutboundPriority.REQUEST,
+    PT.ADMIN_PACKET_ADMIN_POLL:             OutboundPriority.REQUEST,
+    PT.ADMIN_PACKET_ADMIN_GAMESCRIPT:       OutboundPriority.REQUEST,
+    PT.ADMIN_PACKET_ADMIN_CHAT:             OutboundPriority.CHAT,
+}
+
+# {OutboundPriority: (packets per second, burst) or None for no limit}
+DEFAULT_OUTBOUND_RATES = {
+    OutboundPriority.CONTROL:   None,
+    OutboundPriority.REQUEST:   (20, 40),
+    OutboundPriority.CHAT:      (5, 10),
+}
+
+
+class OutboundQueue:
+    def __init__(self, priorities=None, rates=None, clock=time.monotonic):
+        """
+        Packets waiting to be sent, by priority class, each class has its own token bucket
+        so that a rate limited class never delays another one
+        :param priorities: {packet_type: OutboundPriority, ...}, defaults to DEFAULT_OUTBOUND_PRIORITIES
+        :param rates: {OutboundPriority: (rate, burst) or None, ...}, defaults to DEFAULT_OUTBOUND_RATES
+        :param clock: A callable returning the current time in seconds
+        """
+        self.priorities = priorities if priorities is not None else DEFAULT_OUTBOUND_PRIORITIES
+        class_rates = dict(DEFAULT_OUTBOUND_RATES)
+        class_rates.update(rates or {})
+        nb_priorities = len(OutboundPriorityStr)
+        self._queues = [deque() for _ in range(nb_priorities)]
+        self._buckets = [TokenBucket(*class_rates[p], clock=clock) if class_rates.get(p) is not None else None
+                         for p in range(nb_priorities)]
+        self.nb_sent = [0] * nb_priorities
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues)
+
+    def push(self, pkt):
+        self._queues[self.priorities.get(pkt.type_, OutboundPriority.REQUEST)].append(pkt)
+
+    def pop_ready(self):
+        """Returns the packets which can be sent now, highest priority first"""
+        res = []
+        for priority, queue in enumerate(self._queues):
+            bucket = self._buckets[priority]
+            while queue and (bucket is None or bucket.consume()):
+                res.append(queue.popleft())
+                self.nb_sent[priority] += 1
+        return res
+
+    def time_until_ready(self):
+        """Returns the number of seconds until a queued packet can be sent, math.inf if none is queued"""
+        res = math.inf
+        for priority, queue in enumerate(self._queues):
+            if queue:
+                bucket = self._buckets[priority]
+                res = min(res, bucket.time_until_available() if bucket is not None else 0)
+        return res
+
+    def clear(self):
+        """Drops all queued packets, returns their number"""
+        nb = len(self)
+        for queue in self._queues:
+            queue.clear()
+        return nb
+
+    def stats(self):
+        """Returns {priority name: {'sent': x, 'queued': y}, ...}"""
+        return {OutboundPriorityStr[priority]: {'sent': self.nb_sent[priority],
+                                                'queued': len(self._queues[priority])}
+                for priority in range(len(self._queues))}
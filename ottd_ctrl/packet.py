@@ -150,6 +150,9 @@ class AdminPacket(Packet):
 class ServerPacket(Packet):
     """Packets send by server"""
     log = logging.getLogger('ServerPacket')
+    # name of the field identifying the client or company the packet is about,
+    # when set it must be the first field
+    key_field = None
 
     def __init__(self, size, raw_data, *args, **kwargs):
         super().__init__(size, *args, **kwargs)
@@ -187,6 +190,37 @@ class ServerPacket(Packet):
         self.index += field.raw_size
         return decoded_field
 
+    @classmethod
+    def encode(cls, **values):
+        """
+        Returns the raw packet (including size and type) with given field values,
+        the counterpart of decode(), used to play the server
+        fields decoded by a '_decode_xxx' method are encoded by the '_encode_xxx' class method
+        """
+        payload = b''
+        try:
+            for name, decoder in cls._fields:
+                if name not in values:
+                    raise PacketEncodeError('Missing field %s' % name)
+                value = values[name]
+                if type(decoder) is type and issubclass(decoder, Type):
+                    payload += decoder(value).raw_data
+                elif isinstance(decoder, str):
+                    payload += getattr(cls, decoder.replace('_decode_', '_encode_', 1))(value)
+        except StructError as e:
+            raise PacketEncodeError(str(e))
+        pkt_size = cls.pkt_size_size + cls.pkt_type_size + len(payload)
+        return cls.pkt_size_field(value=pkt_size).raw_data + cls.pkt_type_field(value=cls.type_).raw_data + payload
+
+    @classmethod
+    def key_type(cls):
+        """Returns the protocol.Type of the key field, None if the packet has no key field"""
+        if cls.key_field is None:
+            return None
+        name, type_ = cls._fields[0]
+        assert name == cls.key_field, 'Key field must be the first field'
+        return type_
+
     @classmethod
     def decode(cls, packet_size, raw_data):
         """
@@ -259,7 +293,7 @@ class AdminUpdateFrequenciesPacket(AdminPacket):
         return '<{}({}, {})>'.format(
             self.__class__.__name__,
             AdminUpdateTypeStr[self.update_type],
-            AdminUpdateFrequencyStr[self.update_frequency]
+            AdminUpdateFrequencyStr.get(self.update_frequency, self.update_frequency)
         )
 
 
@@ -304,6 +338,13 @@ class ServerProtocolPacket(ServerPacket):
         _ = self._decode_field(UInt8)  # final separator
         return res
 
+    @classmethod
+    def _encode_supported_update_freqs(cls, value):
+        res = b''
+        for key, freqs in value.items():
+            res += UInt8(1).raw_data + UInt16(key).raw_data + UInt16(freqs).raw_data
+        return res + UInt8(0).raw_data
+
     def __str__(self):
         return ', '.join([str(self.version)] +
                          ['%s: 0x%x' % (AdminUpdateTypeStr[k], v)
@@ -387,6 +428,7 @@ class ServerChatPacket(ServerPacket):
 
 class ServerClientJoinPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_JOIN
+    key_field = 'client_id'
     _fields = [
         ('client_id', UInt32),
     ]
@@ -399,6 +441,7 @@ class ServerClientInfoPacket(ServerPacket):
     client_id=1, client_address='' and join_date='0001-01-01'
     """
     type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_INFO
+    key_field = 'client_id'
     _fields = [
         ('client_id',       UInt32),
         ('client_address',  String),
@@ -411,6 +454,7 @@ class ServerClientInfoPacket(ServerPacket):
 
 class ServerClientUpdatePacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_UPDATE
+    key_field = 'client_id'
     _fields = [
         ('client_id',       UInt32),
         ('client_name',     String),
@@ -420,13 +464,15 @@ class ServerClientUpdatePacket(ServerPacket):
 
 class ServerClientQuitPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_QUIT
+    key_field = 'client_id'
     _fields = [
         ('client_id', UInt32),
     ]
 
 
 class ServerClientErrorPacket(ServerPacket):
-    type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_QUIT
+    type_ = PacketTypes.ADMIN_PACKET_SERVER_CLIENT_ERROR
+    key_field = 'client_id'
     _fields = [
         ('client_id',   UInt32),
         ('error',       UInt8),
@@ -435,6 +481,7 @@ class ServerClientErrorPacket(ServerPacket):
 
 class ServerCompanyNewPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_NEW
+    key_field = 'company_id'
     _fields = [
         ('company_id', UInt8),
     ]
@@ -442,6 +489,7 @@ class ServerCompanyNewPacket(ServerPacket):
 
 class ServerCompanyInfoPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_INFO
+    key_field = 'company_id'
     _fields = [
         ('company_id',              UInt8),
         ('company_name',            String),
@@ -458,13 +506,19 @@ class ServerCompanyInfoPacket(ServerPacket):
         """Share owners are appended at the end of the packet"""
         res = []
         share_owner_type = UInt8
-        while (self.index + share_owner_type.struct.size) < len(self.raw_data):
+        while (self.index + share_owner_type.struct.size) <= len(self.raw_data):
             res.append(self._decode_field(share_owner_type))
+        return res
+
+    @classmethod
+    def _encode_share_owners(cls, value):
+        return b''.join(UInt8(share_owner).raw_data for share_owner in value)
 
 
 class ServerCompanyUpdatePacket(ServerPacket):
     """Same fields as erverCompanyInfoPacket"""
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_UPDATE
+    key_field = 'company_id'
     _fields = [
         ('company_id',              UInt8),
         ('company_name',            String),
@@ -479,12 +533,18 @@ class ServerCompanyUpdatePacket(ServerPacket):
         """Share owners are appended at the end of the packet"""
         res = []
         share_owner_type = UInt8
-        while (self.index + share_owner_type.struct.size) < len(self.raw_data):
+        while (self.index + share_owner_type.struct.size) <= len(self.raw_data):
             res.append(self._decode_field(share_owner_type))
+        return res
+
+    @classmethod
+    def _encode_share_owners(cls, value):
+        return b''.join(UInt8(share_owner).raw_data for share_owner in value)
 
 
 class ServerCompanyRemovePacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_REMOVE
+    key_field = 'company_id'
     _fields = [
         ('company_id',    UInt8),
         ('remove_reason', UInt8),  # A value of AdminCompanyRemoveReason
@@ -493,6 +553,7 @@ class ServerCompanyRemovePacket(ServerPacket):
 
 class ServerCompanyEconomyPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_ECONOMY
+    key_field = 'company_id'
     _fields = [
         ('company_id',              UInt8),
         ('money',                   SInt64),  # British Pound
@@ -510,6 +571,7 @@ class ServerCompanyEconomyPacket(ServerPacket):
 
 class ServerCompanyStatsPacket(ServerPacket):
     type_ = PacketTypes.ADMIN_PACKET_SERVER_COMPANY_STATS
+    key_field = 'company_id'
     _fields = [
         ('company_id',              UInt8),
         ('train_vehicles_count',    UInt16),
@@ -587,3 +649,18 @@ packet_map = {
     PacketTypes.ADMIN_PACKET_SERVER_PONG: ServerPongPacket,
     PacketTypes.INVALID_ADMIN_PACKET: None,  # TODO Is this ever sent over the wire?
 }
+
+
+def decode_admin_packet(raw_data):
+    """Returns (packet_type, {field name: value, ...}) of a raw admin packet, values are None if unknown"""
+    packet_type = raw_data[size_len]
+    class_ = packet_map.get(packet_type)
+    if class_ is None:
+        return packet_type, None
+    values = {}
+    index = size_len + type_len
+    for name, type_ in class_._fields:
+        field = type_(raw_data=raw_data[index:])
+        values[name] = field.value
+        index += field.raw_size
+    return packet_type, values
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import logging
+import math
+import time
+
+# project
+from ottd_ctrl.const import AdminUpdateType as AUT, AdminUpdateTypeStr, PacketTypes as PT
+from ottd_ctrl.packet import AdminPollPacket, packet_map
+from ottd_ctrl.ratelimit import TokenBucket
+
+# d1 value polling all clients or companies
+POLL_ALL = 0xFFFFFFFF
+
+DEFAULT_MIN_INTERVAL_S = 1
+DEFAULT_MAX_INTERVAL_S = 60
+DEFAULT_RESPONSE_TIMEOUT_S = 5
+DEFAULT_MAX_PACKETS_PER_S = 10
+# weight of the last observation in the change rate
+CHANGE_RATE_ALPHA = 0.3
+
+# {AdminUpdateType: type of the packets answering a poll}, other packets of
+# the update type are automatic or periodic updates, not responses
+POLL_RESPONSE_PACKET_TYPES = {
+    AUT.ADMIN_UPDATE_DATE:              PT.ADMIN_PACKET_SERVER_DATE,
+    AUT.ADMIN_UPDATE_CLIENT_INFO:       PT.ADMIN_PACKET_SERVER_CLIENT_INFO,
+    AUT.ADMIN_UPDATE_COMPANY_INFO:      PT.ADMIN_PACKET_SERVER_COMPANY_INFO,
+    AUT.ADMIN_UPDATE_COMPANY_ECONOMY:   PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY,
+    AUT.ADMIN_UPDATE_COMPANY_STATS:     PT.ADMIN_PACKET_SERVER_COMPANY_STATS,
+    AUT.ADMIN_UPDATE_CMD_NAMES:         PT.ADMIN_PACKET_SERVER_CMD_NAMES,
+}
+
+
+def _response_key(packet_type, raw_data):
+    """Returns the client or company id of a response payload, None if it has none"""
+    class_ = packet_map.get(packet_type)
+    key_type = class_.key_type() if class_ is not None else None
+    if key_type is None or len(raw_data) < key_type.struct.size:
+        return None
+    return key_type.struct.unpack_from(raw_data)[0]
+
+
+class PollJob:
+    def __init__(self, update_type, d1, min_interval_s, max_interval_s, now):
+        """
+        Periodic poll of an update type, the interval goes from max_interval_s
+        when responses never change to min_interval_s when they always change
+        """
+        self.update_type = update_type
+        self.d1 = d1
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.interval_s = min_interval_s
+        self.next_poll_time = now
+        self.last_poll_time = None
+        # True between sending a poll and receiving the first response
+        self.in_flight = False
+        # True while the responses to a poll for all the entities are received
+        self.receiving = False
+        # exponentially weighted rate of responses which differ from the previous one
+        self.change_rate = 1.0
+        self.nb_polls = 0
+        self.nb_changes = 0
+        # raw payloads received since last poll
+        self._responses = []
+        self._last_response = None
+
+    def is_response(self, packet_type, key):
+        """Returns True if a received packet answers the last poll"""
+        if not (self.in_flight or self.receiving):
+            return False
+        if packet_type != POLL_RESPONSE_PACKET_TYPES.get(self.update_type):
+            return False
+        return self.d1 == POLL_ALL or key is None or key == self.d1
+
+    def add_response(self, raw_data, last):
+        """
+        :param last: True if no other response is expected,
+                     else the next packet which is not a response ends them
+        """
+        self._responses.append(raw_data)
+        self.in_flight = False
+        self.receiving = not last
+
+    def complete(self):
+        """Compares the responses to the last poll with the previous ones, adapts the interval"""
+        if self.last_poll_time is None:
+            return
+        response = b''.join(self._responses)
+        self._responses = []
+        if self._last_response is not None:
+            changed = response != self._last_response
+            self.nb_changes += changed
+            self.change_rate += CHANGE_RATE_ALPHA * (changed - self.change_rate)
+            self.interval_s = (self.min_interval_s +
+                               (self.max_interval_s - self.min_interval_s) * (1 - self.change_rate))
+        self._last_response = response
+
+    def __repr__(self):
+        return '{}({}, d1={}, interval={:.1f}s)'.format(self.__class__.__name__,
+                                                         AdminUpdateTypeStr[self.update_type],
+                                                         self.d1, self.interval_s)
+
+
+class PollScheduler:
+    def __init__(self, send_packet,
+                 max_packets_per_s=DEFAULT_MAX_PACKETS_PER_S,
+                 response_timeout_s=DEFAULT_RESPONSE_TIMEOUT_S,
+                 clock=time.monotonic):
+        """
+        Sends AdminPollPackets for scheduled update types,
+        adapting the poll interval to how often the responses change
+        :param send_packet: Callable sending a packet
+        :param max_packets_per_s: Global budget of poll packets per second
+        :param response_timeout_s: A poll without response is considered done after this delay,
+                                   until then the same poll is not sent again
+        :param clock: A callable returning the current time in seconds
+        """
+        self.send_packet = send_packet
+        self.response_timeout_s = response_timeout_s
+        self.clock = clock
+        self.budget = TokenBucket(max_packets_per_s, clock=clock)
+        self.log = logging.getLogger('poll-scheduler')
+        # {(update_type, d1): PollJob}
+        self.jobs = {}
+
+    def schedule(self, update_type, d1=POLL_ALL,
+                 min_interval_s=DEFAULT_MIN_INTERVAL_S,
+                 max_interval_s=DEFAULT_MAX_INTERVAL_S):
+        """Polls given update type periodically, returns the PollJob"""
+        key = (update_type, d1)
+        if key in self.jobs:
+            job = self.jobs[key]
+            job.min_interval_s = min_interval_s
+            job.max_interval_s = max_interval_s
+        else:
+            job = self.jobs[key] = PollJob(update_type, d1, min_interval_s, max_interval_s, self.clock())
+        return job
+
+    def unschedule(self, update_type, d1=POLL_ALL):
+        self.jobs.pop((update_type, d1), None)
+
+    def poll_now(self, update_type, d1=POLL_ALL):
+        """Brings forward the next poll of a scheduled job, polls in flight are not repeated"""
+        job = self.jobs.get((update_type, d1))
+        if job is not None and not self._is_in_flight(job, self.clock()):
+            job.next_poll_time = self.clock()
+
+    def on_frame(self, packet_type, raw_data):
+        """Feeds a received raw packet (payload only) to the scheduler"""
+        waiting = [job for job in self.jobs.values() if job.in_flight or job.receiving]
+        if not waiting:
+            return
+        key = _response_key(packet_type, raw_data)
+        for job in waiting:
+            if job.is_response(packet_type, key):
+                # the server sends the responses to a poll one after the other
+                job.add_response(raw_data, last=job.d1 != POLL_ALL or key is None)
+            else:
+                job.receiving = False
+
+    def _is_in_flight(self, job, now):
+        if job.in_flight and now - job.last_poll_time >= self.response_timeout_s:
+            self.log.debug('No response for %r', job)
+            job.in_flight = False
+        if job.in_flight:
+            return True
+        # a poll for all the entities covers the one for a single entity
+        if job.d1 != POLL_ALL:
+            all_job = self.jobs.get((job.update_type, POLL_ALL))
+            if all_job is not None and all_job.in_flight:
+                return True
+        return False
+
+    def run(self):
+        """Sends due polls within the packet budget, returns seconds until the next call is needed"""
+        now = self.clock()
+        for job in sorted(self.jobs.values(), key=lambda j: j.next_poll_time):
+            if job.next_poll_time > now:
+                break
+            if self._is_in_flight(job, now):
+                job.next_poll_time = now + job.min_interval_s
+                continue
+            if not self.budget.consume():
+                break
+            job.complete()
+            self.send_packet(AdminPollPacket(update_type=job.update_type, d1=job.d1))
+            job.in_flight = True
+            job.receiving = False
+            job.nb_polls += 1
+            job.last_poll_time = now
+            job.next_poll_time = now + job.interval_s
+        return self.time_until_next_poll()
+
+    def time_until_next_poll(self):
+        if not self.jobs:
+            return math.inf
+        now = self.clock()
+        next_poll_time = min(job.next_poll_time for job in self.jobs.values())
+        if next_poll_time <= now:
+            return self.budget.time_until_available()
+        return next_poll_time - now
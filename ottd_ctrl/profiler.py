@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import logging
+import time
+
+# project
+from ottd_ctrl.const import PacketTypesStr
+
+DEFAULT_SLOW_THRESHOLD_S = 0.05
+DEFAULT_WARNING_INTERVAL_S = 60
+REPORT_ORDERS = ('total', 'max', 'mean', 'count')
+
+
+def callback_name(cb):
+    """Returns module.qualified_name of a callback, e.g. my_plugin.MyBot.on_chat"""
+    name = getattr(cb, '__qualname__', None) or getattr(cb, '__name__', None) or repr(cb)
+    module = getattr(cb, '__module__', None)
+    return '%s.%s' % (module, name) if module else name
+
+
+class CallbackStats:
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.nb_slow = 0
+
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.count if self.count else 0.0
+
+
+class CallbackProfiler:
+    def __init__(self, slow_threshold_s=DEFAULT_SLOW_THRESHOLD_S,
+                 warning_interval_s=DEFAULT_WARNING_INTERVAL_S,
+                 clock=time.monotonic):
+        """
+        Aggregates callback execution times per callback and packet type,
+        warns about callbacks slower than slow_threshold_s
+        :param slow_threshold_s: Callbacks running longer are reported as slow
+        :param warning_interval_s: Minimum interval between two warnings for the same callback
+        :param clock: A callable returning the current time in seconds, used for warning intervals
+        """
+        self.slow_threshold_ns = int(slow_threshold_s * 1e9)
+        self.warning_interval_s = warning_interval_s
+        self.clock = clock
+        self.log = logging.getLogger('profiler')
+        # {(callback name, packet type): CallbackStats}
+        self.stats = {}
+        # {callback name: (time of the last warning, slow calls not reported since)}
+        self._warnings = {}
+        # callback names are cached, computing them on every call would cost more than timing
+        self._names = {}
+
+    def record(self, cb, packet_type, elapsed_ns):
+        """Records a callback execution"""
+        try:
+            name = self._names[cb]
+        except (KeyError, TypeError):
+            name = callback_name(cb)
+            try:
+                self._names[cb] = name
+            except TypeError:
+                # unhashable callable
+                pass
+        key = (name, packet_type)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CallbackStats()
+        stats.count += 1
+        stats.total_ns += elapsed_ns
+        if elapsed_ns > stats.max_ns:
+            stats.max_ns = elapsed_ns
+        if elapsed_ns > self.slow_threshold_ns:
+            stats.nb_slow += 1
+            self._warn(name, packet_type, elapsed_ns)
+
+    def _warn(self, name, packet_type, elapsed_ns):
+        now = self.clock()
+        last_warning, nb_suppressed = self._warnings.get(name, (None, 0))
+        if last_warning is not None and now - last_warning < self.warning_interval_s:
+            self._warnings[name] = (last_warning, nb_suppressed + 1)
+            return
+        self._warnings[name] = (now, 0)
+        self.log.warning('Slow callback %s for %s: %.1fms%s', name, PacketTypesStr.get(packet_type, packet_type),
+                         elapsed_ns / 1e6,
+                         ' (%s slow calls not reported)' % nb_suppressed if nb_suppressed else '')
+
+    def reset(self):
+        self.stats.clear()
+        self._warnings.clear()
+
+    def top(self, nb=10, order='total'):
+        """
+        Returns [(callback name, packet type, CallbackStats), ...] of the nb most expensive callbacks
+        :param order: One of 'total', 'max', 'mean', 'count'
+        """
+        if order not in REPORT_ORDERS:
+            raise Exception('Unknown order %s, expected one of %s' % (order, ', '.join(REPORT_ORDERS)))
+        attr = {'total': 'total_ns', 'max': 'max_ns', 'mean': 'mean_ns', 'count': 'count'}[order]
+        items = sorted(self.stats.items(), key=lambda i: getattr(i[1], attr), reverse=True)[:nb]
+        return [(name, packet_type, stats) for (name, packet_type), stats in items]
+
+    def report(self, nb=10, order='total'):
+        """Returns a human readable table of the nb most expensive callbacks"""
+        lines = ['{:<60} {:<40} {:>8} {:>12} {:>10} {:>10} {:>6}'.format(
+            'callback', 'packet type', 'count', 'total ms', 'mean us', 'max ms', 'slow')]
+        for name, packet_type, stats in self.top(nb, order):
+            lines.append('{:<60} {:<40} {:>8} {:>12.1f} {:>10.1f} {:>10.2f} {:>6}'.format(
+                name, PacketTypesStr.get(packet_type, str(packet_type)), stats.count, stats.total_ns / 1e6,
+                stats.mean_ns / 1e3, stats.max_ns / 1e6, stats.nb_slow))
+        return '\n'.join(lines)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+Session metrics in the Prometheus text format, served over HTTP
+
+The text is rendered every refresh_interval_s by a background thread and served
+as is, scrapes never wait for the session nor make it wait.
+
+    session.start_metrics_server(port=9477)
+
+or, to control the life cycle of the exporter:
+
+    session.enable_metrics()
+    exporter = MetricsExporter(session, port=9477).start()
+    ...
+    exporter.stop()
+"""
+
+# standard library
+import calendar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+# project
+from ottd_ctrl.const import PacketTypesStr
+from ottd_ctrl.metrics import RECEIVED, SENT
+
+DEFAULT_PORT = 9477
+DEFAULT_REFRESH_INTERVAL_S = 5
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'ottd_ctrl_'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in sorted(labels.items()))
+
+
+def _type_name(packet_type):
+    return PacketTypesStr.get(packet_type, str(packet_type))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsText:
+    """Builds a Prometheus text exposition"""
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, type_, help_, samples):
+        """
+        :param samples: [(labels dict, value), ...] or a single value
+        """
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        self.lines.append('# HELP %s%s %s' % (PREFIX, name, help_))
+        self.lines.append('# TYPE %s%s %s' % (PREFIX, name, type_))
+        for labels, value in samples:
+            if value is not None:
+                self.lines.append('%s%s%s %s' % (PREFIX, name, _format_labels(labels), _format_value(value)))
+
+    def histogram(self, name, help_, histograms, scale=1e-9):
+        """
+        :param histograms: [(labels dict, metrics.Histogram), ...]
+        :param scale: Factor converting the histogram values to the exported unit
+        """
+        self.lines.append('# HELP %s%s %s' % (PREFIX, name, help_))
+        self.lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+        for labels, histogram in histograms:
+            counts = list(histogram.counts)
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + [float('inf')], counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound * scale)
+                self.lines.append('%s%s_bucket%s %s' % (PREFIX, name, _format_labels(dict(labels, le=le)), cumulative))
+            self.lines.append('%s%s_sum%s %s' % (PREFIX, name, _format_labels(labels), repr(histogram.sum * scale)))
+            self.lines.append('%s%s_count%s %s' % (PREFIX, name, _format_labels(labels), cumulative))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render(session):
+    """Returns the metrics of a Session in the Prometheus text format"""
+    t = MetricsText()
+    t.metric('connected', 'gauge', 'Whether the session is connected', int(session.is_connected))
+    t.metric('joins_total', 'counter', 'Number of times the server has been joined', session.nb_joins)
+    t.metric('reconnects_total', 'counter', 'Number of times the server has been joined again', session.nb_reconnects)
+    t.metric('clients', 'gauge', 'Number of clients on the server', len(session.clients))
+    t.metric('companies', 'gauge', 'Number of companies in the game', len(session.companies))
+    if session.current_date is not None:
+        t.metric('game_date_seconds', 'gauge', 'Current game date as a Unix timestamp',
+                 calendar.timegm(session.current_date.timetuple()))
+    t.metric('ping_rtt_last_seconds', 'gauge', 'Round trip time of the last ping', session.rtt_s)
+    t.histogram('ping_rtt_seconds', 'Round trip time of pings', [({}, session.rtt_ns)])
+    sim_speed = session.sim_speed
+    t.metric('game_seconds_per_day', 'gauge', 'Wall clock duration of a game day over a window of game days',
+             [({'window_days': w}, sim_speed.seconds_per_day(w)) for w in sim_speed.windows_days])
+    t.metric('server_lagging', 'gauge', 'Whether game days last longer than normal', int(sim_speed.lagging))
+    t.metric('server_lags_total', 'counter', 'Number of times the server started lagging', sim_speed.nb_lags)
+    ping_monitor = session.ping_monitor
+    t.metric('ping_rtt_ewma_seconds', 'gauge', 'Moving average of the ping round trip times', ping_monitor.rtt_ewma_s)
+    t.metric('pings_sent_total', 'counter', 'Pings sent', ping_monitor.nb_sent)
+    t.metric('pings_in_flight', 'gauge', 'Pings sent without pong yet', ping_monitor.nb_pending)
+    t.metric('ping_timeouts_total', 'counter', 'Connections considered lost because a ping was not answered',
+             ping_monitor.nb_timeouts)
+    t.histogram('rcon_latency_seconds', 'Time between sending an rcon command and the end of its result',
+                [({}, session.rcon_latency_ns)])
+
+    metrics = session.metrics
+    if metrics is not None:
+        by_direction = [(direction, list(by_type.items()))
+                        for direction, by_type in ((RECEIVED, metrics.received), (SENT, metrics.sent))]
+        t.metric('callback_errors_total', 'counter', 'Callbacks which raised an exception', metrics.callback_errors)
+        t.metric('packets_total', 'counter', 'Packets by direction and type',
+                 [({'direction': d, 'type': _type_name(pt)}, m.count)
+                  for d, items in by_direction for pt, m in items])
+        t.metric('bytes_total', 'counter', 'Bytes by direction and packet type',
+                 [({'direction': d, 'type': _type_name(pt)}, m.bytes)
+                  for d, items in by_direction for pt, m in items])
+        t.metric('packets_dropped_total', 'counter', 'Received packets dropped as duplicates',
+                 [({'type': _type_name(pt)}, m.dropped) for pt, m in by_direction[0][1]])
+        t.histogram('codec_seconds', 'Time spent decoding received or encoding sent packets',
+                    [({'direction': d, 'type': _type_name(pt)}, m.codec_ns)
+                     for d, items in by_direction for pt, m in items])
+        t.histogram('callbacks_seconds', 'Time spent in the callbacks of received packets',
+                    [({'type': _type_name(pt)}, m.callbacks_ns) for pt, m in by_direction[0][1]])
+    return t.text()
+
+
+class MetricsExporter:
+    def __init__(self, session, host='127.0.0.1', port=DEFAULT_PORT,
+                 refresh_interval_s=DEFAULT_REFRESH_INTERVAL_S):
+        """
+        Serves the metrics of a session on http://host:port/metrics
+        :param session: A Session, packet metrics are only exported if session.enable_metrics() was called
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 for any free port, see address
+        :param refresh_interval_s: Interval at which the served text is rendered
+        """
+        self.session = session
+        self.refresh_interval_s = refresh_interval_s
+        self.log = logging.getLogger('prometheus')
+        self._text = ''
+        self._stopped = threading.Event()
+        self._threads = []
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                exporter.log.debug(fmt, *args)
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        self.http_server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.http_server.server_address
+
+    @property
+    def text(self):
+        return self._text
+
+    def refresh(self):
+        """Renders the served text"""
+        try:
+            self._text = render(self.session)
+        except Exception:
+            # e.g. a dict changed size while being copied, we keep the previous text
+            self.log.exception('Error while rendering metrics')
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval_s):
+            self.refresh()
+
+    def start(self):
+        self.refresh()
+        self._threads = [threading.Thread(target=self.http_server.serve_forever, name='metrics-http', daemon=True),
+                         threading.Thread(target=self._refresh_loop, name='metrics-refresh', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        self.log.info('Serving metrics on http://%s:%s/metrics', *self.address[:2])
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
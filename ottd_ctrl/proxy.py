@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shares one admin connection between many local admin clients
+
+OpenTTD limits the number of admin connections and encodes its updates for each
+of them, the proxy holds a single upstream connection and serves the admin
+protocol on a Unix socket:
+
+    upstream = Session('proxy', password, '1', server_host, server_port)
+    with AdminProxy(upstream, '/run/ottd/admin.sock').start():
+        ...
+
+    # in the bots
+    session = Session('bot', password, '1', '/run/ottd/admin.sock', None)
+
+Server packets are forwarded as received, without being decoded again, to the
+clients subscribed to their update type. The upstream update frequencies are the
+union of the ones requested by the clients, the dates are always received daily
+and forwarded according to the frequency of each client. The server sends the
+economy and stats updates right after the date, they are forwarded according
+to the frequencies of that date. Polls, rcon results and pongs are only sent
+back to their requester. The server does not tell the responses to a poll apart
+from its automatic updates, so between a poll and the pong following its
+responses the packets of the polled update type only go to the requester.
+"""
+
+# standard library
+from argparse import ArgumentParser
+from collections import defaultdict, deque
+import logging
+
+# project
+from ottd_ctrl.admin_client import ConnectionClosedByPeer
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT, AdminUpdateTypeStr
+from ottd_ctrl.const import NetworkErrorCode, PacketTypes as PT, PacketTypesStr, PacketUpdateTypes
+from ottd_ctrl.const import date_update_frequencies
+from ottd_ctrl.packet import AdminPingPacket, AdminUpdateFrequenciesPacket, ServerErrorPacket, ServerPacket
+from ottd_ctrl.packet import PacketDecodeError, ServerPongPacket, decode_admin_packet, size_fmt, size_len, type_len
+from ottd_ctrl.protocol import FieldDecodeError
+from ottd_ctrl.session import UNSUBSCRIBE_FREQUENCY, Session
+from ottd_ctrl.unix_server import DEFAULT_MAX_BUFFERED_BYTES, RECV_SIZE, Peer, UnixSocketServer
+
+# admin packets forwarded upstream as is
+FORWARDED_PACKET_TYPES = (PT.ADMIN_PACKET_ADMIN_CHAT, PT.ADMIN_PACKET_ADMIN_GAMESCRIPT)
+PERIODIC_FREQUENCIES = (AUF.ADMIN_FREQUENCY_DAILY | AUF.ADMIN_FREQUENCY_WEEKLY | AUF.ADMIN_FREQUENCY_MONTHLY |
+                        AUF.ADMIN_FREQUENCY_QUARTERLY | AUF.ADMIN_FREQUENCY_ANUALLY)
+
+
+def _reencoded(pkt):
+    """Returns the raw data of a received server packet"""
+    return pkt.encode(**{name: getattr(pkt, name) for name, _ in pkt._fields})
+
+
+class ProxyClient(Peer):
+    def __init__(self, sock):
+        """An admin client connected to the proxy"""
+        super().__init__(sock)
+        self.in_buffer = bytearray()
+        self.joined = False
+        self.name = None
+        # {AdminUpdateType: AdminUpdateFrequency}
+        self.update_frequencies = {}
+        # {AdminUpdateType: number of polls waiting for their responses}
+        self.pending_polls = defaultdict(int)
+
+    def wants(self, update_type, update_frequency):
+        return self.update_frequencies.get(update_type, 0) & update_frequency
+
+    def frames(self):
+        """Yields the complete raw packets received, raises PacketDecodeError on a size shorter than a header"""
+        while len(self.in_buffer) >= size_len:
+            packet_size = size_fmt.unpack_from(self.in_buffer)[0]
+            if packet_size < size_len + type_len:
+                # the following bytes cannot be framed anymore
+                self.in_buffer.clear()
+                raise PacketDecodeError('invalid packet size %s' % packet_size)
+            if len(self.in_buffer) < packet_size:
+                break
+            raw_data = bytes(self.in_buffer[:packet_size])
+            del self.in_buffer[:packet_size]
+            yield raw_data
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+
+class AdminProxy(UnixSocketServer):
+    peer_class = ProxyClient
+    thread_name = 'admin-proxy'
+    log_name = 'proxy'
+
+    def __init__(self, upstream, path, password=None, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES):
+        """
+        :param upstream: A Session, the server is joined by start() if not yet, it must not be used
+                         by anything else while the proxy runs. Packets are forwarded in the order
+                         they are received and sent, so priority dispatch, the outbound scheduler
+                         and non-blocking sockets are not supported
+        :param path: Path of the Unix socket to listen on, a stale socket file is replaced
+        :param password: Password of the clients, defaults to the password of the upstream session
+        :param max_buffered_bytes: Clients not reading their packets are disconnected
+                                   once this many bytes are waiting for them
+        """
+        if upstream.inbound_queue is not None or upstream.outbound_queue is not None or upstream.nonblocking:
+            # pongs would overtake poll responses and forwarded packets would overtake queued ones
+            raise Exception('The upstream session of a proxy must not dispatch by priority, '
+                            'schedule outbound packets or use a non-blocking socket')
+        super().__init__(path, max_buffered_bytes)
+        self.upstream = upstream
+        self.password = password if password is not None else upstream.password
+        self.current_date = None
+        # {AdminUpdateType: AdminUpdateFrequency} requested upstream
+        self.upstream_frequencies = {}
+        # raw PROTOCOL and WELCOME packets sent to joining clients
+        self._join_frames = None
+        # clients waiting for an rcon result, in the order of their commands
+        self._rcon_requesters = deque()
+        # {upstream ping data: (client, client ping data or None, polled update type or None)}
+        self._pings = {}
+        self._next_ping_data = 0
+        # {AdminUpdateType: number of polls waiting for their responses, including the ones of closed clients}
+        self._pending_polls = defaultdict(int)
+        self.nb_frames_received = 0
+        self.nb_frames_forwarded = 0
+
+    @property
+    def clients(self):
+        return self.peers
+
+    # #### running ###############################################################
+    def join_upstream(self):
+        """Joins the server if needed, subscribes to daily dates"""
+        if not self.upstream.is_connected:
+            self.upstream.join_server()
+        self._join_frames = (_reencoded(self.upstream.protocol_packet) +
+                             _reencoded(self.upstream.welcome_packet))
+        self._set_upstream_frequency(AUT.ADMIN_UPDATE_DATE, AUF.ADMIN_FREQUENCY_DAILY)
+
+    def start(self):
+        """Joins the server and serves in a background thread"""
+        self.join_upstream()
+        return super().start()
+
+    def serve_forever(self):
+        if self._join_frames is None:
+            self.join_upstream()
+        self.log.info('Serving admin clients on %s', self.path)
+        super().serve_forever()
+
+    def _sockets(self):
+        rlist, wlist = super()._sockets()
+        return rlist + [self.upstream.socket], wlist
+
+    def _on_readable(self, sock):
+        if sock is self.upstream.socket:
+            self._receive_upstream()
+        else:
+            super()._on_readable(sock)
+
+    # #### upstream ##############################################################
+    def _receive_upstream(self):
+        """Routes a received server packet, returns False if the connection to the server is lost"""
+        try:
+            packet_size, raw_data = self.upstream.receive_frame()
+        except ConnectionClosedByPeer:
+            self.log.error('Server closed the connection')
+            self._on_upstream_lost()
+            return False
+        except OSError as e:
+            # e.g. a timeout in the middle of a packet or a reset connection
+            self.log.error('Connection to the server lost: %s', e)
+            self.upstream.disconnect()
+            self._on_upstream_lost()
+            return False
+        self.nb_frames_received += 1
+        self._route(raw_data)
+        return True
+
+    def _on_upstream_lost(self):
+        """Closes the clients once their pending packets are sent and stops serving"""
+        for client in list(self.clients):
+            client.closing = True
+            self._flush(client)
+        self._stop = True
+
+    def _route(self, raw_data):
+        packet_type = raw_data[size_len]
+        if packet_type == PT.ADMIN_PACKET_SERVER_PONG:
+            return self._on_pong(ServerPacket.decode(len(raw_data), raw_data).data)
+        if packet_type in (PT.ADMIN_PACKET_SERVER_RCON, PT.ADMIN_PACKET_SERVER_RCON_END):
+            if not self._rcon_requesters:
+                self.log.warning('Received %s without command', PacketTypesStr[packet_type])
+                return
+            requester = (self._rcon_requesters.popleft() if packet_type == PT.ADMIN_PACKET_SERVER_RCON_END
+                         else self._rcon_requesters[0])
+            if requester in self.clients:
+                self._send(requester, raw_data)
+            return
+
+        update_type = PacketUpdateTypes.get(packet_type)
+        if update_type is None:
+            # new game, shutdown, errors...
+            for client in list(self.clients):
+                if client.joined:
+                    self._send(client, raw_data)
+            return
+        update_frequency = AUF.ADMIN_FREQUENCY_AUTOMATIC
+        if update_type == AUT.ADMIN_UPDATE_DATE:
+            self.current_date = ServerPacket.decode(len(raw_data), raw_data).date
+            update_frequency = date_update_frequencies(self.current_date)
+        elif update_type in (AUT.ADMIN_UPDATE_COMPANY_ECONOMY, AUT.ADMIN_UPDATE_COMPANY_STATS):
+            # sent after the date of the day they are due
+            update_frequency = (date_update_frequencies(self.current_date) if self.current_date is not None
+                                else PERIODIC_FREQUENCIES)
+        if self._pending_polls[update_type] > 0:
+            # possibly a response, only for the requesters
+            recipients = [c for c in self.clients if c.pending_polls[update_type] > 0]
+        else:
+            recipients = [c for c in self.clients if c.wants(update_type, update_frequency)]
+        for client in recipients:
+            if client.joined:
+                self._send(client, raw_data)
+
+    def _on_pong(self, data):
+        entry = self._pings.pop(data, None)
+        if entry is None:
+            self.log.debug('Received unexpected pong %s', data)
+            return
+        client, client_data, polled_update_type = entry
+        if polled_update_type is not None:
+            self._pending_polls[polled_update_type] -= 1
+        if client not in self.clients:
+            return
+        if polled_update_type is not None:
+            # the responses to the poll have all been received
+            client.pending_polls[polled_update_type] -= 1
+        else:
+            self._send(client, ServerPongPacket.encode(data=client_data))
+
+    def _ping_upstream(self, client, client_data=None, polled_update_type=None):
+        data = self._next_ping_data
+        self._next_ping_data = (data + 1) & 0xFFFFFFFF
+        self._pings[data] = (client, client_data, polled_update_type)
+        self.upstream.send_packet(AdminPingPacket(data=data))
+
+    def _set_upstream_frequency(self, update_type, update_frequency):
+        if self.upstream_frequencies.get(update_type, UNSUBSCRIBE_FREQUENCY) == update_frequency:
+            return
+        self.log.debug('Upstream frequency of %s: %s', AdminUpdateTypeStr[update_type], update_frequency)
+        self.upstream.send_packet(AdminUpdateFrequenciesPacket(update_type=update_type,
+                                                               update_frequency=update_frequency))
+        self.upstream_frequencies[update_type] = update_frequency
+
+    def _merge_frequencies(self, update_type):
+        """Requests upstream the union of the frequencies requested by the clients for given update type"""
+        if update_type == AUT.ADMIN_UPDATE_DATE:
+            # always received daily, the clients get the dates according to their frequency
+            return
+        update_frequency = UNSUBSCRIBE_FREQUENCY
+        for client in self.clients:
+            update_frequency |= client.update_frequencies.get(update_type, 0)
+        self._set_upstream_frequency(update_type, update_frequency)
+
+    # #### clients ###############################################################
+    def _accept(self):
+        client = super()._accept()
+        if client is not None:
+            self.log.debug('Admin client connected')
+        return client
+
+    def _receive(self, client):
+        try:
+            data = client.socket.recv(RECV_SIZE)
+        except (BlockingIOError, ConnectionError):
+            data = None
+        if not data:
+            if data is not None:
+                self._close(client)
+            return
+        if client.closing:
+            # waiting for the error to be sent
+            return
+        client.in_buffer += data
+        try:
+            for raw_data in client.frames():
+                self._handle_packet(client, raw_data)
+                if client.closing or client not in self.clients:
+                    break
+        except PacketDecodeError as e:
+            self.log.warning('Disconnecting %r: %s', client, e)
+            self._send_error(client, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+
+    def _send(self, client, raw_data):
+        # a client too slow is disconnected before the next wait
+        if self._queue(client, raw_data):
+            self.nb_frames_forwarded += 1
+            self._flush(client)
+
+    def _close(self, client):
+        if client in self.clients:
+            super()._close(client)
+            self.log.debug('Admin client %s disconnected', client.name)
+            if self.upstream.is_connected:
+                for update_type in client.update_frequencies:
+                    self._merge_frequencies(update_type)
+
+    def _send_error(self, client, error):
+        client.closing = True
+        self._send(client, ServerErrorPacket.encode(error=error))
+
+    def _handle_packet(self, client, raw_data):
+        try:
+            packet_type, values = decode_admin_packet(raw_data)
+        except FieldDecodeError as e:
+            self.log.warning('Invalid %s from %r: %s', PacketTypesStr.get(raw_data[size_len]), client, e)
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        if values is None:
+            self.log.warning('Unknown admin packet type %s', packet_type)
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        if not client.joined and packet_type != PT.ADMIN_PACKET_ADMIN_JOIN:
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_NOT_EXPECTED)
+        if packet_type in FORWARDED_PACKET_TYPES:
+            return self.upstream.send_frame(raw_data)
+        handler = {
+            PT.ADMIN_PACKET_ADMIN_JOIN:             self._on_join,
+            PT.ADMIN_PACKET_ADMIN_QUIT:             self._on_quit,
+            PT.ADMIN_PACKET_ADMIN_UPDATE_FREQUENCY: self._on_update_frequency,
+            PT.ADMIN_PACKET_ADMIN_POLL:             self._on_poll,
+            PT.ADMIN_PACKET_ADMIN_RCON:             self._on_rcon,
+            PT.ADMIN_PACKET_ADMIN_PING:             self._on_ping,
+        }[packet_type]
+        handler(client, raw_data, **values)
+
+    def _on_join(self, client, raw_data, password, name, version):
+        if client.joined:
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_NOT_EXPECTED)
+        if password != self.password:
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_WRONG_PASSWORD)
+        client.joined = True
+        client.name = name
+        self.log.info('Admin client %s joined', name)
+        self._send(client, self._join_frames)
+
+    def _on_quit(self, client, raw_data):
+        self._close(client)
+
+    def _on_update_frequency(self, client, raw_data, update_type, update_frequency):
+        supported = self.upstream.supported_update_frequencies.get(update_type, 0)
+        if supported & update_frequency != update_frequency:
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        client.update_frequencies[update_type] = update_frequency
+        self._merge_frequencies(update_type)
+
+    def _on_poll(self, client, raw_data, update_type, d1):
+        if not self.upstream.supported_update_frequencies.get(update_type, 0) & AUF.ADMIN_FREQUENCY_POLL:
+            return self._send_error(client, NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET)
+        client.pending_polls[update_type] += 1
+        self._pending_polls[update_type] += 1
+        self.upstream.send_frame(raw_data)
+        # the server answers in order, the pong comes after the last response to the poll
+        self._ping_upstream(client, polled_update_type=update_type)
+
+    def _on_rcon(self, client, raw_data, command):
+        self._rcon_requesters.append(client)
+        self.upstream.send_frame(raw_data)
+
+    def _on_ping(self, client, raw_data, data):
+        self._ping_upstream(client, client_data=data)
+
+
+def parse_args():
+    ap = ArgumentParser(description='Shares one admin connection between local admin clients')
+    ap.add_argument('--server-host', default='localhost')
+    ap.add_argument('--server-port', type=int, default=3977)
+    ap.add_argument('--server-password', required=True)
+    ap.add_argument('--socket', required=True, help='Path of the Unix socket to listen on')
+    ap.add_argument('--password', default=None, help='Password of the admin clients (default: server password)')
+    ap.add_argument('--verbose', action='store_true')
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    upstream = Session('ottd_ctrl-proxy', args.server_password, '1', args.server_host, args.server_port)
+    proxy = AdminProxy(upstream, args.socket, args.password)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.stop()
+        if upstream.is_connected:
+            upstream.quit_server()
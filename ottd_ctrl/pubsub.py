@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fans the packets received by a session out to local processes
+
+Each received packet is serialized once as a JSON line and written to every
+process connected to a Unix socket, adding a consumer neither adds load on the
+admin server nor decodes packets again:
+
+    session.start_publisher('/run/ottd/events.sock')
+
+    # in another process
+    for event in iter_events('/run/ottd/events.sock'):
+        print(event['type'], event['date'], event['fields'])
+
+Each subscriber has a bounded buffer, a subscriber not reading fast enough is
+disconnected instead of delaying the session or the other subscribers.
+"""
+
+# standard library
+from datetime import date
+import json
+import socket
+
+# project
+from ottd_ctrl.const import PacketTypesStr
+from ottd_ctrl.unix_server import DEFAULT_MAX_BUFFERED_BYTES, RECV_SIZE, Peer, UnixSocketServer
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def encode_event(pkt, game_date=None):
+    """Returns a received packet as a JSON line: {"type": ..., "date": ..., "fields": {...}}"""
+    event = {
+        'type': PacketTypesStr.get(pkt.type_, pkt.type_),
+        'date': game_date,
+        'fields': {name: getattr(pkt, name, None) for name, _ in pkt._fields},
+    }
+    return json.dumps(event, separators=(',', ':'), default=_json_default).encode('utf-8') + b'\n'
+
+
+def iter_events(path, timeout_s=None):
+    """
+    Connects to a publisher and yields its events as dicts, ends when the publisher closes the connection
+    :param timeout_s: Timeout of each read, socket.timeout is raised if no event is received meanwhile
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout_s)
+    try:
+        sock.connect(path)
+        buffer = b''
+        while True:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                return
+            buffer += data
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                yield json.loads(line.decode('utf-8'))
+    finally:
+        sock.close()
+
+
+class Subscriber(Peer):
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.socket.fileno())
+
+
+class EventPublisher(UnixSocketServer):
+    peer_class = Subscriber
+    thread_name = 'event-publisher'
+    log_name = 'publisher'
+
+    def __init__(self, path, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES):
+        """
+        Writes published events to the processes connected to a Unix socket, from a background thread
+        :param path: Path of the Unix socket to listen on, a stale socket file is replaced
+        :param max_buffered_bytes: Subscribers are disconnected once this many bytes are waiting for them
+        """
+        super().__init__(path, max_buffered_bytes)
+        self.nb_published = 0
+
+    @property
+    def subscribers(self):
+        return self.peers
+
+    def start(self):
+        super().start()
+        self.log.info('Publishing events on %s', self.path)
+        return self
+
+    def publish(self, pkt, game_date=None):
+        """Queues a received packet for all the subscribers, does nothing without subscriber"""
+        if not self.peers:
+            return
+        line = encode_event(pkt, game_date)
+        wake = False
+        with self._lock:
+            for subscriber in self.peers:
+                # the writing thread only waits for subscribers with something to write
+                was_empty = not subscriber.out_buffer
+                if self._queue(subscriber, line):
+                    wake = wake or was_empty
+                elif subscriber.too_slow:
+                    # disconnected by the writing thread
+                    wake = True
+        self.nb_published += 1
+        if wake:
+            self.wake()
+
+    def _accept(self):
+        subscriber = super()._accept()
+        if subscriber is not None:
+            self.log.info('Subscriber connected, %s subscribers', len(self.peers))
+        return subscriber
+
+    def _receive(self, subscriber):
+        """Subscribers send nothing, a readable socket means a disconnection"""
+        try:
+            data = subscriber.socket.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(subscriber)
+
+    def _close(self, subscriber):
+        if subscriber in self.peers:
+            super()._close(subscriber)
+            self.log.info('Subscriber disconnected, %s subscribers', len(self.peers))
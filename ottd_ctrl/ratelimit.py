@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """
+        A token bucket, tokens are added at a constant rate up to burst tokens
+        :param rate: Tokens added per second
+        :param burst: Maximum number of tokens in the bucket, defaults to rate
+        :param clock: A callable returning the current time in seconds
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self._last_time = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last_time) * self.rate)
+        self._last_time = now
+
+    def consume(self, nb=1):
+        """Takes nb tokens if available, returns True if so"""
+        self._refill()
+        if self.tokens >= nb:
+            self.tokens -= nb
+            return True
+        return False
+
+    def time_until_available(self, nb=1):
+        """Returns the number of seconds until nb tokens are available"""
+        self._refill()
+        if self.tokens >= nb:
+            return 0
+        return (nb - self.tokens) / self.rate
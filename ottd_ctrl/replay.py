@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from collections import defaultdict
+import logging
+import mmap
+import time
+
+# project
+from ottd_ctrl.capture import DIRECTION_RECEIVED, iter_records, segment_data, segment_paths
+from ottd_ctrl.const import PacketTypesStr
+from ottd_ctrl.packet import PacketDecodeError, size_fmt, size_len, type_len
+
+
+class ReplaySocket:
+    """Stands for the socket of a client fed by a CaptureReplayer, keeps what the client sends"""
+    family = None
+
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(bytes(data))
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, value):
+        pass
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class PacketTypeStats:
+    def __init__(self):
+        self.count = 0
+        self.decode_ns = 0
+        self.callbacks_ns = 0
+
+
+class ReplayStats:
+    def __init__(self):
+        self.nb_packets = 0
+        self.nb_dropped = 0
+        self.elapsed_s = 0.0
+        self.by_type = defaultdict(PacketTypeStats)
+
+    @property
+    def packets_per_s(self):
+        return self.nb_packets / self.elapsed_s if self.elapsed_s else 0.0
+
+    def as_dict(self):
+        return {
+            'packets': self.nb_packets,
+            'dropped': self.nb_dropped,
+            'elapsed_s': self.elapsed_s,
+            'packets_per_s': self.packets_per_s,
+            'by_type': {PacketTypesStr.get(packet_type, str(packet_type)): {
+                'count': stats.count,
+                'mean_decode_us': stats.decode_ns / stats.count / 1000 if stats.count else 0.0,
+                'mean_callbacks_us': stats.callbacks_ns / stats.count / 1000 if stats.count else 0.0,
+            } for packet_type, stats in self.by_type.items()},
+        }
+
+    def report(self):
+        """Returns a human readable report"""
+        lines = ['{} packets in {:.3f}s ({:.0f} packets/s), {} dropped'.format(
+            self.nb_packets, self.elapsed_s, self.packets_per_s, self.nb_dropped)]
+        for name, stats in sorted(self.as_dict()['by_type'].items(), key=lambda i: -i[1]['count']):
+            lines.append('{:<40} {:>10} decode {:>8.2f}us callbacks {:>8.2f}us'.format(
+                name, stats['count'], stats['mean_decode_us'], stats['mean_callbacks_us']))
+        return '\n'.join(lines)
+
+
+class CaptureReplayer:
+    def __init__(self, path_prefix, realtime=False, speed=1.0):
+        """
+        Feeds the packets received in a capture to a client, without socket
+        :param path_prefix: Prefix of the capture segments, see capture.CaptureRecorder
+        :param realtime: If True packets are fed at the recorded pace, otherwise as fast as possible
+        :param speed: Pace multiplier when realtime is True
+        """
+        self.path_prefix = path_prefix
+        self.realtime = realtime
+        self.speed = speed
+        self.log = logging.getLogger('replay')
+
+    def iter_frames(self):
+        """
+        Yields (monotonic timestamp ns, packet size, raw data) of the received packets,
+        raises PacketDecodeError if a record does not split into whole packets, e.g. in a corrupted capture
+        """
+        for path in segment_paths(self.path_prefix):
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    header, data = segment_data(buffer)
+                    try:
+                        for direction, timestamp_ns, raw_data in iter_records(data):
+                            if direction != DIRECTION_RECEIVED:
+                                continue
+                            index = 0
+                            while index < len(raw_data):
+                                packet_size = (size_fmt.unpack_from(raw_data, index)[0]
+                                               if index + size_len <= len(raw_data) else 0)
+                                if packet_size < size_len + type_len or index + packet_size > len(raw_data):
+                                    raise PacketDecodeError('invalid packet size %s at %s of a record of %s in %s'
+                                                            % (packet_size, index, timestamp_ns, path))
+                                yield timestamp_ns, packet_size, raw_data[index:index + packet_size]
+                                index += packet_size
+                    finally:
+                        # the map cannot be closed while a view on it exists
+                        if isinstance(data, memoryview):
+                            data.release()
+
+    def replay(self, client, max_packets=None):
+        """
+        Feeds the captured packets to the client (e.g. a Session), returns ReplayStats,
+        packets sent by the client are kept in client.socket.sent
+        :param client: An AdminClient, if not connected its socket is replaced by a ReplaySocket
+        :param max_packets: Stops after this number of packets
+        """
+        if client.socket is None:
+            client.socket = ReplaySocket()
+        stats = ReplayStats()
+        first_timestamp_ns = None
+        start_ns = time.perf_counter_ns()
+        for timestamp_ns, packet_size, raw_data in self.iter_frames():
+            if getattr(client, 'stop', False) or (max_packets is not None and stats.nb_packets >= max_packets):
+                break
+            if self.realtime:
+                if first_timestamp_ns is None:
+                    first_timestamp_ns = timestamp_ns
+                delay_s = ((timestamp_ns - first_timestamp_ns) / self.speed -
+                           (time.perf_counter_ns() - start_ns)) / 1e9
+                if delay_s > 0:
+                    time.sleep(delay_s)
+            t0 = time.perf_counter_ns()
+            pkt = client.decode_frame(packet_size, raw_data)
+            t1 = time.perf_counter_ns()
+            stats.nb_packets += 1
+            if pkt is None:
+                stats.nb_dropped += 1
+                continue
+            client.dispatch_packet(pkt)
+            t2 = time.perf_counter_ns()
+            type_stats = stats.by_type[pkt.type_]
+            type_stats.count += 1
+            type_stats.decode_ns += t1 - t0
+            type_stats.callbacks_ns += t2 - t1
+        stats.elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9
+        self.log.info('Replayed %s packets at %.0f packets/s', stats.nb_packets, stats.packets_per_s)
+        return stats
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timers run by the session main loop, without threads
+
+    session.timers.call_every(600, session.send_public_chat, 'Visit our website!')
+    session.date_triggers.every_quarter(lambda date: session.send_rcon('save auto'))
+
+Wall clock timers are kept in a heap, the main loop waits for packets exactly
+until the next timer is due. Game date triggers run when date updates are
+received, they need the date update type.
+"""
+
+# standard library
+from datetime import date as Date
+import heapq
+import itertools
+import logging
+import math
+import time
+
+
+class Timer:
+    def __init__(self, when, interval_s, callback, args, kwargs):
+        self.when = when
+        # None for a one shot timer
+        self.interval_s = interval_s
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        """The timer is removed from its scheduler the next time it is due"""
+        self.cancelled = True
+
+    def __repr__(self):
+        return '{}({}, when={:.3f}, interval={})'.format(self.__class__.__name__,
+                                                         getattr(self.callback, '__name__', self.callback),
+                                                         self.when, self.interval_s)
+
+
+class TimerScheduler:
+    def __init__(self, clock=time.monotonic):
+        """
+        Runs callbacks at given times
+        :param clock: A callable returning the current time in seconds
+        """
+        self.clock = clock
+        self.log = logging.getLogger('scheduler')
+        # [(when, sequence number, Timer), ...], the sequence number keeps insertion order for equal times
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return sum(1 for _, _, timer in self._heap if not timer.cancelled)
+
+    def _push(self, timer):
+        heapq.heappush(self._heap, (timer.when, next(self._counter), timer))
+        return timer
+
+    def call_at(self, when, callback, *args, **kwargs):
+        """Calls callback(*args, **kwargs) once at given clock time, returns the Timer"""
+        return self._push(Timer(when, None, callback, args, kwargs))
+
+    def call_later(self, delay_s, callback, *args, **kwargs):
+        """Calls callback(*args, **kwargs) once in delay_s, returns the Timer"""
+        return self.call_at(self.clock() + delay_s, callback, *args, **kwargs)
+
+    def call_every(self, interval_s, callback, *args, first_delay_s=None, **kwargs):
+        """
+        Calls callback(*args, **kwargs) every interval_s, returns the Timer
+        :param first_delay_s: Delay before the first call, defaults to interval_s
+        """
+        if interval_s <= 0:
+            raise Exception('Interval must be positive, got %s' % interval_s)
+        first_delay_s = interval_s if first_delay_s is None else first_delay_s
+        return self._push(Timer(self.clock() + first_delay_s, interval_s, callback, args, kwargs))
+
+    def run(self):
+        """Calls the due callbacks, returns the number of seconds until the next one, math.inf if none"""
+        now = self.clock()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, timer = heapq.heappop(heap)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args, **timer.kwargs)
+            except Exception:
+                self.log.exception('Error while executing timer %r', timer)
+            if timer.interval_s is not None and not timer.cancelled:
+                timer.when += timer.interval_s
+                if timer.when <= now:
+                    # a late timer is not called again to catch up
+                    timer.when = now + timer.interval_s
+                self._push(timer)
+        return self.time_until_next()
+
+    def time_until_next(self):
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return math.inf
+        return max(0, heap[0][0] - self.clock())
+
+
+def _next_quarter_start(date):
+    """Returns the first day of the quarter following date"""
+    month = (date.month - 1) // 3 * 3 + 4
+    return Date(date.year + 1, 1, 1) if month > 12 else Date(date.year, month, 1)
+
+
+class DateTrigger:
+    def __init__(self, next_date_fn, callback, args, kwargs, once=False, may_trigger_first_day=True):
+        """
+        :param next_date_fn: A callable returning the first date to trigger at after a given date
+        :param once: If True the trigger is removed once called
+        :param may_trigger_first_day: If True the trigger may be called with the first date received
+        """
+        self.next_date_fn = next_date_fn
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.once = once
+        self.may_trigger_first_day = may_trigger_first_day
+        # set on the first date received
+        self.next_date = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return '{}({}, next_date={})'.format(self.__class__.__name__,
+                                             getattr(self.callback, '__name__', self.callback), self.next_date)
+
+
+class DateScheduler:
+    def __init__(self):
+        """Runs callbacks at game dates, fed with the received dates, see run()"""
+        self.log = logging.getLogger('scheduler')
+        # [(date ordinal, sequence number, DateTrigger), ...]
+        self._heap = []
+        # triggers waiting for a first date to compute their next date
+        self._new = []
+        self._counter = itertools.count()
+        self.last_date = None
+
+    def __len__(self):
+        return sum(1 for trigger in self._new if not trigger.cancelled) + \
+            sum(1 for _, _, trigger in self._heap if not trigger.cancelled)
+
+    def _add(self, trigger):
+        self._new.append(trigger)
+        return trigger
+
+    def every_days(self, nb_days, callback, *args, **kwargs):
+        """
+        Calls callback(date, *args, **kwargs) every nb_days game days, counted from
+        the first date received after the call, returns the DateTrigger
+        """
+        if nb_days <= 0:
+            raise Exception('Number of days must be positive, got %s' % nb_days)
+        return self._add(DateTrigger(lambda d: Date.fromordinal(d.toordinal() + nb_days),
+                                     callback, args, kwargs, may_trigger_first_day=False))
+
+    def every_quarter(self, callback, *args, **kwargs):
+        """Calls callback(date, *args, **kwargs) on the first day of each quarter, returns the DateTrigger"""
+        return self._add(DateTrigger(_next_quarter_start, callback, args, kwargs))
+
+    def at(self, date, callback, *args, **kwargs):
+        """
+        Calls callback(date, *args, **kwargs) once the game reaches date, right away
+        with the next date received if it is already past, returns the DateTrigger
+        """
+        return self._add(DateTrigger(lambda d: date, callback, args, kwargs, once=True))
+
+    def _push(self, trigger):
+        heapq.heappush(self._heap, (trigger.next_date.toordinal(), next(self._counter), trigger))
+
+    def reset(self):
+        """Computes the next dates again from the next date received, e.g. on a new game"""
+        self._new.extend(trigger for _, _, trigger in self._heap if not trigger.cancelled)
+        self._heap = []
+        self.last_date = None
+
+    def run(self, date):
+        """Calls the triggers due at given game date"""
+        if self.last_date is not None and date < self.last_date:
+            # new game or date changed by hand
+            self.reset()
+        self.last_date = date
+        for trigger in self._new:
+            if not trigger.cancelled:
+                after = Date.fromordinal(date.toordinal() - 1) if trigger.may_trigger_first_day else date
+                trigger.next_date = trigger.next_date_fn(after)
+                self._push(trigger)
+        self._new = []
+
+        ordinal = date.toordinal()
+        heap = self._heap
+        while heap and heap[0][0] <= ordinal:
+            _, _, trigger = heapq.heappop(heap)
+            if trigger.cancelled:
+                continue
+            try:
+                trigger.callback(date, *trigger.args, **trigger.kwargs)
+            except Exception:
+                self.log.exception('Error while executing date trigger %r', trigger)
+            if not trigger.once and not trigger.cancelled:
+                trigger.next_date = trigger.next_date_fn(date)
+                self._push(trigger)
@@ -2,22 +2,68 @@
 
 # standard library
 from contextlib import contextmanager
+import logging
 import math
 from select import select
 import time
 
 # project
-from .admin_client import AdminClient, CallbackPrepend
+from .admin_client import AdminClient, CallbackAppend, CallbackPrepend, ConnectionClosedByPeer
 from .packet import *
-from .const import AdminUpdateFrequencyStr, AdminUpdateTypeStr
-from .const import DestType, PacketTypes as PT
+from .const import AdminUpdateFrequency, AdminUpdateFrequencyStr, AdminUpdateTypeStr
+from .const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from .const import DestType, PacketTypes as PT, PacketUpdateTypes
 from .const import NetworkAction, NetworkErrorCodeStr
+from .keepalive import DEFAULT_PING_INTERVAL_S, DEFAULT_PONG_TIMEOUT_S, PingMonitor
+from .metrics import Histogram
+from .pubsub import DEFAULT_MAX_BUFFERED_BYTES, EventPublisher
+from .poll import POLL_ALL, DEFAULT_MAX_INTERVAL_S, DEFAULT_MIN_INTERVAL_S, PollScheduler
+from .scheduler import DateScheduler, TimerScheduler
+from .sim_speed import SimSpeedMonitor
+from .snapshot import DEFAULT_MAX_CLIENTS, DEFAULT_MAX_COMPANIES, SnapshotWriter
+
+# Maximum time the main loop waits for packets, due jobs wake it up earlier,
+# bounds the time needed to notice stop set from another thread
+MAIN_LOOP_TIMEOUT_S = 5
+
+# Sent as update frequency to stop receiving updates of a given type
+UNSUBSCRIBE_FREQUENCY = 0x00
+
+# Delays between reconnection attempts, the last one is repeated
+RECONNECT_DELAYS_S = (1, 2, 5, 10, 30)
+
+# Frequencies used for automatic subscriptions, by order of preference
+AUTO_SUBSCRIBE_FREQUENCIES = {
+    AUT.ADMIN_UPDATE_DATE:              [AUF.ADMIN_FREQUENCY_DAILY],
+    AUT.ADMIN_UPDATE_CLIENT_INFO:       [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+    AUT.ADMIN_UPDATE_COMPANY_INFO:      [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+    AUT.ADMIN_UPDATE_COMPANY_ECONOMY:   [AUF.ADMIN_FREQUENCY_WEEKLY, AUF.ADMIN_FREQUENCY_MONTHLY,
+                                         AUF.ADMIN_FREQUENCY_QUARTERLY, AUF.ADMIN_FREQUENCY_ANUALLY],
+    AUT.ADMIN_UPDATE_COMPANY_STATS:     [AUF.ADMIN_FREQUENCY_WEEKLY, AUF.ADMIN_FREQUENCY_MONTHLY,
+                                         AUF.ADMIN_FREQUENCY_QUARTERLY, AUF.ADMIN_FREQUENCY_ANUALLY],
+    AUT.ADMIN_UPDATE_CHAT:              [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+    AUT.ADMIN_UPDATE_CONSOLE:           [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+    AUT.ADMIN_UPDATE_CMD_LOGGING:       [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+    AUT.ADMIN_UPDATE_GAMESCRIPT:        [AUF.ADMIN_FREQUENCY_AUTOMATIC],
+}
+
+# Public hooks which are not packet callbacks but need an update type
+HOOK_UPDATE_TYPES = {
+    'on_new_day':       AUT.ADMIN_UPDATE_DATE,
+    'on_new_month':     AUT.ADMIN_UPDATE_DATE,
+    'on_new_year':      AUT.ADMIN_UPDATE_DATE,
+    'on_server_lag':    AUT.ADMIN_UPDATE_DATE,
+}
 
 
 class NotAllPacketReceived(Exception):
     pass
 
 
+class UnsupportedUpdateFrequency(Exception):
+    pass
+
+
 class Session(AdminClient):
     def __init__(self,
                  client_name,
@@ -27,7 +73,9 @@ class Session(AdminClient):
                  server_port,
                  timeout_s=None,
                  update_frequencies=None,
-                 client_welcome_message=None):
+                 client_welcome_message=None,
+                 initial_polls=None,
+                 auto_subscribe=False):
         """
         A convenience class which inherits from AdminClient,
         keeps track of some data such as the current date and provides helper
@@ -41,12 +89,23 @@ class Session(AdminClient):
         :param update_frequencies: {AdminUpdateType: AdminUpdateFrequency, ...}
         :param client_welcome_message: A message which will be sent to a connected client,
                                        string or sequence of strings
+        :param initial_polls: [(AdminUpdateType, d1), ...], polls sent once the server is joined
+        :param auto_subscribe: If True we only subscribe to the update types consumed
+                               by overridden on_XXX() hooks and registered callbacks,
+                               update_frequencies is then only used to choose the frequencies
         """
+        # set before registering callbacks, see register_callback()
+        self.auto_subscribe = auto_subscribe
+        self.supported_update_frequencies = None
+        # {AdminUpdateType: AdminUpdateFrequency, ...} currently registered on the server
+        self._subscriptions = {}
+
         super().__init__(server_host, server_port, timeout_s)
 
         self.log = logging.getLogger('session')
 
         self._update_frequencies = update_frequencies or {}
+        self._initial_polls = initial_polls or []
 
         self._pkt_callbacks = {
             None:                                   [self._on_packet, self.on_packet],
@@ -62,14 +121,20 @@ class Session(AdminClient):
             PT.ADMIN_PACKET_SERVER_CLIENT_INFO:     [self._on_client_info, self.on_client_info],
             PT.ADMIN_PACKET_SERVER_CLIENT_UPDATE:   [self._on_client_update, self.on_client_update],
             PT.ADMIN_PACKET_SERVER_CLIENT_QUIT:     [self._on_client_quit, self.on_client_quit],
-            PT.ADMIN_PACKET_SERVER_COMPANY_NEW:     self.on_company_new,
-            PT.ADMIN_PACKET_SERVER_COMPANY_UPDATE:  self.on_company_update,
-            PT.ADMIN_PACKET_SERVER_COMPANY_INFO:    self.on_company_info,
+            PT.ADMIN_PACKET_SERVER_CLIENT_ERROR:    [self._on_client_error, self.on_client_error],
+            PT.ADMIN_PACKET_SERVER_COMPANY_NEW:     [self._on_company_new, self.on_company_new],
+            PT.ADMIN_PACKET_SERVER_COMPANY_UPDATE:  [self._on_company_update, self.on_company_update],
+            PT.ADMIN_PACKET_SERVER_COMPANY_INFO:    [self._on_company_info, self.on_company_info],
             PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY: self.on_company_economy,
             PT.ADMIN_PACKET_SERVER_COMPANY_STATS:   self.on_company_stats,
+            PT.ADMIN_PACKET_SERVER_COMPANY_REMOVE:  [self._on_company_remove, self.on_company_remove],
             PT.ADMIN_PACKET_SERVER_CHAT:            [self._on_chat, self.on_chat],
+            PT.ADMIN_PACKET_SERVER_PONG:            [self._on_pong, self.on_pong],
         }
         self.register_callbacks(self._pkt_callbacks, position=CallbackPrepend)
+        self._own_callbacks = set()
+        for callbacks in self._pkt_callbacks.values():
+            self._own_callbacks.update(callbacks if isinstance(callbacks, list) else [callbacks])
 
         self.client_name = client_name
         self.password = password
@@ -79,20 +144,52 @@ class Session(AdminClient):
         self.welcome_packet = None
         self.protocol_packet = None
 
-        self.supported_update_frequencies = None
-
         self.stop = False
         self._server_joined = False
+        # seconds between connecting and being ready (joined, subscribed and polled)
+        self.time_to_ready_s = None
 
         self.last_received_date = None
         self.current_date = None
 
         # Set when we send an rcon package
         self._current_rcon_request = None
+        self.rcon_latency_ns = Histogram()
+
+        # {client_id: ServerClientInfoPacket or None until received, ...}
+        # complete only when subscribed to ADMIN_UPDATE_CLIENT_INFO
+        self.clients = {}
+        # {company_id: ServerCompanyInfoPacket or None until received, ...}
+        # complete only when subscribed to ADMIN_UPDATE_COMPANY_INFO
+        self.companies = {}
+
+        # number of times the server has been joined
+        self.nb_joins = 0
+
+        # round trip times, keepalive pings, see enable_keepalive()
+        self.ping_monitor = PingMonitor(self.send_packet)
+        self.keepalive_reconnect = False
+
+        # seconds per game day, measured from the date updates
+        self.sim_speed = SimSpeedMonitor()
+
+        # wall clock timers and game date triggers, run by the main loop
+        self.timers = TimerScheduler()
+        self.date_triggers = DateScheduler()
+
+        # polls update types at an interval adapted to how often they change
+        self.poll_scheduler = PollScheduler(self.send_packet)
+
+        # see start_metrics_server()
+        self.metrics_server = None
+        # see start_publisher()
+        self.publisher = None
+        # see start_snapshot()
+        self.snapshot = None
 
     def _format_company_welcome_msg(self):
         if not isinstance(self.client_welcome_message, (list, tuple)):
-            message = list(self.client_welcome_message)
+            message = [self.client_welcome_message]
         else:
             message = self.client_welcome_message
         return ['-' * 20] + list(message) + ['-' * 20]
@@ -100,21 +197,58 @@ class Session(AdminClient):
     def _set_update_frequencies(self, update_frequencies):
         [self.set_update_frequency(*u_type_freq) for u_type_freq in update_frequencies.items()]
 
+    def _send_initial_polls(self):
+        for update_type, d1 in self._initial_polls:
+            self.send_packet(AdminPollPacket(update_type=update_type, d1=d1))
+
+    def _bootstrap_packets(self, update_frequencies):
+        """Returns the join, update frequencies and poll packets sent by a pipelined join"""
+        packets = [AdminJoinPacket(password=self.password,
+                                   name=self.client_name,
+                                   version=self.client_version)]
+        packets += [AdminUpdateFrequenciesPacket(update_type=update_type,
+                                                 update_frequency=update_frequency)
+                    for update_type, update_frequency in update_frequencies.items()]
+        packets += [AdminPollPacket(update_type=update_type, d1=d1)
+                    for update_type, d1 in self._initial_polls]
+        return packets
+
     @contextmanager
-    def quitting_server(self):
-        self.join_server()
+    def quitting_server(self, pipelined=False):
+        self.join_server(pipelined=pipelined)
         try:
             yield self
         finally:
             self.quit_server()
 
-    def join_server(self):
+    def join_server(self, pipelined=False):
+        """
+        Connects and joins the server, then registers update frequencies and sends initial polls
+        :param pipelined: If True join, update frequencies and polls are sent in a single burst
+                          without waiting for the server, update frequencies are validated
+                          once the PROTOCOL packet is received, automatic subscriptions
+                          guessed meanwhile are then replaced by supported frequencies
+        """
         if self.is_connected:
             raise Exception('Already connected to server')
+        start_time = time.perf_counter()
         self.connect()
-        self.send_packet(AdminJoinPacket(password=self.password,
-                                         name=self.client_name,
-                                         version=self.client_version))
+        self.nb_joins += 1
+        self.clients.clear()
+        self.companies.clear()
+        self.ping_monitor.reset()
+        self.sim_speed.reset()
+        if self.auto_subscribe:
+            # before the PROTOCOL packet we can only guess the frequencies
+            update_frequencies = self.required_update_frequencies()
+        else:
+            update_frequencies = self._update_frequencies
+        if pipelined:
+            self.send_packets(self._bootstrap_packets(update_frequencies))
+        else:
+            self.send_packet(AdminJoinPacket(password=self.password,
+                                             name=self.client_name,
+                                             version=self.client_version))
         self.wait_for_packets(packet_types=[PT.ADMIN_PACKET_SERVER_PROTOCOL,
                                             PT.ADMIN_PACKET_SERVER_WELCOME],
                               timeout_s=5)
@@ -125,8 +259,39 @@ class Session(AdminClient):
         else:
             self.log.error("Could not jon server")
 
-        if self._update_frequencies:
-            self._set_update_frequencies(self._update_frequencies)
+        if pipelined:
+            # already sent, we can only check them now
+            try:
+                if self.auto_subscribe:
+                    # the frequencies guessed before the PROTOCOL packet are replaced by supported ones
+                    self._subscriptions = dict(update_frequencies)
+                    self._update_subscriptions()
+                    update_frequencies = self._subscriptions
+                else:
+                    for update_type, update_frequency in update_frequencies.items():
+                        self._check_update_frequency(update_type, update_frequency)
+                for update_type, _ in self._initial_polls:
+                    self._check_update_frequency(update_type, AdminUpdateFrequency.ADMIN_FREQUENCY_POLL)
+            except UnsupportedUpdateFrequency:
+                # the server got the subscriptions, we do not stay connected half set up
+                self.disconnect()
+                self._server_joined = False
+                raise
+        else:
+            if self.auto_subscribe:
+                update_frequencies = self.required_update_frequencies()
+            if update_frequencies:
+                self._set_update_frequencies(update_frequencies)
+            self._send_initial_polls()
+        self._subscriptions = dict(update_frequencies)
+        if not self.auto_subscribe:
+            unused = set(update_frequencies) - self.required_update_types()
+            if unused:
+                self.log.warning('Subscribed to unused update types: %s',
+                                 ', '.join(AdminUpdateTypeStr[t] for t in sorted(unused)))
+
+        self.time_to_ready_s = time.perf_counter() - start_time
+        self.log.info('Server ready in %.3fs', self.time_to_ready_s)
 
         self.on_server_joined()
 
@@ -139,19 +304,90 @@ class Session(AdminClient):
         if self._current_rcon_request is not None:
             self.log.error('Sending RCON while RCON request in progress')
         pkt = AdminRConPacket(command=command)
+        start_ns = time.perf_counter_ns()
         self.send_packet(pkt)
         self._current_rcon_request = {
             'packet': pkt,
             'results': []
         }
         pkt = self.wait_for_packet(PT.ADMIN_PACKET_SERVER_RCON_END, timeout_s)
-        self.log.debug("Result for RCON command '%s': ", command)
-        for line in self._current_rcon_request['results']:
-            self.log.info(line)
+        self.rcon_latency_ns.observe(time.perf_counter_ns() - start_ns)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("Result for RCON command '%s':\n%s", command,
+                           '\n'.join(self._current_rcon_request['results']))
         results = self._current_rcon_request['results']
         self._current_rcon_request = None
         return results
 
+    def send_ping(self):
+        """Sends a ping, rtt_s is set when the pong is received, returns the ping data"""
+        return self.ping_monitor.send_ping()
+
+    @property
+    def rtt_s(self):
+        """Round trip time of the last ping"""
+        return self.ping_monitor.rtt_s
+
+    @property
+    def rtt_ns(self):
+        """Histogram of the round trip times"""
+        return self.ping_monitor.rtt_ns
+
+    def enable_keepalive(self, interval_s=DEFAULT_PING_INTERVAL_S, timeout_s=DEFAULT_PONG_TIMEOUT_S,
+                         reconnect=True):
+        """
+        The main loop pings the server every interval_s, if a ping is not answered within timeout_s
+        the connection is considered lost, on_connection_lost() is called and the server is joined
+        again if reconnect is True, otherwise the main loop stops
+        """
+        self.ping_monitor.interval_s = interval_s
+        self.ping_monitor.timeout_s = timeout_s
+        self.keepalive_reconnect = reconnect
+
+    def disable_keepalive(self):
+        self.ping_monitor.interval_s = None
+        self.keepalive_reconnect = False
+
+    def _run_keepalive(self):
+        """Pings the server and handles lost connections, returns the seconds until the next check"""
+        if self.ping_monitor.interval_s is not None and self.ping_monitor.timed_out():
+            self.ping_monitor.nb_timeouts += 1
+            self.log.warning('No pong for %.1fs, connection lost', self.ping_monitor.oldest_pending_age_s())
+            self._connection_lost()
+            return 0
+        return self.ping_monitor.run()
+
+    def _connection_lost(self):
+        self.on_connection_lost()
+        if self.keepalive_reconnect:
+            self.reconnect()
+        else:
+            self.stop = True
+
+    def reconnect(self):
+        """Drops the connection and joins the server again, retrying until it succeeds or stop is set"""
+        self.disconnect()
+        self._server_joined = False
+        attempt = 0
+        while not self.stop:
+            try:
+                self.join_server()
+                if self._server_joined:
+                    return
+                reason = 'server not joined'
+            except Exception as e:
+                # e.g. the server restarted with other supported frequencies
+                reason = e
+            delay_s = RECONNECT_DELAYS_S[min(attempt, len(RECONNECT_DELAYS_S) - 1)]
+            self.log.warning('Reconnection failed (%s), next attempt in %ss', reason, delay_s)
+            self.disconnect()
+            attempt += 1
+            time.sleep(delay_s)
+
+    @property
+    def nb_reconnects(self):
+        return max(0, self.nb_joins - 1)
+
     def send_public_chat(self, message):
         """
         Sends a public chat message
@@ -207,20 +443,218 @@ class Session(AdminClient):
     def set_update_frequency(self, update_type, update_frequency):
         """Checks if given frequency is supported by server, if not raises an error"""
         if self.supported_update_frequencies is not None:
-            if update_type not in self.supported_update_frequencies:
-                raise Exception('Unknown update type %s' % update_type)
-            if not self.supported_update_frequencies[update_type] & update_frequency:
-                raise Exception('Frequency %s not supported for type %s' %
-                                (AdminUpdateFrequencyStr[update_frequency],
-                                 AdminUpdateTypeStr[update_type]))
+            self._check_update_frequency(update_type, update_frequency)
             self.send_packet(AdminUpdateFrequenciesPacket(update_type=update_type,
                                                           update_frequency=update_frequency))
         else:
             self.log.warning('Setting update frequencies without knowing supported frequencies')
 
+    def register_callback(self, packet_type, callback, position=CallbackAppend):
+        super().register_callback(packet_type, callback, position)
+        self._update_subscriptions()
+
+    def unregister_callback(self, packet_type, callback):
+        super().unregister_callback(packet_type, callback)
+        self._update_subscriptions()
+
+    def register_keyed_callback(self, packet_type, key, callback, position=CallbackAppend):
+        super().register_keyed_callback(packet_type, key, callback, position)
+        self._update_subscriptions()
+
+    def unregister_keyed_callback(self, packet_type, key, callback):
+        super().unregister_keyed_callback(packet_type, key, callback)
+        self._update_subscriptions()
+
+    def required_update_types(self):
+        """
+        Returns the update types consumed by overridden on_XXX() hooks, by callbacks
+        registered with register_(keyed_)callback(), by the welcome message and by date triggers
+        """
+        required = set()
+        for packet_type, callbacks in self.callbacks.items():
+            update_type = PacketUpdateTypes.get(packet_type)
+            if update_type is None:
+                continue
+            for cb in callbacks:
+                if cb not in self._own_callbacks or self._is_overridden(cb):
+                    required.add(update_type)
+                    break
+        for packet_type in self.keyed_callbacks:
+            if packet_type in PacketUpdateTypes:
+                required.add(PacketUpdateTypes[packet_type])
+        for hook_name, update_type in HOOK_UPDATE_TYPES.items():
+            if self._is_overridden(getattr(self, hook_name)):
+                required.add(update_type)
+        if self.client_welcome_message:
+            required.add(AUT.ADMIN_UPDATE_CLIENT_INFO)
+        if len(self.date_triggers) > 0:
+            required.add(AUT.ADMIN_UPDATE_DATE)
+        return required
+
+    def required_update_frequencies(self):
+        """
+        Returns {AdminUpdateType: AdminUpdateFrequency, ...} for the required update types,
+        the frequencies given to the constructor are preferred, then AUTO_SUBSCRIBE_FREQUENCIES
+        """
+        res = {}
+        for update_type in self.required_update_types():
+            if update_type in self._update_frequencies:
+                res[update_type] = self._update_frequencies[update_type]
+                continue
+            preferred = AUTO_SUBSCRIBE_FREQUENCIES.get(update_type)
+            if not preferred:
+                # poll only update types, nothing to subscribe to
+                continue
+            if self.supported_update_frequencies is not None:
+                supported = self.supported_update_frequencies.get(update_type, 0)
+                preferred = [f for f in preferred if f & supported]
+                if not preferred:
+                    self.log.warning('No automatic frequency supported for %s',
+                                     AdminUpdateTypeStr[update_type])
+                    continue
+            res[update_type] = preferred[0]
+        return res
+
+    def _update_subscriptions(self):
+        """(Un)subscribes update types according to required_update_frequencies()"""
+        if (not self.auto_subscribe or
+                not self.is_connected or
+                self.supported_update_frequencies is None):
+            return
+        required = self.required_update_frequencies()
+        for update_type in set(self._subscriptions) - set(required):
+            self.log.debug('Unsubscribing from %s', AdminUpdateTypeStr[update_type])
+            self.send_packet(AdminUpdateFrequenciesPacket(update_type=update_type,
+                                                          update_frequency=UNSUBSCRIBE_FREQUENCY))
+            del self._subscriptions[update_type]
+        for update_type, update_frequency in required.items():
+            if self._subscriptions.get(update_type) != update_frequency:
+                self.set_update_frequency(update_type, update_frequency)
+                self._subscriptions[update_type] = update_frequency
+
+    def _is_overridden(self, method):
+        """Returns True if given bound method is a Session hook overridden by a subclass"""
+        func = getattr(method, '__func__', None)
+        if func is None or getattr(method, '__self__', None) is not self:
+            return False
+        base_func = getattr(Session, func.__name__, None)
+        return base_func is not None and func is not base_func and not func.__name__.startswith('_')
+
+    def start_metrics_server(self, host='127.0.0.1', port=None, refresh_interval_s=None):
+        """
+        Enables metrics and serves them in the Prometheus format on a background thread,
+        see prometheus.MetricsExporter
+        :param port: Defaults to prometheus.DEFAULT_PORT
+        :param refresh_interval_s: Defaults to prometheus.DEFAULT_REFRESH_INTERVAL_S
+        """
+        # imported here, the HTTP server is only needed by the sessions serving metrics
+        from .prometheus import DEFAULT_PORT, DEFAULT_REFRESH_INTERVAL_S, MetricsExporter
+        port = port if port is not None else DEFAULT_PORT
+        refresh_interval_s = refresh_interval_s if refresh_interval_s is not None else DEFAULT_REFRESH_INTERVAL_S
+        self.stop_metrics_server()
+        self.enable_metrics()
+        self.metrics_server = MetricsExporter(self, host, port, refresh_interval_s).start()
+        return self.metrics_server
+
+    def stop_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+    def start_publisher(self, path, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES):
+        """
+        Publishes the received packets to the processes connected to a Unix socket,
+        see pubsub.EventPublisher, returns the started publisher
+        """
+        self.stop_publisher()
+        self.publisher = EventPublisher(path, max_buffered_bytes).start()
+        self.register_callback(None, self._publish)
+        return self.publisher
+
+    def stop_publisher(self):
+        if self.publisher is not None:
+            self.unregister_callback(None, self._publish)
+            self.publisher.stop()
+            self.publisher = None
+
+    def start_snapshot(self, name, max_clients=DEFAULT_MAX_CLIENTS, max_companies=DEFAULT_MAX_COMPANIES):
+        """
+        Writes the clients, companies, economies and current date to a shared memory block
+        from the main loop, see snapshot.SnapshotWriter, returns the writer
+        """
+        self.stop_snapshot()
+        self.snapshot = SnapshotWriter(name, max_clients, max_companies)
+        self.register_callback(None, self._on_snapshot_packet)
+        return self.snapshot
+
+    def stop_snapshot(self):
+        if self.snapshot is not None:
+            self.unregister_callback(None, self._on_snapshot_packet)
+            self.snapshot.close()
+            self.snapshot = None
+
+    def _on_snapshot_packet(self, pkt):
+        self.snapshot.on_packet(pkt)
+
+    def write_snapshot(self):
+        """Writes the snapshot if packets changed it, called by the main loop once per batch of packets"""
+        if self.snapshot is not None and self.snapshot.dirty:
+            self.snapshot.write(self.current_date, self.clients, self.companies)
+        return math.inf
+
+    def _publish(self, pkt):
+        # generic callbacks are called before the date is updated
+        game_date = pkt.date if pkt.type_ == PT.ADMIN_PACKET_SERVER_DATE else self.current_date
+        self.publisher.publish(pkt, game_date)
+
+    def schedule_poll(self, update_type, d1=POLL_ALL,
+                      min_interval_s=DEFAULT_MIN_INTERVAL_S,
+                      max_interval_s=DEFAULT_MAX_INTERVAL_S):
+        """
+        Polls given update type from the main loop, the interval between polls
+        adapts to how often the responses change
+        :param update_type: AdminUpdateType
+        :param d1: Poll parameter, e.g. a client id, POLL_ALL for all clients or companies
+        :param min_interval_s: Interval used when responses always change
+        :param max_interval_s: Interval used when responses never change
+        """
+        if self.supported_update_frequencies is not None:
+            self._check_update_frequency(update_type, AdminUpdateFrequency.ADMIN_FREQUENCY_POLL)
+        return self.poll_scheduler.schedule(update_type, d1, min_interval_s, max_interval_s)
+
+    def _check_update_frequency(self, update_type, update_frequency):
+        """Raises an error if given frequency is not supported by server"""
+        if update_type not in self.supported_update_frequencies:
+            raise UnsupportedUpdateFrequency('Unknown update type %s' % update_type)
+        if not self.supported_update_frequencies[update_type] & update_frequency:
+            raise UnsupportedUpdateFrequency('Frequency %s not supported for type %s' %
+                            (AdminUpdateFrequencyStr[update_frequency],
+                             AdminUpdateTypeStr[update_type]))
+
+    def _run_jobs(self):
+        """
+        Runs due timers, polls, queued packets, pings and the snapshot,
+        returns the number of seconds until the next one
+        """
+        return min(MAIN_LOOP_TIMEOUT_S, self.timers.run(), self.poll_scheduler.run(),
+                   self.flush_outbound(), self._run_keepalive(), self.write_snapshot())
+
     def main_loop(self):
         while not self.stop:
-            self.receive_packets(timeout_s=5)
+            timeout_s = self._run_jobs()
+            try:
+                if len(self._wait_readable(timeout_s)) > 0:
+                    self.receive_packets(timeout_s=0)
+            except (OSError, ConnectionClosedByPeer) as e:
+                if not self.keepalive_reconnect:
+                    raise
+                self.log.warning('Connection lost: %s', e)
+                self._connection_lost()
+
+    def decode_frame(self, packet_size, raw_data):
+        header_size = size_len + type_len
+        self.poll_scheduler.on_frame(raw_data[size_len], raw_data[header_size:packet_size])
+        return super().decode_frame(packet_size, raw_data)
 
     def quit_server(self):
         self.send_packet(AdminQuitPacket())
@@ -236,7 +670,8 @@ class Session(AdminClient):
         while remaining_s > 0:
             start_time = time.time()
             pkt = self.receive_packet()
-            if pkt.type_ == packet_type:
+            self.flush_outbound()
+            if pkt is not None and pkt.type_ == packet_type:
                 return pkt
             elapsed_s = time.time() - start_time
             remaining_s -= elapsed_s
@@ -251,16 +686,83 @@ class Session(AdminClient):
         packets_to_receive = set(packet_types)
         remaining_s = timeout_s if timeout_s is not None else math.inf
         while remaining_s > 0:
+            start_time = time.time()
             pkt = self.receive_packet()
-            packet_type = pkt.type_
-            packets_to_receive.discard(packet_type)
-            if packet_type in packet_types:
-                received_packets.setdefault(packet_type, []).append(pkt)
-            if len(packets_to_receive) == 0:
-                return received_packets
+            self.flush_outbound()
+            if pkt is not None:
+                packet_type = pkt.type_
+                packets_to_receive.discard(packet_type)
+                if packet_type in packet_types:
+                    received_packets.setdefault(packet_type, []).append(pkt)
+                if len(packets_to_receive) == 0:
+                    return received_packets
+            elapsed_s = time.time() - start_time
+            remaining_s -= elapsed_s
         else:
             raise TimeoutError()
 
+    def iter_packets(self, types=None, predicate=None, timeout_s=None):
+        """
+        Yields the received packets as they arrive, registered callbacks are called
+        before a packet is yielded, timers, polls and pings are run while waiting
+        like in main_loop(), the iteration ends when stop is set
+
+            for pkt in session.iter_packets(types=[PT.ADMIN_PACKET_SERVER_CHAT]):
+                ...
+
+        :param types: Packet types to yield, None for all
+        :param predicate: A callable taking a packet, only packets for which it returns True are yielded
+        :param timeout_s: The iteration ends if no packet is yielded within timeout_s, None to wait forever
+        """
+        types = set(types) if types is not None else None
+        deadline = self._deadline(timeout_s)
+        while True:
+            received, pkt = self._receive_before(deadline, self.receive_packet)
+            if not received:
+                return
+            if (pkt is None or
+                    (types is not None and pkt.type_ not in types) or
+                    (predicate is not None and not predicate(pkt))):
+                continue
+            yield pkt
+            deadline = self._deadline(timeout_s)
+
+    def iter_frames(self, types=None, timeout_s=None):
+        """
+        Yields (packet size, raw data) of the received packets as they arrive, the packets are
+        neither decoded nor passed to callbacks, the session state (date, clients...) is then
+        not updated, the iteration ends when stop is set
+        :param types: Packet types to yield, None for all
+        :param timeout_s: The iteration ends if no frame is yielded within timeout_s, None to wait forever
+        """
+        types = set(types) if types is not None else None
+        deadline = self._deadline(timeout_s)
+        while True:
+            received, frame = self._receive_before(deadline, self.receive_frame)
+            if not received:
+                return
+            if types is not None and frame[1][size_len] not in types:
+                continue
+            yield frame
+            deadline = self._deadline(timeout_s)
+
+    @staticmethod
+    def _deadline(timeout_s):
+        return time.monotonic() + timeout_s if timeout_s is not None else math.inf
+
+    def _receive_before(self, deadline, receive):
+        """
+        Runs jobs and waits until a packet can be received, returns (True, receive()),
+        or (False, None) if stop is set or deadline (time.monotonic()) is reached first
+        """
+        while not self.stop:
+            remaining_s = deadline - time.monotonic()
+            if remaining_s <= 0:
+                break
+            if len(self._wait_readable(min(self._run_jobs(), remaining_s))) > 0:
+                return True, receive()
+        return False, None
+
     def receive_packets(self, nb=None, timeout_s=0):
         """
         Receives packets if there are some
@@ -269,16 +771,35 @@ class Session(AdminClient):
         """
         self.log.debug('receiving packets')
         nb_received = 0
-        rlist, wlist, xlist = select([self.socket], [], [], timeout_s)
+        rlist = self._wait_readable(timeout_s)
         while len(rlist) > 0 and not self.stop:
             if nb is not None and nb_received >= nb:
                 break
             self.receive_packet()
             nb_received += 1
-            rlist, wlist, xlist = select([self.socket], [], [], timeout_s)
+            rlist = self._wait_readable(timeout_s)
         if nb is not None and nb_received < nb:
             raise NotAllPacketReceived()
 
+    def _wait_readable(self, timeout_s):
+        """
+        Returns a non empty list if a packet can be received without waiting more than timeout_s,
+        queued outbound packets and buffered data are sent while waiting
+        """
+        if self.has_pending_packets():
+            return [self.socket]
+        end_time = time.monotonic() + timeout_s
+        while True:
+            outbound_wait_s = self.flush_outbound()
+            remaining_s = max(0, end_time - time.monotonic())
+            # waiting for writability only when there is something to write
+            wlist = [self.socket] if self.has_unsent_data() else []
+            rlist, wlist, xlist = select([self.socket], wlist, [], min(remaining_s, outbound_wait_s))
+            if len(wlist) > 0:
+                self._flush_send_buffer()
+            if len(rlist) > 0 or (len(wlist) == 0 and outbound_wait_s >= remaining_s):
+                return rlist
+
     # we store data coming from server directly in the received packets
     @property
     def server_name(self):
@@ -291,7 +812,7 @@ class Session(AdminClient):
     # #### private callback on packet reception ######################################
     # #### these are not supposed to ne overridden
     def _on_packet(self, pkt):
-        self.log.debug('Received %s', str(pkt))
+        self.log.debug('Received %s', pkt)
 
     def _on_welcome(self, pkt):
         self.welcome_packet = pkt
@@ -303,6 +824,8 @@ class Session(AdminClient):
 
     def _on_date(self, pkt):
         self.current_date = pkt.date
+        if self.sim_speed.on_date(pkt.date, len(self.clients), len(self.companies)):
+            self.on_server_lag(self.sim_speed.seconds_per_day())
         if self.last_received_date is not None:
             if self.last_received_date.year < self.current_date.year:
                 self.on_new_year(self.current_date)
@@ -317,6 +840,7 @@ class Session(AdminClient):
                 self.on_new_day(self.current_date)
 
         self.last_received_date = self.current_date
+        self.date_triggers.run(self.current_date)
 
     def _on_rcon(self, pkt):
         if self._current_rcon_request is None:
@@ -330,6 +854,11 @@ class Session(AdminClient):
 
     def _on_new_game(self, pkt):
         self.log.info('New game')
+        self.companies.clear()
+        self.sim_speed.reset()
+        self.date_triggers.reset()
+        if self.deduplicator is not None:
+            self.deduplicator.reset()
 
     def _on_server_shutdown(self, pkt):
         self.stop = True
@@ -339,6 +868,7 @@ class Session(AdminClient):
         self.log.info('Error: %s', NetworkErrorCodeStr[pkt.error])
 
     def _on_client_join(self, pkt):
+        self.clients.setdefault(pkt.client_id, None)
         # sending a welcome message if set
         if self.client_welcome_message:
             for line in self._format_company_welcome_msg():
@@ -348,13 +878,44 @@ class Session(AdminClient):
                                                  message=line))
 
     def _on_client_info(self, pkt):
-        pass
+        self.clients[pkt.client_id] = pkt
 
     def _on_client_update(self, pkt):
-        pass
+        info = self.clients.get(pkt.client_id)
+        if info is not None:
+            info.client_name = pkt.client_name
+            info.client_play_as = pkt.client_play_as
 
     def _on_client_quit(self, pkt):
-        pass
+        self.clients.pop(pkt.client_id, None)
+        if self.deduplicator is not None:
+            self.deduplicator.forget('client_id', pkt.client_id)
+
+    def _on_client_error(self, pkt):
+        # the client is disconnected
+        self._on_client_quit(pkt)
+
+    def _on_company_new(self, pkt):
+        self.companies.setdefault(pkt.company_id, None)
+        if self.deduplicator is not None:
+            self.deduplicator.forget('company_id', pkt.company_id)
+
+    def _on_company_info(self, pkt):
+        self.companies[pkt.company_id] = pkt
+
+    def _on_company_update(self, pkt):
+        info = self.companies.get(pkt.company_id)
+        if info is not None:
+            for name, _ in pkt._fields:
+                setattr(info, name, getattr(pkt, name))
+
+    def _on_company_remove(self, pkt):
+        self.companies.pop(pkt.company_id, None)
+        if self.deduplicator is not None:
+            self.deduplicator.forget('company_id', pkt.company_id)
+
+    def _on_pong(self, pkt):
+        self.ping_monitor.on_pong(pkt.data)
 
     def _on_chat(self, pkt):
         pass
@@ -367,6 +928,10 @@ class Session(AdminClient):
     def on_server_quit(self):
         pass
 
+    def on_connection_lost(self):
+        """Called when the keepalive detects a lost connection, before reconnecting"""
+        pass
+
     # ## packet callbacks ####################################################
     def on_packet(self, pkt):
         pass
@@ -389,6 +954,13 @@ class Session(AdminClient):
     def on_new_year(self, date):
         pass
 
+    def on_server_lag(self, seconds_per_day):
+        """
+        Called when a game day starts lasting longer than normal, see SimSpeedMonitor,
+        self.clients and self.companies give the load of the server
+        """
+        pass
+
     def on_rcon(self, pkt):
         pass
 
@@ -416,6 +988,9 @@ class Session(AdminClient):
     def on_client_quit(self, pkt):
         pass
 
+    def on_client_error(self, pkt):
+        pass
+
     def on_company_new(self, pkt):
         pass
 
@@ -425,6 +1000,9 @@ class Session(AdminClient):
     def on_company_info(self, pkt):
         pass
 
+    def on_company_remove(self, pkt):
+        pass
+
     def on_company_economy(self, pkt):
         pass
 
@@ -434,3 +1012,6 @@ class Session(AdminClient):
     def on_chat(self, pkt):
         pass
 
+    def on_pong(self, pkt):
+        pass
+
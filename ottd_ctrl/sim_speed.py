@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Server simulation speed measured from the cadence of the date updates
+
+A game day lasts 74 ticks of 30ms, a server taking longer than that per day
+cannot keep up with its map, its clients or its scripts. Measures need the
+date update type with the daily frequency, longer frequencies work but react
+more slowly.
+"""
+
+# standard library
+from collections import deque
+import logging
+import math
+import time
+
+# 74 ticks of 30ms
+NORMAL_SECONDS_PER_DAY = 2.22
+# sliding windows in game days, the first one is used to detect lag
+DEFAULT_WINDOWS_DAYS = (10, 100)
+# the server lags when a day lasts this many times longer than normal
+DEFAULT_LAG_RATIO = 1.25
+# more time without date update is taken as a pause, measures start again
+DEFAULT_MAX_GAP_S = 60
+
+
+def _pearson(xs, ys):
+    """Returns the correlation coefficient of xs and ys, None if one of them is constant"""
+    n = len(xs)
+    if n < 2:
+        return None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if var_x == 0 or var_y == 0:
+        return None
+    return cov / math.sqrt(var_x * var_y)
+
+
+class SimSpeedMonitor:
+    def __init__(self, windows_days=DEFAULT_WINDOWS_DAYS,
+                 lag_ratio=DEFAULT_LAG_RATIO,
+                 max_gap_s=DEFAULT_MAX_GAP_S,
+                 clock=time.monotonic):
+        """
+        Computes wall clock seconds per game day over sliding windows of game days
+        :param windows_days: Window sizes in game days, lag is detected over the first one
+        :param lag_ratio: The server lags when seconds per day exceed NORMAL_SECONDS_PER_DAY * lag_ratio
+        :param max_gap_s: Longer intervals between date updates are taken as a pause
+        :param clock: A callable returning the current time in seconds
+        """
+        self.windows_days = tuple(windows_days)
+        self.lag_ratio = lag_ratio
+        self.max_gap_s = max_gap_s
+        self.clock = clock
+        self.log = logging.getLogger('sim_speed')
+        # (time received, date ordinal, number of clients, number of companies), oldest first
+        self.samples = deque(maxlen=max(self.windows_days) + 1)
+        self.lagging = False
+        # number of times the server started lagging
+        self.nb_lags = 0
+
+    def reset(self):
+        """Forgets the samples, e.g. on a new connection or a new game"""
+        self.samples.clear()
+        self.lagging = False
+
+    def on_date(self, date, nb_clients=0, nb_companies=0):
+        """
+        Records a date update, returns True if the server just started lagging
+        :param nb_clients: Number of clients on the server, see correlation()
+        :param nb_companies: Number of companies in the game, see correlation()
+        """
+        now = self.clock()
+        ordinal = date.toordinal()
+        if self.samples:
+            last_time, last_ordinal, _, _ = self.samples[-1]
+            if ordinal <= last_ordinal or now - last_time > self.max_gap_s:
+                # new game, date changed by hand or game paused
+                self.samples.clear()
+        self.samples.append((now, ordinal, nb_clients, nb_companies))
+
+        seconds_per_day = self.seconds_per_day()
+        if seconds_per_day is None:
+            return False
+        lagging = seconds_per_day > NORMAL_SECONDS_PER_DAY * self.lag_ratio
+        started = lagging and not self.lagging
+        if started:
+            self.nb_lags += 1
+            self.log.warning('Server lagging: %.2fs per day over %s days (normal: %ss), %s clients, %s companies',
+                             seconds_per_day, self.windows_days[0], NORMAL_SECONDS_PER_DAY,
+                             nb_clients, nb_companies)
+        elif self.lagging and not lagging:
+            self.log.info('Server caught up: %.2fs per day', seconds_per_day)
+        self.lagging = lagging
+        return started
+
+    def seconds_per_day(self, window_days=None):
+        """
+        Returns the average wall clock duration of a game day over the last window_days,
+        None until the samples span a whole window
+        :param window_days: Defaults to the first window
+        """
+        window_days = window_days if window_days is not None else self.windows_days[0]
+        if len(self.samples) < 2:
+            return None
+        last_time, last_ordinal, _, _ = self.samples[-1]
+        for sample_time, ordinal, _, _ in reversed(self.samples):
+            if last_ordinal - ordinal >= window_days:
+                return (last_time - sample_time) / (last_ordinal - ordinal)
+        return None
+
+    @property
+    def speed_ratio(self):
+        """Simulation speed compared to normal over the first window, 1.0 is full speed, None if unknown"""
+        seconds_per_day = self.seconds_per_day()
+        return NORMAL_SECONDS_PER_DAY / seconds_per_day if seconds_per_day else None
+
+    def correlation(self):
+        """
+        Returns {'clients': r, 'companies': r}, the correlation coefficients between
+        day durations and the number of clients and companies over the samples,
+        a value close to 1 means the server slows down as they grow, None if unknown
+        """
+        durations, clients, companies = [], [], []
+        previous = None
+        for sample in self.samples:
+            if previous is not None:
+                durations.append((sample[0] - previous[0]) / (sample[1] - previous[1]))
+                clients.append(sample[2])
+                companies.append(sample[3])
+            previous = sample
+        return {'clients': _pearson(durations, clients),
+                'companies': _pearson(durations, companies)}
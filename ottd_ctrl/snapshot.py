@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Publishes the state of a session in shared memory for local processes
+
+The session writes its clients, companies with their economy and the current
+date into a fixed layout shared memory block, readers copy it without any round
+trip to the session:
+
+    session.start_snapshot('ottd_snapshot')
+
+    # in another process
+    reader = SnapshotReader('ottd_snapshot')
+    state = reader.read()  # {'date': ..., 'clients': [...], 'companies': [...], ...}
+
+The block starts with a sequence number, odd while the session writes. A reader
+copies the block between two reads of the sequence number and starts again if
+it changed, so it never sees a half written state and never blocks the session.
+Economies are only known when subscribed to ADMIN_UPDATE_COMPANY_ECONOMY.
+"""
+
+# standard library
+from datetime import date as Date
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import logging
+import struct
+import sys
+import time
+
+# project
+from ottd_ctrl.const import PacketTypes as PT
+
+MAGIC = b'OTSS'
+LAYOUT_VERSION = 1
+# names are truncated to this many bytes of UTF-8
+NAME_SIZE = 64
+DEFAULT_MAX_CLIENTS = 255
+DEFAULT_MAX_COMPANIES = 15
+# number of times a reader copies the block before giving up
+DEFAULT_MAX_RETRIES = 1000
+
+# the sequence number comes first, aligned for the writes of other processes
+SEQUENCE = struct.Struct('<Q')
+# sequence number, magic, layout version, max clients, max companies,
+# nb clients, nb companies, date ordinal (0 if unknown), time of the write (time.time())
+HEADER = struct.Struct('<Q4sHHHHHxxId')
+# client id, play as, language, join date ordinal, name, address
+CLIENT = struct.Struct('<IBBI%ds%ds' % (NAME_SIZE, NAME_SIZE))
+# company id, colour, is passworded, is AI, inaugurated year, months of bankruptcy, name, manager name,
+# has economy, money, current loan, income, delivered cargo, company value, performance
+COMPANY = struct.Struct('<BB??IB%ds%ds?qQqHQH' % (NAME_SIZE, NAME_SIZE))
+
+# packets changing the snapshot
+SNAPSHOT_PACKET_TYPES = frozenset([
+    PT.ADMIN_PACKET_SERVER_WELCOME,
+    PT.ADMIN_PACKET_SERVER_NEWGAME,
+    PT.ADMIN_PACKET_SERVER_DATE,
+    PT.ADMIN_PACKET_SERVER_CLIENT_JOIN,
+    PT.ADMIN_PACKET_SERVER_CLIENT_INFO,
+    PT.ADMIN_PACKET_SERVER_CLIENT_UPDATE,
+    PT.ADMIN_PACKET_SERVER_CLIENT_QUIT,
+    PT.ADMIN_PACKET_SERVER_CLIENT_ERROR,
+    PT.ADMIN_PACKET_SERVER_COMPANY_NEW,
+    PT.ADMIN_PACKET_SERVER_COMPANY_INFO,
+    PT.ADMIN_PACKET_SERVER_COMPANY_UPDATE,
+    PT.ADMIN_PACKET_SERVER_COMPANY_REMOVE,
+    PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY,
+])
+
+
+def block_size(max_clients, max_companies):
+    return HEADER.size + max_clients * CLIENT.size + max_companies * COMPANY.size
+
+
+def _encode_name(name):
+    """Returns name as UTF-8 truncated to NAME_SIZE bytes without splitting a character"""
+    return (name or '').encode('utf-8')[:NAME_SIZE].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def _decode_name(raw):
+    return raw.rstrip(b'\x00').decode('utf-8')
+
+
+def _ordinal(date):
+    return date.toordinal() if date is not None else 0
+
+
+def _date(ordinal):
+    return Date.fromordinal(ordinal) if ordinal else None
+
+
+class SnapshotWriter:
+    def __init__(self, name, max_clients=DEFAULT_MAX_CLIENTS, max_companies=DEFAULT_MAX_COMPANIES):
+        """
+        Creates the shared memory block, the only writer of the block, it is removed by close()
+        :param name: Name of the shared memory block, a stale block with the same name is replaced
+        :param max_clients: Clients beyond this number are left out of the snapshot
+        :param max_companies: Companies beyond this number are left out of the snapshot
+        """
+        self.name = name
+        self.max_clients = max_clients
+        self.max_companies = max_companies
+        self.log = logging.getLogger('snapshot')
+        size = block_size(max_clients, max_companies)
+        try:
+            self.shm = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self.log.warning('Replacing existing shared memory block %s', name)
+            stale = SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = SharedMemory(name, create=True, size=size)
+        self.sequence = 0
+        self.nb_writes = 0
+        # {company_id: ServerCompanyEconomyPacket, ...}, the session does not keep them
+        self.economies = {}
+        # set when a packet changed the state, see on_packet()
+        self.dirty = True
+        self.write(None, {}, {})
+
+    def close(self):
+        """Removes the block, readers keep the copy they have attached to"""
+        self.shm.close()
+        self.shm.unlink()
+
+    def on_packet(self, pkt):
+        """Keeps the economies and marks the snapshot as dirty when a received packet changes it"""
+        if pkt.type_ not in SNAPSHOT_PACKET_TYPES:
+            return
+        if pkt.type_ == PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY:
+            self.economies[pkt.company_id] = pkt
+        elif pkt.type_ == PT.ADMIN_PACKET_SERVER_COMPANY_REMOVE:
+            self.economies.pop(pkt.company_id, None)
+        elif pkt.type_ in (PT.ADMIN_PACKET_SERVER_WELCOME, PT.ADMIN_PACKET_SERVER_NEWGAME):
+            self.economies.clear()
+        self.dirty = True
+
+    def write(self, current_date, clients, companies):
+        """
+        Writes the state to the block
+        :param current_date: Current game date or None
+        :param clients: {client_id: ServerClientInfoPacket or None, ...}, clients without information are left out
+        :param companies: {company_id: ServerCompanyInfoPacket or None, ...}, same
+        """
+        clients = [c for c in clients.values() if c is not None][:self.max_clients]
+        companies = [c for c in companies.values() if c is not None][:self.max_companies]
+        buf = self.shm.buf
+
+        # odd while writing
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, 0, self.sequence)
+        offset = HEADER.size
+        for client in clients:
+            CLIENT.pack_into(buf, offset, client.client_id, client.client_play_as, client.client_lang,
+                             _ordinal(client.join_date), _encode_name(client.client_name),
+                             _encode_name(client.client_address))
+            offset += CLIENT.size
+        offset = HEADER.size + self.max_clients * CLIENT.size
+        for company in companies:
+            economy = self.economies.get(company.company_id)
+            if economy is not None:
+                economy_values = (True, economy.money, economy.current_loan, economy.income,
+                                  economy.delivered_cargo, economy.company_value_0, economy.performance_history_0)
+            else:
+                economy_values = (False, 0, 0, 0, 0, 0, 0)
+            COMPANY.pack_into(buf, offset, company.company_id, company.colour, company.is_passworded,
+                              company.is_ai, company.inaugurated_year, company.months_of_bankruptcy,
+                              _encode_name(company.company_name), _encode_name(company.manager_name),
+                              *economy_values)
+            offset += COMPANY.size
+        HEADER.pack_into(buf, 0, self.sequence, MAGIC, LAYOUT_VERSION, self.max_clients, self.max_companies,
+                         len(clients), len(companies), _ordinal(current_date), time.time())
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, 0, self.sequence)
+
+        self.nb_writes += 1
+        self.dirty = False
+
+
+class SnapshotReader:
+    def __init__(self, name, track=False):
+        """
+        Attaches to the block of a SnapshotWriter
+        :param name: Name of the shared memory block
+        :param track: If False the block is not unlinked when this process exits, leave False unless
+                      the writer runs in this process or in a process sharing its resource tracker,
+                      i.e. started by it or starting it with multiprocessing
+        """
+        self.name = name
+        if sys.version_info >= (3, 13):
+            self.shm = SharedMemory(name, track=track)
+        else:
+            self.shm = SharedMemory(name)
+            if not track:
+                # before Python 3.13 attaching registers the block to the resource tracker as if created
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.nb_retries = 0
+
+    def close(self):
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read_raw(self, max_retries=DEFAULT_MAX_RETRIES):
+        """Returns a consistent copy of the block as bytes"""
+        buf = self.shm.buf
+        for _ in range(max_retries):
+            sequence = SEQUENCE.unpack_from(buf, 0)[0]
+            if sequence % 2 == 0:
+                data = bytes(buf)
+                if SEQUENCE.unpack_from(buf, 0)[0] == sequence:
+                    return data
+            self.nb_retries += 1
+            # lets the writer finish
+            time.sleep(0)
+        raise Exception('Snapshot %s kept changing during %s reads' % (self.name, max_retries))
+
+    def read(self, max_retries=DEFAULT_MAX_RETRIES):
+        """
+        Returns the last state written:
+        {'sequence': ..., 'date': date or None, 'updated_at': time.time() of the write,
+         'clients': [{'client_id': ..., ...}, ...], 'companies': [{'company_id': ..., 'economy': {...} or None}, ...]}
+        """
+        return decode_snapshot(self.read_raw(max_retries))
+
+
+def decode_snapshot(data):
+    """Returns the state from a copy of a block, see SnapshotReader.read()"""
+    (sequence, magic, version, max_clients, max_companies,
+     nb_clients, nb_companies, date_ordinal, updated_at) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != LAYOUT_VERSION:
+        raise Exception('Not a snapshot of layout version %s: magic %r, version %s' % (LAYOUT_VERSION, magic, version))
+    clients = []
+    offset = HEADER.size
+    for _ in range(nb_clients):
+        client_id, play_as, lang, join_date, name, address = CLIENT.unpack_from(data, offset)
+        clients.append({'client_id': client_id, 'client_name': _decode_name(name),
+                        'client_address': _decode_name(address), 'client_lang': lang,
+                        'join_date': _date(join_date), 'client_play_as': play_as})
+        offset += CLIENT.size
+    companies = []
+    offset = HEADER.size + max_clients * CLIENT.size
+    for _ in range(nb_companies):
+        (company_id, colour, is_passworded, is_ai, inaugurated_year, months_of_bankruptcy, name, manager,
+         has_economy, money, current_loan, income, delivered_cargo, company_value,
+         performance) = COMPANY.unpack_from(data, offset)
+        economy = None
+        if has_economy:
+            economy = {'money': money, 'current_loan': current_loan, 'income': income,
+                       'delivered_cargo': delivered_cargo, 'company_value': company_value,
+                       'performance': performance}
+        companies.append({'company_id': company_id, 'company_name': _decode_name(name),
+                          'manager_name': _decode_name(manager), 'colour': colour,
+                          'is_passworded': is_passworded, 'is_ai': is_ai, 'inaugurated_year': inaugurated_year,
+                          'months_of_bankruptcy': months_of_bankruptcy, 'economy': economy})
+        offset += COMPANY.size
+    return {'sequence': sequence, 'date': _date(date_ordinal), 'updated_at': updated_at,
+            'clients': clients, 'companies': companies}
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs sessions on many servers across processes
+
+Callbacks of all the sessions of a process share one core because of the GIL,
+the supervisor spreads the servers over worker processes, restarts the workers
+which crash and collects a summary of each session:
+
+    servers = [{'client_name': 'bot', 'password': 'secret', 'client_version': '1',
+                'server_host': host, 'server_port': 3977} for host in hosts]
+    supervisor = Supervisor(servers, session_factory=MyBot, servers_per_worker=4)
+    supervisor.run()  # until stop() is called
+
+    supervisor.state()   # {'host:3977': {'connected': True, 'clients': 12, ...}, ...}
+    supervisor.totals()  # {'servers': 40, 'connected': 39, 'clients': 250, ...}
+
+The sessions of a worker run in threads, a worker exits, and is restarted, as soon
+as one of its sessions stops because of an error.
+"""
+
+# standard library
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+import threading
+import time
+
+# project
+from ottd_ctrl.scheduler import TimerScheduler
+from ottd_ctrl.session import Session
+
+DEFAULT_SUMMARY_INTERVAL_S = 5
+# delays before restarting a worker which crashed, by number of consecutive crashes
+RESTART_DELAYS_S = (1, 2, 5, 10, 30)
+# time given to the workers to quit their servers
+STOP_TIMEOUT_S = 10
+# maximum time the supervisor waits before checking stop
+MAX_WAIT_S = 1
+
+# messages between the supervisor and the workers
+MSG_STOP = 'stop'
+MSG_SUMMARIES = 'summaries'
+
+
+def server_key(session):
+    return '%s:%s' % (session.host, session.port)
+
+
+def session_summary(session):
+    """Returns a picklable summary of the state of a session"""
+    current_date = session.current_date
+    return {
+        'connected': session.is_connected,
+        'server_name': session.server_name,
+        'date': current_date.isoformat() if current_date is not None else None,
+        'clients': len(session.clients),
+        'companies': len(session.companies),
+        'joins': session.nb_joins,
+        'rtt_s': session.rtt_s,
+        'seconds_per_day': session.sim_speed.seconds_per_day(),
+        'lagging': session.sim_speed.lagging,
+        'metrics': session.metrics.snapshot() if session.metrics is not None else None,
+    }
+
+
+def _run_session(session, errors):
+    try:
+        with session.quitting_server():
+            session.main_loop()
+    except Exception as e:
+        session.log.exception('Session stopped by an error')
+        errors.append(e)
+
+
+def _worker_main(worker_id, session_factory, servers, conn, summary_interval_s):
+    """Runs the sessions of a worker, sends their summaries until stopped or a session fails"""
+    log = logging.getLogger('worker-%s' % worker_id)
+    sessions = [session_factory(**kwargs) for kwargs in servers]
+    errors = []
+    threads = [threading.Thread(target=_run_session, args=(session, errors), name=server_key(session), daemon=True)
+               for session in sessions]
+    for thread in threads:
+        thread.start()
+    stopping = False
+    while not stopping and not errors and any(thread.is_alive() for thread in threads):
+        if conn.poll(summary_interval_s):
+            stopping = conn.recv() == MSG_STOP
+        conn.send((MSG_SUMMARIES, {server_key(s): session_summary(s) for s in sessions}))
+    for session in sessions:
+        session.stop = True
+    for thread in threads:
+        thread.join(STOP_TIMEOUT_S)
+    if errors and not stopping:
+        log.error('Exiting after a session error: %s', errors[0])
+        raise SystemExit(1)
+
+
+class Worker:
+    def __init__(self, worker_id, servers):
+        """A worker process as seen by the supervisor"""
+        self.id = worker_id
+        self.servers = servers
+        self.process = None
+        self.conn = None
+        self.nb_starts = 0
+        self.nb_consecutive_crashes = 0
+        # {server key: summary}
+        self.summaries = {}
+        self.last_summary_time = None
+
+    @property
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def __repr__(self):
+        return '{}({}, {} servers)'.format(self.__class__.__name__, self.id, len(self.servers))
+
+
+class Supervisor:
+    def __init__(self, servers, session_factory=Session,
+                 servers_per_worker=1,
+                 summary_interval_s=DEFAULT_SUMMARY_INTERVAL_S,
+                 mp_context=None):
+        """
+        :param servers: [{Session keyword arguments}, ...], one per server
+        :param session_factory: A picklable callable returning a Session from keyword arguments, e.g. a subclass
+        :param servers_per_worker: Number of servers handled by a worker process
+        :param summary_interval_s: Interval at which workers send the summaries of their sessions
+        :param mp_context: A multiprocessing context, e.g. multiprocessing.get_context('spawn')
+        """
+        if servers_per_worker < 1:
+            raise Exception('servers_per_worker must be at least 1, got %s' % servers_per_worker)
+        self.session_factory = session_factory
+        self.summary_interval_s = summary_interval_s
+        self.mp_context = mp_context if mp_context is not None else multiprocessing.get_context()
+        self.log = logging.getLogger('supervisor')
+        self.workers = [Worker(i, servers[start:start + servers_per_worker])
+                        for i, start in enumerate(range(0, len(servers), servers_per_worker))]
+        self.timers = TimerScheduler()
+        self.stop_requested = False
+
+    def start_worker(self, worker):
+        parent_conn, child_conn = self.mp_context.Pipe()
+        worker.process = self.mp_context.Process(
+            target=_worker_main, name='ottd-worker-%s' % worker.id, daemon=True,
+            args=(worker.id, self.session_factory, worker.servers, child_conn, self.summary_interval_s))
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.nb_starts += 1
+        self.log.info('Started %r, pid %s', worker, worker.process.pid)
+
+    def start(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+        return self
+
+    def run(self):
+        """Starts the workers if needed, supervises them until stop() is called, then stops them"""
+        if any(worker.process is None for worker in self.workers):
+            self.start()
+        try:
+            while not self.stop_requested:
+                self.run_once(min(MAX_WAIT_S, self.timers.run()))
+        finally:
+            self.stop_workers()
+
+    def run_once(self, timeout_s):
+        """Waits up to timeout_s for summaries or worker exits and handles them"""
+        by_handle = {}
+        for worker in self.workers:
+            if worker.conn is not None:
+                by_handle[worker.conn] = worker
+                by_handle[worker.process.sentinel] = worker
+        for handle in wait(list(by_handle), timeout_s):
+            worker = by_handle[handle]
+            if handle is worker.conn:
+                self._receive(worker)
+            elif worker.conn is not None:
+                self._on_exit(worker)
+
+    def _receive(self, worker):
+        try:
+            while worker.conn.poll():
+                kind, payload = worker.conn.recv()
+                if kind == MSG_SUMMARIES:
+                    worker.summaries = payload
+                    worker.last_summary_time = time.monotonic()
+                    if any(summary['connected'] for summary in payload.values()):
+                        worker.nb_consecutive_crashes = 0
+        except (EOFError, OSError):
+            # the worker exited, its sentinel tells how
+            pass
+
+    def _on_exit(self, worker):
+        self._receive(worker)
+        worker.process.join()
+        worker.conn.close()
+        worker.conn = None
+        exit_code = worker.process.exitcode
+        for summary in worker.summaries.values():
+            summary['connected'] = False
+        if self.stop_requested:
+            return
+        delay_s = RESTART_DELAYS_S[min(worker.nb_consecutive_crashes, len(RESTART_DELAYS_S) - 1)]
+        worker.nb_consecutive_crashes += 1
+        self.log.error('%r exited with code %s, restarting in %ss', worker, exit_code, delay_s)
+        self.timers.call_later(delay_s, self._restart, worker)
+
+    def _restart(self, worker):
+        if not self.stop_requested and not worker.is_alive:
+            self.start_worker(worker)
+
+    def stop(self):
+        """Makes run() stop the workers and return, can be called from another thread or a signal handler"""
+        self.stop_requested = True
+
+    def stop_workers(self, timeout_s=STOP_TIMEOUT_S):
+        """Asks the workers to quit their servers, terminates the ones still running after timeout_s"""
+        self.stop_requested = True
+        for worker in self.workers:
+            if worker.is_alive:
+                try:
+                    worker.conn.send(MSG_STOP)
+                except (OSError, EOFError):
+                    pass
+        end_time = time.monotonic() + timeout_s
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0, end_time - time.monotonic()))
+            if worker.process.is_alive():
+                self.log.warning('Terminating %r', worker)
+                worker.process.terminate()
+                worker.process.join()
+            if worker.conn is not None:
+                self._receive(worker)
+                worker.conn.close()
+                worker.conn = None
+
+    def state(self):
+        """Returns {server key: summary} of all the sessions, from their last summary"""
+        res = {}
+        for worker in self.workers:
+            res.update(worker.summaries)
+        return res
+
+    def totals(self):
+        """Returns the sums of the summaries of all the sessions"""
+        summaries = list(self.state().values())
+        return {
+            'servers': sum(len(worker.servers) for worker in self.workers),
+            'connected': sum(1 for s in summaries if s['connected']),
+            'lagging': sum(1 for s in summaries if s['lagging']),
+            'clients': sum(s['clients'] for s in summaries),
+            'companies': sum(s['companies'] for s in summaries),
+            'worker_restarts': sum(max(0, worker.nb_starts - 1) for worker in self.workers),
+        }
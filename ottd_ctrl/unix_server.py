@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Serves local processes on a Unix socket from a background thread
+
+Base of the event publisher and of the admin proxy: accepts the connections,
+writes to each peer from a bounded buffer and disconnects the peers not reading
+fast enough instead of delaying the others.
+"""
+
+# standard library
+import logging
+import os
+from select import select
+import socket
+import stat
+import threading
+
+RECV_SIZE = 64 * 1024
+# a peer with more data waiting to be sent is too slow and is disconnected
+DEFAULT_MAX_BUFFERED_BYTES = 4 * 1024 * 1024
+
+
+class Peer:
+    def __init__(self, sock):
+        """A process connected to the Unix socket"""
+        self.socket = sock
+        self.socket.setblocking(False)
+        self.out_buffer = bytearray()
+        # closed once the out buffer has been sent
+        self.closing = False
+        # set when the out buffer overflows, the peer is then disconnected by the serving thread
+        self.too_slow = False
+
+
+class UnixSocketServer:
+    peer_class = Peer
+    thread_name = 'unix-server'
+    log_name = 'unix-server'
+
+    def __init__(self, path, max_buffered_bytes=DEFAULT_MAX_BUFFERED_BYTES):
+        """
+        :param path: Path of the Unix socket to listen on, a stale socket file is replaced
+        :param max_buffered_bytes: Peers are disconnected once this many bytes are waiting for them
+        """
+        self.path = path
+        self.max_buffered_bytes = max_buffered_bytes
+        self.log = logging.getLogger(self.log_name)
+
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        self.listen_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listen_socket.bind(path)
+        self.listen_socket.listen(16)
+        self.listen_socket.setblocking(False)
+
+        self.peers = []
+        self.nb_slow_disconnected = 0
+        # protects the peers and their buffers when they are also used outside of the serving thread
+        self._lock = threading.RLock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_w.setblocking(False)
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name=self.thread_name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop = True
+        self.wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for peer in list(self.peers):
+                self._close(peer)
+        self.listen_socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def wake(self):
+        """Interrupts the wait of the serving thread, e.g. when data has been queued from another thread"""
+        try:
+            self._wake_w.send(b'\x00')
+        except OSError:
+            # already woken up or stopped
+            pass
+
+    def serve_forever(self):
+        while not self._stop:
+            with self._lock:
+                self._drop_slow_peers()
+                rlist, wlist = self._sockets()
+            rlist, wlist, xlist = select(rlist, wlist, [])
+            with self._lock:
+                for sock in rlist:
+                    if sock is self.listen_socket:
+                        self._accept()
+                    elif sock is self._wake_r:
+                        self._wake_r.recv(RECV_SIZE)
+                    else:
+                        self._on_readable(sock)
+                for sock in wlist:
+                    peer = self._peer(sock)
+                    if peer is not None:
+                        self._flush(peer)
+
+    def _sockets(self):
+        """Returns the sockets to wait for: (readable, writable)"""
+        rlist = [self.listen_socket, self._wake_r] + [p.socket for p in self.peers]
+        wlist = [p.socket for p in self.peers if p.out_buffer]
+        return rlist, wlist
+
+    def _on_readable(self, sock):
+        peer = self._peer(sock)
+        if peer is not None:
+            self._receive(peer)
+
+    def _receive(self, peer):
+        """Reads the data sent by a readable peer"""
+        raise NotImplementedError('Must be implemented')
+
+    def _peer(self, sock):
+        for peer in self.peers:
+            if peer.socket is sock:
+                return peer
+        return None
+
+    def _accept(self):
+        try:
+            sock, _ = self.listen_socket.accept()
+        except BlockingIOError:
+            return None
+        peer = self.peer_class(sock)
+        self.peers.append(peer)
+        return peer
+
+    def _queue(self, peer, data):
+        """Appends data to the buffer of a peer, returns False and marks it as too slow if the buffer overflows"""
+        if peer.too_slow:
+            return False
+        if len(peer.out_buffer) + len(data) > self.max_buffered_bytes:
+            peer.too_slow = True
+            return False
+        peer.out_buffer += data
+        return True
+
+    def _flush(self, peer):
+        """Sends as much buffered data as the socket of a peer accepts"""
+        try:
+            nb_sent = peer.socket.send(peer.out_buffer)
+            del peer.out_buffer[:nb_sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(peer)
+            return
+        if peer.closing and not peer.out_buffer:
+            self._close(peer)
+
+    def _drop_slow_peers(self):
+        for peer in [p for p in self.peers if p.too_slow]:
+            self.log.warning('Disconnecting %r, %s bytes not read', peer, len(peer.out_buffer))
+            self.nb_slow_disconnected += 1
+            self._close(peer)
+
+    def _close(self, peer):
+        if peer in self.peers:
+            self.peers.remove(peer)
+            peer.socket.close()
@@ -23,9 +23,29 @@ if __name__ == '__main__':
 
     tests = [
         'admin_client_test.py',
+        'benchmark_test.py',
+        'capture_test.py',
+        'dedup_test.py',
+        'dispatch_test.py',
+        'keepalive_test.py',
+        'log_test.py',
+        'metrics_test.py',
+        'mock_server_test.py',
+        'outbound_test.py',
         'packet_test.py',
+        'poll_test.py',
+        'profiler_test.py',
+        'prometheus_test.py',
         'protocol_test.py',
+        'proxy_test.py',
+        'pubsub_test.py',
+        'replay_test.py',
+        'scheduler_test.py',
         'session_test.py',
+        'sim_speed_test.py',
+        'snapshot_test.py',
+        'supervisor_test.py',
+        'unix_server_test.py',
     ]
     tests = [os.path.join(tests_base_path, t) for t in tests]
 
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
 # standard library
+import socket
+import threading
 
 # related
 import pytest
 
 # project
 from ottd_ctrl.admin_client import AdminClient, CallbackAppend, CallbackPrepend
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.packet import AdminChatPacket, size_fmt, type_fmt
+from ottd_ctrl.protocol import SInt64, UInt8, UInt16, UInt64
 
 
 @pytest.mark.parametrize('callbacks_expected', [
@@ -98,3 +103,69 @@ def test_admin_client_register_callback(callbacks_expected):
     for packet_type, callbacks in expected.items():
         assert ac.callbacks[packet_type] == expected[packet_type], \
             'Callbacks do not match for packet type {}'.format(packet_type)
+
+
+def _company_economy_frame(company_id):
+    payload = (UInt8(company_id).raw_data + SInt64(1).raw_data + UInt64(2).raw_data + SInt64(3).raw_data +
+               UInt16(4).raw_data + (UInt64(5).raw_data + UInt16(6).raw_data + UInt16(7).raw_data) * 2)
+    return (size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) +
+            type_fmt.pack(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY) + payload)
+
+
+def test_admin_client_keyed_callbacks():
+    """Testing callbacks registered for a given company are only called for this company"""
+    called = []
+    ac = AdminClient('host', 1111)
+    ac.register_callback(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, lambda p: called.append(('all', p.company_id)))
+    ac.register_keyed_callback(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, 4, lambda p: called.append((4, p.company_id)))
+    cb_5 = lambda p: called.append((5, p.company_id))
+    ac.register_keyed_callback(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, 5, cb_5)
+    for company_id in (3, 4, 5):
+        frame = _company_economy_frame(company_id)
+        ac.process_frame(len(frame), frame)
+    assert called == [('all', 3), ('all', 4), (4, 4), ('all', 5), (5, 5)]
+    ac.unregister_keyed_callback(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, 5, cb_5)
+    assert 5 not in ac.keyed_callbacks[PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY]
+
+
+def test_admin_client_keyed_callback_without_key_field():
+    ac = AdminClient('host', 1111)
+    with pytest.raises(Exception):
+        ac.register_keyed_callback(PT.ADMIN_PACKET_SERVER_DATE, 1, lambda p: None)
+
+
+def test_admin_client_nonblocking_send():
+    """Sending more than the socket accepts does not block, the rest is sent once writable"""
+    ac = AdminClient('host', 1111)
+    ac.socket, server_socket = socket.socketpair()
+    ac.set_socket_options(nonblocking=True, send_buffer_size=4096)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    pkts = [AdminChatPacket(network_action=3, destination_type=0, destination=0, message='x' * 1000)
+            for _ in range(100)]
+    for pkt in pkts:
+        ac.send_packet(pkt)
+    assert ac.has_unsent_data()
+    expected = b''.join(pkt.encoded() for pkt in pkts)
+    received = b''
+    server_socket.setblocking(False)
+    while len(received) < len(expected):
+        try:
+            received += server_socket.recv(65536)
+        except BlockingIOError:
+            pass
+        ac._wait_io(0)
+    assert received == expected
+    assert not ac.has_unsent_data()
+
+
+def test_admin_client_nonblocking_receive():
+    """A packet arriving in several parts is received on a non-blocking socket"""
+    ac = AdminClient('host', 1111, timeout_s=2)
+    ac.socket, server_socket = socket.socketpair()
+    ac.set_socket_options(nonblocking=True)
+    frame = _company_economy_frame(7)
+    server_socket.sendall(frame[:5])
+    timer = threading.Timer(0.05, server_socket.sendall, args=(frame[5:],))
+    timer.start()
+    assert ac.receive_packet().company_id == 7
+    timer.join()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import json
+import os.path
+import sys
+# related
+import pytest
+# project
+from ottd_ctrl.packet import ServerPacket
+from tests.benchmarks import codec_bench, latency_bench
+from tests.benchmarks.common import compare, percentile
+
+
+def test_codec_bench_covers_all_packets():
+    names = [name for name, fn in codec_bench.benchmarks()]
+    for class_ in codec_bench.admin_packet_classes():
+        assert 'encode:%s' % class_.__name__ in names
+    for class_ in codec_bench.server_packet_classes():
+        assert 'decode:%s' % class_.__name__ in names
+
+
+@pytest.mark.parametrize('class_', codec_bench.server_packet_classes())
+def test_codec_bench_server_payloads(class_):
+    values = codec_bench.SERVER_PACKET_VALUES[class_.__name__]
+    raw_data = class_.encode(**values)
+    pkt = ServerPacket.decode(len(raw_data), raw_data)
+    for name, value in values.items():
+        assert getattr(pkt, name) == value
+
+
+def test_latency_bench_smoke(tmpdir, monkeypatch):
+    output = os.path.join(str(tmpdir), 'latency.json')
+    monkeypatch.setattr(sys, 'argv', ['latency_bench', '--samples', '3', '--console-rate', '200',
+                                      '--output', output])
+    assert latency_bench.main() == 0
+    with open(output) as f:
+        results = json.load(f)['results']
+    assert sorted(results) == ['join_welcome', 'ping', 'rcon']
+    assert all(metrics['p50_ms'] > 0 for metrics in results.values())
+
+
+def test_compare():
+    baseline = {'a': {'ns_per_op': 100}, 'b': {'ns_per_op': 100}, 'c': {'ns_per_op': 100}}
+    results = {'a': {'ns_per_op': 120}, 'b': {'ns_per_op': 130}, 'd': {'ns_per_op': 1000}}
+    assert compare(results, baseline, tolerance=0.25) == [('b', 'ns_per_op', 100, 130)]
+
+
+@pytest.mark.parametrize('p, expected', [
+    (50, 50),
+    (99, 99),
+    (99.9, 100),
+    (0, 1),
+])
+def test_percentile(p, expected):
+    assert percentile(list(range(1, 101)), p) == expected
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks, not collected by pytest, each one is run as a module and prints JSON:
+
+    python -m tests.benchmarks.codec_bench --output codec.json
+    python -m tests.benchmarks.codec_bench --baseline codec.json
+
+see tests/benchmarks/common.py for the options shared by all benchmarks
+"""
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+Encode time of every AdminPacket, decode time of every ServerPacket in packet_map
+and encode/decode times of the protocol primitives, in nanoseconds per operation
+
+    python -m tests.benchmarks.codec_bench [--output x.json] [--baseline y.json] [--filter Company]
+"""
+
+# standard library
+from datetime import date
+import sys
+
+# project
+from ottd_ctrl.const import AdminUpdateType as AUT, DestType, NetworkAction
+from ottd_ctrl.mock_server import DEFAULT_SUPPORTED_UPDATE_FREQS
+from ottd_ctrl.packet import AdminPacket, ServerPacket, packet_map
+from ottd_ctrl.poll import POLL_ALL
+from ottd_ctrl.protocol import MAX_PACKET_SIZE, Boolean, Date, SInt64, String, UInt8, UInt16, UInt32, UInt64
+from tests.benchmarks.common import argument_parser, report, time_op
+
+# size, type, origin ('net' and delimiter) and string delimiter
+MAX_CONSOLE_LINE = 'x' * (MAX_PACKET_SIZE - 3 - 4 - 1)
+LONG_NAME = 'Ünïcødé Transport Company of the Greater Metropolitan Area'
+LONG_MESSAGE = 'Hello everyone, welcome to the server! ' * 20
+MAX_SHARE_OWNERS = [0, 1, 2, 3]
+
+ADMIN_PACKET_VALUES = {
+    'AdminJoinPacket': {'password': 'secret password', 'name': LONG_NAME, 'version': '1.10.3'},
+    'AdminQuitPacket': {},
+    'AdminUpdateFrequenciesPacket': {'update_type': AUT.ADMIN_UPDATE_DATE, 'update_frequency': 1},
+    'AdminPollPacket': {'update_type': AUT.ADMIN_UPDATE_CLIENT_INFO, 'd1': POLL_ALL},
+    'AdminChatPacket': {'network_action': NetworkAction.NETWORK_ACTION_CHAT,
+                        'destination_type': DestType.DESTTYPE_BROADCAST, 'destination': 0,
+                        'message': LONG_MESSAGE},
+    'AdminRConPacket': {'command': 'kick 123 "flooding the chat"'},
+    'AdminGameScriptPacket': {'json_string': '{"action": "goal", "values": [%s]}' % ', '.join(map(str, range(100)))},
+    'AdminPingPacket': {'data': 0xDEADBEEF},
+}
+
+SERVER_PACKET_VALUES = {
+    'ServerProtocolPacket': {'version': 1, 'supported_update_freqs': DEFAULT_SUPPORTED_UPDATE_FREQS},
+    'ServerWelcomePacket': {'server_name': LONG_NAME, 'openttd_revision': '1.10.3', 'is_dedicated': True,
+                            'map_name': 'Random Map', 'generation_seed': 123456789, 'landscape': 0,
+                            'game_creation_date': date(1950, 1, 1), 'map_size_x': 2048, 'map_size_y': 2048},
+    'ServerNewGamePacket': {},
+    'ServerShutdownPacket': {},
+    'ServerDatePacket': {'date': date(1987, 6, 5)},
+    'ServerClientJoinPacket': {'client_id': 1234},
+    'ServerClientInfoPacket': {'client_id': 1234, 'client_address': '2001:db8:85a3::8a2e:370:7334',
+                               'client_name': LONG_NAME, 'client_lang': 0, 'join_date': date(1987, 6, 5),
+                               'client_play_as': 3},
+    'ServerClientUpdatePacket': {'client_id': 1234, 'client_name': LONG_NAME, 'client_play_as': 3},
+    'ServerClientQuitPacket': {'client_id': 1234},
+    'ServerClientErrorPacket': {'client_id': 1234, 'error': 3},
+    'ServerCompanyNewPacket': {'company_id': 3},
+    'ServerCompanyInfoPacket': {'company_id': 3, 'company_name': LONG_NAME, 'manager_name': LONG_NAME,
+                                'colour': 5, 'is_passworded': True, 'inaugurated_year': 1950, 'is_ai': False,
+                                'months_of_bankruptcy': 0, 'share_owners': MAX_SHARE_OWNERS},
+    'ServerCompanyUpdatePacket': {'company_id': 3, 'company_name': LONG_NAME, 'manager_name': LONG_NAME,
+                                  'colour': 5, 'is_passworded': True, 'months_of_bankruptcy': 0,
+                                  'share_owners': MAX_SHARE_OWNERS},
+    'ServerCompanyRemovePacket': {'company_id': 3, 'remove_reason': 0},
+    'ServerCompanyEconomyPacket': {'company_id': 3, 'money': -123456789, 'current_loan': 300000,
+                                   'income': 987654, 'delivered_cargo': 4321,
+                                   'company_value_0': 12345678, 'performance_history_0': 789,
+                                   'delivered_cargo_0': 4000, 'company_value_1': 12000000,
+                                   'performance_history_1': 750, 'delivered_cargo_1': 3900},
+    'ServerCompanyStatsPacket': dict({'company_id': 3}, **{
+        '%s_%s_count' % (kind, what): 500 for kind in ('train', 'lorry', 'bus', 'plane', 'ship')
+        for what in ('vehicles', 'stations')}),
+    'ServerChatPacket': {'network_action': NetworkAction.NETWORK_ACTION_CHAT,
+                         'destination_type': DestType.DESTTYPE_BROADCAST, 'client_id': 1234,
+                         'message': LONG_MESSAGE, 'data': 0},
+    'ServerRConPacket': {'colour': 1, 'result': MAX_CONSOLE_LINE[:500]},
+    'ServerRConEndPacket': {'command': 'list_clients'},
+    'ServerConsolePacket': {'origin': 'net', 'string': MAX_CONSOLE_LINE},
+    'ServerGameScriptPacket': {'json_string': '{"event": "goal", "values": [%s]}' % ', '.join(map(str, range(100)))},
+    'ServerPongPacket': {'data': 0xDEADBEEF},
+    'ServerErrorPackage': {'error': 10},
+}
+
+PRIMITIVE_VALUES = [
+    (Boolean, True),
+    (UInt8, 200),
+    (UInt16, 60000),
+    (UInt32, 4000000000),
+    (UInt64, 2 ** 63),
+    (SInt64, -2 ** 62),
+    (Date, date(1987, 6, 5)),
+    (String, LONG_NAME),
+    (String, MAX_CONSOLE_LINE),
+]
+
+
+def admin_packet_classes():
+    return sorted({c for c in packet_map.values() if c is not None and issubclass(c, AdminPacket)},
+                  key=lambda c: c.type_)
+
+
+def server_packet_classes():
+    return sorted({c for c in packet_map.values() if c is not None and issubclass(c, ServerPacket)},
+                  key=lambda c: c.type_)
+
+
+def benchmarks():
+    """Yields (name, callable) for all the codec benchmarks"""
+    for class_ in admin_packet_classes():
+        values = ADMIN_PACKET_VALUES[class_.__name__]
+        yield 'encode:%s' % class_.__name__, lambda c=class_, v=values: c(**v).encode()
+    for class_ in server_packet_classes():
+        raw_data = class_.encode(**SERVER_PACKET_VALUES[class_.__name__])
+        yield 'decode:%s' % class_.__name__, lambda r=raw_data, s=len(raw_data): ServerPacket.decode(s, r)
+    for type_, value in PRIMITIVE_VALUES:
+        name = type_.__name__
+        if type_ is String:
+            name += '[%s]' % len(value)
+        raw_data = type_(value).raw_data
+        yield 'encode:%s' % name, lambda t=type_, v=value: t(v).raw_data
+        yield 'decode:%s' % name, lambda t=type_, r=raw_data: t(raw_data=r).value
+
+
+def main():
+    args = argument_parser('Packet codec microbenchmarks').parse_args()
+    results = {}
+    for name, fn in benchmarks():
+        if args.filter in name:
+            ns_per_op = time_op(fn)
+            results[name] = {'ns_per_op': round(ns_per_op, 1)}
+            print('{:<45} {:>10.0f} ns'.format(name, ns_per_op), file=sys.stderr)
+    return report('codec', results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from argparse import ArgumentParser
+import json
+import platform
+import sys
+import timeit
+
+
+def argument_parser(description):
+    """Returns an ArgumentParser with the options shared by all benchmarks"""
+    ap = ArgumentParser(description=description)
+    ap.add_argument('--output', help='Writes the JSON results to this file instead of stdout')
+    ap.add_argument('--baseline', help='JSON results of a previous run, exits with 1 on regressions')
+    ap.add_argument('--tolerance', type=float, default=0.25,
+                    help='Relative slowdown from the baseline reported as regression (default: 0.25)')
+    ap.add_argument('--filter', default='', help='Only runs the benchmarks whose name contains this string')
+    return ap
+
+
+def time_op(fn, repeat=5):
+    """Returns the best time of fn() in nanoseconds"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def percentile(sorted_values, p):
+    """Returns the p-th percentile (nearest rank) of sorted values"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns [(benchmark name, metric, baseline value, value), ...] for the metrics
+    worse than in baseline by more than tolerance, for all metrics lower is better,
+    benchmarks or metrics missing from the baseline are ignored
+    """
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            baseline_value = baseline.get(name, {}).get(metric)
+            if not isinstance(baseline_value, (int, float)) or not isinstance(value, (int, float)):
+                continue
+            if value > baseline_value * (1 + tolerance):
+                regressions.append((name, metric, baseline_value, value))
+    return regressions
+
+
+def latency_metrics(samples_s):
+    """Returns {metric: milliseconds, ...} of latency samples in seconds"""
+    samples_ms = sorted(s * 1000 for s in samples_s)
+    return {
+        'mean_ms': round(sum(samples_ms) / len(samples_ms), 3),
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'p999_ms': round(percentile(samples_ms, 99.9), 3),
+        'max_ms': round(samples_ms[-1], 3),
+    }
+
+
+def report(benchmark, results, args, config=None):
+    """
+    Writes the results as JSON and compares them to the baseline if any,
+    returns the exit code of the benchmark
+    :param benchmark: Name of the benchmark
+    :param results: {benchmark name: {metric: value, ...}, ...}
+    :param args: Arguments parsed by a parser from argument_parser()
+    :param config: Parameters of the run, written with the results but not compared
+    """
+    doc = {
+        'benchmark': benchmark,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'config': config or {},
+        'results': results,
+    }
+    text = json.dumps(doc, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for name, metric, baseline_value, value in regressions:
+        print('REGRESSION {} {}: {:.1f} -> {:.1f} ({:+.0%})'.format(
+            name, metric, baseline_value, value, value / baseline_value - 1), file=sys.stderr)
+    return 1 if regressions else 0
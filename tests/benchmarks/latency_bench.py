@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wall clock latency of the request/response paths of a Session connected
+to a local MockAdminServer, optionally under console/chat floods
+
+    rcon            send_rcon() round trip
+    ping            PING sent to PONG received
+    join_welcome    client joining the server to the welcome message received by the server
+
+    python -m tests.benchmarks.latency_bench [--samples 1000] [--console-rate 2000] [--chat-rate 100]
+"""
+
+# standard library
+import logging
+import sys
+import threading
+import time
+
+# project
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT, PacketTypes as PT
+from ottd_ctrl.mock_server import MockAdminServer
+from ottd_ctrl.packet import AdminPingPacket
+from ottd_ctrl.session import Session
+from tests.benchmarks.common import argument_parser, latency_metrics, report
+
+# how often the load generator floods the server
+LOAD_INTERVAL_S = 0.01
+
+
+class TimingServer(MockAdminServer):
+    """Notes when chat messages are received"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat_received = threading.Event()
+        self.chat_time = None
+
+    def _on_chat(self, conn, network_action, destination_type, destination, message):
+        super()._on_chat(conn, network_action, destination_type, destination, message)
+        self.chat_time = time.perf_counter()
+        self.chat_received.set()
+
+
+class LoadGenerator(threading.Thread):
+    def __init__(self, server, console_rate, chat_rate):
+        """
+        Floods the server with console lines and chat messages
+        :param console_rate: Console lines per second
+        :param chat_rate: Chat messages per second
+        """
+        super().__init__(name='load-generator', daemon=True)
+        self.server = server
+        self.console_rate = console_rate
+        self.chat_rate = chat_rate
+        self.stopped = threading.Event()
+
+    def run(self):
+        console_debt = chat_debt = 0.0
+        while not self.stopped.wait(LOAD_INTERVAL_S):
+            console_debt += self.console_rate * LOAD_INTERVAL_S
+            chat_debt += self.chat_rate * LOAD_INTERVAL_S
+            if console_debt >= 1:
+                self.server.console('[net] flood line from the load generator', nb=int(console_debt))
+                console_debt -= int(console_debt)
+            for _ in range(int(chat_debt)):
+                self.server.chat(1, 'flood message from the load generator')
+            chat_debt -= int(chat_debt)
+
+
+def measure_rcon(session, samples):
+    res = []
+    for _ in range(samples):
+        start_time = time.perf_counter()
+        session.send_rcon('help')
+        res.append(time.perf_counter() - start_time)
+    return res
+
+
+def measure_ping(session, samples):
+    res = []
+    for n in range(samples):
+        start_time = time.perf_counter()
+        session.send_packet(AdminPingPacket(data=n))
+        while session.wait_for_packet(PT.ADMIN_PACKET_SERVER_PONG, timeout_s=5).data != n:
+            pass
+        res.append(time.perf_counter() - start_time)
+    return res
+
+
+def measure_join_welcome(session, server, samples):
+    res = []
+    for _ in range(samples):
+        server.chat_received.clear()
+        start_time = time.perf_counter()
+        server.add_clients(1)
+        # the welcome message is sent by the CLIENT_JOIN callback
+        session.wait_for_packet(PT.ADMIN_PACKET_SERVER_CLIENT_JOIN, timeout_s=5)
+        session.flush_outbound()
+        if not server.chat_received.wait(5):
+            raise TimeoutError('Welcome message not received')
+        res.append(server.chat_time - start_time)
+    return res
+
+
+def main():
+    ap = argument_parser('Request/response latency of a Session against a local mock server')
+    ap.add_argument('--samples', type=int, default=500, help='Samples per benchmark (default: 500)')
+    ap.add_argument('--console-rate', type=float, default=0, help='Console lines per second of background load')
+    ap.add_argument('--chat-rate', type=float, default=0, help='Chat messages per second of background load')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    server = TimingServer(rcon_handler=lambda command: ['line %s' % n for n in range(5)]).start()
+    host, port = server.address
+    session = Session('latency-bench', '', '1', host, port, timeout_s=5,
+                      update_frequencies={AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                                          AUT.ADMIN_UPDATE_CONSOLE: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                                          AUT.ADMIN_UPDATE_CHAT: AUF.ADMIN_FREQUENCY_AUTOMATIC},
+                      client_welcome_message='Welcome!')
+    session.join_server()
+    load = LoadGenerator(server, args.console_rate, args.chat_rate)
+    load.start()
+
+    benchmarks = {
+        'rcon':         lambda: measure_rcon(session, args.samples),
+        'ping':         lambda: measure_ping(session, args.samples),
+        'join_welcome': lambda: measure_join_welcome(session, server, args.samples),
+    }
+    results = {}
+    try:
+        for name, measure in benchmarks.items():
+            if args.filter in name:
+                results[name] = latency_metrics(measure())
+                print('{:<15} p50 {p50_ms:>8.3f}ms p99 {p99_ms:>8.3f}ms p999 {p999_ms:>8.3f}ms'.format(
+                    name, **results[name]), file=sys.stderr)
+    finally:
+        load.stopped.set()
+        session.quit_server()
+        server.stop()
+    config = {'samples': args.samples, 'console_rate': args.console_rate, 'chat_rate': args.chat_rate}
+    return report('latency', results, args, config=config)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
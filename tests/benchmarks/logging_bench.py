@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cost per received packet of the Session receive path (decode and callbacks)
+with logging off, DEBUG logging written synchronously and DEBUG logging
+through a background thread, in nanoseconds per packet
+
+The *_slow_io variants use a handler blocking --io-latency-us per record (e.g. a
+network filesystem or syslog), which is where the background thread pays off,
+with a fast handler it only competes with the receive loop for the GIL.
+
+    python -m tests.benchmarks.logging_bench [--output x.json] [--baseline y.json]
+"""
+
+# standard library
+from datetime import date
+import logging
+import os
+import sys
+import time
+
+# project
+from ottd_ctrl.log import start_background_logging, stop_background_logging
+from ottd_ctrl.packet import ServerChatPacket, ServerClientInfoPacket, ServerConsolePacket, ServerDatePacket
+from ottd_ctrl.session import Session
+from tests.benchmarks.common import argument_parser, report, time_op
+
+FMT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+
+
+def frames():
+    """A mix of received packets"""
+    return [
+        ServerDatePacket.encode(date=date(1950, 1, 1)),
+        ServerConsolePacket.encode(origin='net', string='[server] Client #12 joined the game'),
+        ServerChatPacket.encode(network_action=3, destination_type=0, client_id=12, message='hello', data=0),
+        ServerClientInfoPacket.encode(client_id=12, client_address='10.0.0.12', client_name='Player',
+                                      client_lang=0, join_date=date(1950, 1, 1), client_play_as=255),
+    ]
+
+
+def receive_loop(session, raw_packets):
+    for raw_data in raw_packets:
+        session.process_frame(len(raw_data), raw_data)
+
+
+class SlowIOHandler(logging.FileHandler):
+    """Blocks io_latency_s per record"""
+    def __init__(self, filename, io_latency_s):
+        super().__init__(filename)
+        self.io_latency_s = io_latency_s
+
+    def emit(self, record):
+        super().emit(record)
+        time.sleep(self.io_latency_s)
+
+
+def configure(level, io_latency_s=0):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if io_latency_s:
+        handler = SlowIOHandler(os.devnull, io_latency_s)
+    else:
+        handler = logging.FileHandler(os.devnull)
+    handler.setFormatter(logging.Formatter(FMT))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def main():
+    ap = argument_parser('Receive path cost with and without logging')
+    ap.add_argument('--io-latency-us', type=float, default=100, help='Latency of the slow handler (default: 100)')
+    args = ap.parse_args()
+    io_latency_s = args.io_latency_us / 1e6
+    session = Session('logging-bench', '', '1', 'localhost', 1)
+    raw_packets = frames()
+
+    def run():
+        receive_loop(session, raw_packets)
+
+    results = {}
+    for name, level, latency_s, background in (('off', logging.WARNING, 0, False),
+                                               ('debug', logging.DEBUG, 0, False),
+                                               ('debug_background', logging.DEBUG, 0, True),
+                                               ('debug_slow_io', logging.DEBUG, io_latency_s, False),
+                                               ('debug_slow_io_background', logging.DEBUG, io_latency_s, True)):
+        name = 'receive_loop:%s' % name
+        if args.filter not in name:
+            continue
+        configure(level, latency_s)
+        listener = start_background_logging() if background else None
+        try:
+            ns_per_packet = time_op(run, repeat=3) / len(raw_packets)
+        finally:
+            if listener is not None:
+                # the records still queued are not part of the measure
+                stop_background_logging(listener)
+        results[name] = {'ns_per_packet': round(ns_per_packet, 1)}
+        print('{:<35} {:>10.0f} ns/packet'.format(name, ns_per_packet), file=sys.stderr)
+    configure(logging.WARNING)
+    return report('logging', results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
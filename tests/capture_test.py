@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import os.path
+import socket
+
+# related
+import pytest
+
+# project
+from ottd_ctrl.admin_client import AdminClient
+from ottd_ctrl.capture import DIRECTION_RECEIVED, DIRECTION_SENT, CaptureRecorder
+from ottd_ctrl.capture import read_capture, segment_paths
+from ottd_ctrl.packet import AdminPingPacket, size_fmt, type_fmt
+from ottd_ctrl.protocol import UInt32
+from ottd_ctrl.const import PacketTypes as PT
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib', 'lzma'])
+def test_record_and_read(tmpdir, compression):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    recorder = CaptureRecorder(prefix, compression=compression, buffer_size=100, max_segment_size=1000)
+    records = [(i % 2, bytes([i % 256]) * (i + 1)) for i in range(100)]
+    for direction, data in records:
+        recorder.record(direction, data)
+    recorder.close()
+    assert len(segment_paths(prefix)) > 1, 'Capture not segmented'
+    read = list(read_capture(prefix))
+    assert [(direction, data) for direction, _, data in read] == records
+    timestamps = [timestamp for _, timestamp, _ in read]
+    assert timestamps == sorted(timestamps)
+
+
+def test_new_recorder_appends_segments(tmpdir):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    for data in (b'first', b'second'):
+        recorder = CaptureRecorder(prefix)
+        recorder.record(DIRECTION_RECEIVED, data)
+        recorder.close()
+    assert [data for _, _, data in read_capture(prefix)] == [b'first', b'second']
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_flushed_records_readable(tmpdir, compression):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    recorder = CaptureRecorder(prefix, compression=compression)
+    recorder.record(DIRECTION_RECEIVED, b'first')
+    recorder.flush()
+    # as if the process crashed, the segment is not closed
+    assert [data for _, _, data in read_capture(prefix)] == [b'first']
+    recorder.close()
+
+
+def test_other_files_ignored(tmpdir):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    for name in ('capture-1a.cap', 'capture-000001.bak.cap', 'capture-000001.cap.bak'):
+        open(os.path.join(str(tmpdir), name), 'wb').close()
+    recorder = CaptureRecorder(prefix)
+    recorder.record(DIRECTION_RECEIVED, b'data')
+    recorder.close()
+    assert segment_paths(prefix) == [prefix + '-000000.cap']
+    assert [data for _, _, data in read_capture(prefix)] == [b'data']
+
+
+def test_admin_client_capture(tmpdir):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    ac = AdminClient('host', 1111)
+    ac.socket, server_socket = socket.socketpair()
+    ac.start_capture(prefix)
+    ping = AdminPingPacket(data=5)
+    ac.send_packet(ping)
+    payload = UInt32(5).raw_data
+    pong = size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) + type_fmt.pack(PT.ADMIN_PACKET_SERVER_PONG) + payload
+    server_socket.sendall(pong)
+    ac.receive_packet()
+    ac.stop_capture()
+    assert [(direction, data) for direction, _, data in read_capture(prefix)] == \
+        [(DIRECTION_SENT, ping.encoded()), (DIRECTION_RECEIVED, pong)]
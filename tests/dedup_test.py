@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+
+# related
+import pytest
+
+# project
+from ottd_ctrl.admin_client import AdminClient
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.dedup import PacketDeduplicator
+from ottd_ctrl.packet import size_fmt, type_fmt
+from ottd_ctrl.protocol import String, UInt8, UInt32
+
+COMPANY_UPDATE = PT.ADMIN_PACKET_SERVER_COMPANY_UPDATE
+CLIENT_UPDATE = PT.ADMIN_PACKET_SERVER_CLIENT_UPDATE
+
+
+def client_update_payload(client_id, name, play_as=1):
+    return UInt32(client_id).raw_data + String(name).raw_data + UInt8(play_as).raw_data
+
+
+@pytest.mark.parametrize('payloads_expected', [
+    ([client_update_payload(1, 'a')], [False]),
+    ([client_update_payload(1, 'a'), client_update_payload(1, 'a')], [False, True]),
+    ([client_update_payload(1, 'a'), client_update_payload(2, 'a')], [False, False]),
+    ([client_update_payload(1, 'a'), client_update_payload(1, 'b'),
+      client_update_payload(1, 'a')], [False, False, False]),
+    ([client_update_payload(1, 'a'), client_update_payload(2, 'b'),
+      client_update_payload(1, 'a'), client_update_payload(2, 'b')], [False, False, True, True]),
+])
+@pytest.mark.parametrize('use_hash', [False, True])
+def test_is_duplicate(payloads_expected, use_hash):
+    payloads, expected = payloads_expected
+    dedup = PacketDeduplicator(use_hash=use_hash)
+    assert [dedup.is_duplicate(CLIENT_UPDATE, p) for p in payloads] == expected
+    assert dedup.nb_dropped[CLIENT_UPDATE] == sum(expected)
+    assert dedup.hit_rate(CLIENT_UPDATE) == sum(expected) / len(expected)
+
+
+def test_other_packet_types_not_deduplicated():
+    dedup = PacketDeduplicator(packet_types=[COMPANY_UPDATE])
+    payload = client_update_payload(1, 'a')
+    assert not dedup.is_duplicate(CLIENT_UPDATE, payload)
+    assert not dedup.is_duplicate(CLIENT_UPDATE, payload)
+    assert dedup.stats() == {}
+
+
+def test_packet_type_without_key():
+    with pytest.raises(Exception):
+        PacketDeduplicator(packet_types=[PT.ADMIN_PACKET_SERVER_DATE])
+
+
+def test_forget():
+    dedup = PacketDeduplicator()
+    dedup.is_duplicate(CLIENT_UPDATE, client_update_payload(1, 'a'))
+    dedup.is_duplicate(CLIENT_UPDATE, client_update_payload(2, 'a'))
+    dedup.forget('client_id', 1)
+    assert not dedup.is_duplicate(CLIENT_UPDATE, client_update_payload(1, 'a'))
+    assert dedup.is_duplicate(CLIENT_UPDATE, client_update_payload(2, 'a'))
+
+
+def test_admin_client_drops_duplicates():
+    received = []
+    ac = AdminClient('host', 1111, callbacks={CLIENT_UPDATE: received.append})
+    ac.enable_deduplication()
+    payload = client_update_payload(3, 'name')
+    frame = size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) + type_fmt.pack(CLIENT_UPDATE) + payload
+    assert ac.process_frame(len(frame), frame).client_name == 'name'
+    assert ac.process_frame(len(frame), frame) is None
+    assert len(received) == 1
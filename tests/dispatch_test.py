@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import socket
+
+# related
+import pytest
+
+# project
+from ottd_ctrl.admin_client import AdminClient, ConnectionClosedByPeer
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.dispatch import InboundQueue
+from ottd_ctrl.packet import ServerCompanyInfoPacket, ServerDatePacket, size_fmt, type_fmt
+from ottd_ctrl.session import Session
+from ottd_ctrl.protocol import String, UInt16, UInt32
+
+
+def frame(packet_type, payload):
+    raw_data = size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) + type_fmt.pack(packet_type) + payload
+    return len(raw_data), raw_data
+
+
+def console_frame(string):
+    return frame(PT.ADMIN_PACKET_SERVER_CONSOLE, String('origin').raw_data + String(string).raw_data)
+
+
+def pong_frame(data):
+    return frame(PT.ADMIN_PACKET_SERVER_PONG, UInt32(data).raw_data)
+
+
+def rcon_frame(result):
+    return frame(PT.ADMIN_PACKET_SERVER_RCON, UInt16(1).raw_data + String(result).raw_data)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_inbound_queue_order():
+    queue = InboundQueue()
+    frames = [console_frame('c1'), rcon_frame('r1'), console_frame('c2'), pong_frame(1), rcon_frame('r2')]
+    for f in frames:
+        queue.push(*f)
+    assert len(queue) == 5
+    popped = [queue.pop() for _ in range(5)]
+    assert popped == [frames[1], frames[3], frames[4], frames[0], frames[2]]
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_inbound_queue_wait_stats():
+    clock = FakeClock()
+    queue = InboundQueue(clock=clock)
+    queue.push(*console_frame('c1'))
+    queue.push(*pong_frame(1))
+    clock.now = 2
+    queue.pop()
+    clock.now = 3
+    queue.pop()
+    stats = queue.stats()
+    assert stats['CONTROL']['count'] == 1
+    assert stats['CONTROL']['max_wait_s'] == 2
+    assert stats['BULK']['mean_wait_s'] == 3
+    assert stats['STATE']['count'] == 0
+
+
+def test_admin_client_priority_dispatch():
+    """A pong received after a console flood is dispatched first"""
+    received = []
+    ac = AdminClient('host', 1111, callbacks={None: lambda pkt: received.append(pkt.type_)})
+    ac.enable_priority_dispatch()
+    ac.socket, server_socket = socket.socketpair()
+    for i in range(20):
+        server_socket.sendall(console_frame(str(i))[1])
+    server_socket.sendall(pong_frame(1)[1])
+    server_socket.close()
+    for _ in range(21):
+        ac.receive_packet()
+    assert received[0] == PT.ADMIN_PACKET_SERVER_PONG
+    assert received[1:] == [PT.ADMIN_PACKET_SERVER_CONSOLE] * 20
+    with pytest.raises(ConnectionClosedByPeer):
+        ac.receive_packet()
+
+
+def test_new_game_after_stale_state():
+    """State updates of the old game received before NEWGAME are dispatched before it"""
+    session = Session('name', 'pass', 1, 'host', 1)
+    session.enable_priority_dispatch()
+    session.socket, server_socket = socket.socketpair()
+    for company_id in range(3):
+        server_socket.sendall(ServerCompanyInfoPacket.encode(
+            company_id=company_id, company_name='old', manager_name='', colour=0, is_passworded=False,
+            inaugurated_year=1950, is_ai=False, months_of_bankruptcy=0, share_owners=[]))
+    server_socket.sendall(ServerDatePacket.encode(date=date(1960, 1, 1)) + console_frame('saving')[1] +
+                          frame(PT.ADMIN_PACKET_SERVER_NEWGAME, b'')[1] + pong_frame(1)[1])
+    received = []
+    session.register_callback(None, lambda pkt: received.append(pkt.type_))
+    for _ in range(7):
+        session.receive_packet()
+    assert received == [PT.ADMIN_PACKET_SERVER_PONG] + [PT.ADMIN_PACKET_SERVER_COMPANY_INFO] * 3 + \
+        [PT.ADMIN_PACKET_SERVER_DATE, PT.ADMIN_PACKET_SERVER_NEWGAME, PT.ADMIN_PACKET_SERVER_CONSOLE]
+    assert session.companies == {}
+    server_socket.close()
+    session.disconnect()
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers shared by the tests
+"""
+
+# standard library
+import time
+
+
+def wait_until(condition, timeout_s=2, interval_s=0.01):
+    """Waits until condition() is true, fails the test after timeout_s"""
+    end_time = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < end_time, 'Timed out'
+        time.sleep(interval_s)
+
+
+def feed(session, *frames):
+    """Processes raw server packets as if received"""
+    for frame in frames:
+        session.process_frame(len(frame), frame)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import math
+import threading
+import time
+# related
+import pytest
+# project
+from ottd_ctrl.keepalive import MAX_PENDING_PINGS, PingMonitor
+from ottd_ctrl.mock_server import MockAdminServer
+from ottd_ctrl.session import Session, UnsupportedUpdateFrequency
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def monitor():
+    sent = []
+    monitor = PingMonitor(sent.append, interval_s=10, timeout_s=30, alpha=0.5, clock=FakeClock())
+    monitor.sent = sent
+    return monitor
+
+
+def test_run_sends_pings_at_interval(monitor):
+    assert monitor.run() == 10
+    assert [pkt.data for pkt in monitor.sent] == [0]
+    monitor.clock.now = 4
+    assert monitor.run() == 6
+    assert len(monitor.sent) == 1
+    monitor.clock.now = 10
+    monitor.run()
+    assert [pkt.data for pkt in monitor.sent] == [0, 1]
+    assert monitor.nb_sent == 2
+
+
+def test_run_disabled():
+    monitor = PingMonitor(lambda pkt: None)
+    assert monitor.run() == math.inf
+
+
+def test_rtt(monitor):
+    data = monitor.send_ping()
+    monitor.clock.now = 0.2
+    assert monitor.on_pong(data) == pytest.approx(0.2)
+    assert monitor.rtt_ewma_s == pytest.approx(0.2)
+    data = monitor.send_ping()
+    monitor.clock.now = 0.6
+    monitor.on_pong(data)
+    assert monitor.rtt_s == pytest.approx(0.4)
+    assert monitor.rtt_ewma_s == pytest.approx(0.3)
+    assert monitor.rtt_ns.count == 2
+    assert monitor.nb_received == 2
+    assert monitor.on_pong(1234) is None
+
+
+def test_older_pings_dropped(monitor):
+    first = monitor.send_ping()
+    monitor.clock.now = 1
+    second = monitor.send_ping()
+    monitor.on_pong(second)
+    assert monitor.nb_pending == 0
+    assert monitor.on_pong(first) is None
+
+
+def test_max_pending(monitor):
+    for _ in range(MAX_PENDING_PINGS + 1):
+        monitor.send_ping()
+    assert monitor.nb_pending == MAX_PENDING_PINGS
+
+
+def test_timeout(monitor):
+    monitor.run()
+    monitor.clock.now = 10
+    monitor.run()
+    monitor.clock.now = 25
+    # the first ping deadline comes before the next ping
+    assert monitor.run() == 5
+    assert not monitor.timed_out()
+    monitor.clock.now = 30.5
+    assert monitor.timed_out()
+    assert monitor.oldest_pending_age_s() == 30.5
+    monitor.reset()
+    assert not monitor.timed_out()
+    assert monitor.oldest_pending_age_s() is None
+
+
+class KeepaliveSession(Session):
+    def on_connection_lost(self):
+        self.nb_lost = getattr(self, 'nb_lost', 0) + 1
+
+    def on_server_joined(self):
+        if self.nb_joins == 2:
+            self.stop = True
+
+
+def test_session_reconnects():
+    with MockAdminServer(password='secret') as server:
+        host, port = server.address
+        session = KeepaliveSession('admin', 'secret', '1', host, port, timeout_s=2)
+        session.enable_keepalive(interval_s=0.05, timeout_s=1)
+        session.join_server()
+        thread = threading.Thread(target=session.main_loop, daemon=True)
+        thread.start()
+        time.sleep(0.2)
+        assert session.ping_monitor.nb_received > 0
+        server.disconnect_admins()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert session.nb_lost == 1
+        assert session.nb_reconnects == 1
+        session.quit_server()
+
+
+def test_session_stops_without_reconnect():
+    with MockAdminServer(password='secret') as server:
+        host, port = server.address
+        session = KeepaliveSession('admin', 'secret', '1', host, port, timeout_s=2)
+        session.enable_keepalive(interval_s=0.05, timeout_s=0.1, reconnect=False)
+        session.join_server()
+        # pongs are not handled, the pings time out
+        session.ping_monitor.on_pong = lambda data: None
+        session.main_loop()
+        assert session.nb_lost == 1
+        assert session.ping_monitor.nb_timeouts == 1
+        session.disconnect()
+
+
+class FailingJoinSession(KeepaliveSession):
+    """The first reconnection fails as if the server rejected the subscriptions"""
+    nb_attempts = 0
+
+    def join_server(self, pipelined=False):
+        self.nb_attempts += 1
+        if self.nb_attempts == 2:
+            raise UnsupportedUpdateFrequency('Frequency not supported')
+        super().join_server(pipelined)
+
+
+def test_session_reconnect_retries_failed_join(monkeypatch):
+    monkeypatch.setattr('ottd_ctrl.session.RECONNECT_DELAYS_S', (0.05,))
+    with MockAdminServer(password='secret') as server:
+        host, port = server.address
+        session = FailingJoinSession('admin', 'secret', '1', host, port, timeout_s=2)
+        session.enable_keepalive(interval_s=0.05, timeout_s=1)
+        session.join_server()
+        old_socket = session.socket
+        thread = threading.Thread(target=session.main_loop, daemon=True)
+        thread.start()
+        server.disconnect_admins()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert session.nb_attempts == 3
+        assert session.nb_reconnects == 1
+        # closed, not only dropped
+        assert old_socket.fileno() == -1
+        session.quit_server()
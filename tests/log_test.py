@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import logging
+import threading
+# related
+import pytest
+# project
+from ottd_ctrl.log import start_background_logging, stop_background_logging
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+
+class Formatted:
+    """Notes the thread formatting it"""
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.current_thread())
+        return 'formatted'
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('log-test')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handler = logger.recording_handler = RecordingHandler()
+    logger.addHandler(handler)
+    yield logger
+    logger.removeHandler(handler)
+
+
+@pytest.mark.parametrize('defer_formatting', [True, False])
+def test_background_logging(logger, defer_formatting):
+    handler = logger.recording_handler
+    handlers = list(logger.handlers)
+    listener = start_background_logging(logger, defer_formatting=defer_formatting)
+    assert handler not in logger.handlers
+    arg = Formatted()
+    logger.debug('value: %s', arg)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception('error')
+    stop_background_logging(listener, logger)
+    assert logger.handlers == handlers
+    assert handler.messages[0] == 'value: formatted'
+    assert handler.messages[1].startswith('error\nTraceback')
+    assert handler.threads[0] is not threading.current_thread()
+    # formatted right away, it could be modified
+    assert arg.threads[0] is threading.current_thread()
+
+
+def test_deferred_formatting(logger):
+    handler = logger.recording_handler
+    listener = start_background_logging(logger)
+    pkt = {'client_name': 'before'}
+    logger.debug('%s %s %s', 'value', 1, None)
+    logger.debug('received %s', pkt)
+    logger.debug('received %(client_name)s', pkt)
+    # e.g. a stored packet updated by the session
+    pkt['client_name'] = 'after'
+    stop_background_logging(listener, logger)
+    assert handler.messages == ['value 1 None', "received {'client_name': 'before'}", 'received before']
+
+
+def test_disabled_debug_does_not_format(logger):
+    logger.setLevel(logging.INFO)
+    arg = Formatted()
+    logger.debug('value: %s', arg)
+    assert arg.threads == []
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import socket
+# related
+import pytest
+# project
+from ottd_ctrl.admin_client import AdminClient
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.metrics import RECEIVED, SENT, Histogram
+from ottd_ctrl.packet import AdminPingPacket, ServerCompanyNewPacket, ServerCompanyStatsPacket
+
+
+@pytest.mark.parametrize('values, expected_counts', [
+    ([], [0, 0, 0, 0]),
+    ([1, 10], [2, 0, 0, 0]),
+    ([11, 100, 101, 1000], [0, 2, 2, 0]),
+    ([1001, 5000], [0, 0, 0, 2]),
+])
+def test_histogram_observe(values, expected_counts):
+    h = Histogram(bounds=(10, 100, 1000))
+    for v in values:
+        h.observe(v)
+    assert h.counts == expected_counts
+    assert h.count == len(values)
+    assert h.sum == sum(values)
+
+
+def test_histogram_percentile():
+    h = Histogram(bounds=(10, 100, 1000))
+    assert h.percentile(50) is None
+    for v in [5] * 90 + [50] * 9 + [5000]:
+        h.observe(v)
+    assert h.percentile(50) == 10
+    assert h.percentile(99) == 100
+    assert h.percentile(100) is None
+
+
+def test_admin_client_metrics():
+    ac = AdminClient('host', 1111)
+    ac.socket, server_socket = socket.socketpair()
+    metrics = ac.enable_metrics()
+    errors = []
+    ac.register_callback(PT.ADMIN_PACKET_SERVER_COMPANY_NEW, lambda p: errors.append(1 / 0))
+    frame = ServerCompanyNewPacket.encode(company_id=1)
+    for _ in range(3):
+        ac.process_frame(len(frame), frame)
+    ac.send_packet(AdminPingPacket(data=1))
+    snapshot = metrics.snapshot()
+    received = snapshot[RECEIVED]['ADMIN_PACKET_SERVER_COMPANY_NEW']
+    assert received['count'] == 3
+    assert received['bytes'] == 3 * len(frame)
+    assert received['codec_ns']['count'] == 3
+    assert received['callbacks_ns']['count'] == 3
+    assert snapshot['callback_errors'] == 3
+    sent = snapshot[SENT]['ADMIN_PACKET_ADMIN_PING']
+    assert sent['count'] == 1
+    assert sent['bytes'] == len(AdminPingPacket(data=1).encoded())
+    ac.disable_metrics()
+    ac.process_frame(len(frame), frame)
+    assert metrics.received[PT.ADMIN_PACKET_SERVER_COMPANY_NEW].count == 3
+
+
+def test_admin_client_metrics_dropped_packets():
+    ac = AdminClient('host', 1111)
+    ac.enable_deduplication()
+    observed = []
+    metrics = ac.enable_metrics()
+    metrics.add_observer(lambda *args: observed.append(args))
+    ac.register_callback(PT.ADMIN_PACKET_SERVER_COMPANY_STATS, lambda p: None)
+    values = {name: 0 for name, _ in ServerCompanyStatsPacket._fields}
+    frame = ServerCompanyStatsPacket.encode(**values)
+    ac.process_frame(len(frame), frame)
+    ac.process_frame(len(frame), frame)
+    assert metrics.received[PT.ADMIN_PACKET_SERVER_COMPANY_STATS].dropped == 1
+    assert [(d, t, n, callbacks_ns is None) for d, t, n, codec_ns, callbacks_ns in observed] == [
+        (RECEIVED, PT.ADMIN_PACKET_SERVER_COMPANY_STATS, len(frame), False),
+        (RECEIVED, PT.ADMIN_PACKET_SERVER_COMPANY_STATS, len(frame), True),
+    ]
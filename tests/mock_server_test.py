@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+# related
+import pytest
+# project
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.const import NetworkErrorCode, PacketTypes as PT
+from ottd_ctrl.mock_server import MockAdminServer, decode_admin_packet
+from ottd_ctrl.packet import AdminJoinPacket, AdminPingPacket, AdminPollPacket, AdminRConPacket
+from ottd_ctrl.poll import POLL_ALL
+from ottd_ctrl.session import Session
+from tests.helpers import wait_until
+
+
+@pytest.fixture
+def server():
+    server = MockAdminServer(password='secret', start_date=date(1950, 1, 1),
+                             rcon_handler=lambda command: ['line 1', 'line 2'])
+    server.start()
+    yield server
+    server.stop()
+
+
+def make_session(server, password='secret', update_frequencies=None):
+    host, port = server.address
+    return Session('admin', password, '1', host, port, timeout_s=2, update_frequencies=update_frequencies)
+
+
+def receive(session, packet_type, nb):
+    return [session.wait_for_packet(packet_type, timeout_s=2) for _ in range(nb)]
+
+
+def test_decode_admin_packet():
+    pkt = AdminPollPacket(update_type=AUT.ADMIN_UPDATE_DATE, d1=3)
+    assert decode_admin_packet(pkt.encoded()) == (PT.ADMIN_PACKET_ADMIN_POLL,
+                                                 {'update_type': AUT.ADMIN_UPDATE_DATE, 'd1': 3})
+
+
+def test_join_and_rcon(server):
+    session = make_session(server)
+    session.join_server()
+    assert session.server_name == server.server_name
+    assert session.protocol_packet.supported_update_freqs == server.supported_update_freqs
+    assert session.send_rcon('help') == ['line 1', 'line 2']
+    session.quit_server()
+    wait_until(lambda: len(server.connections) == 0)
+
+
+@pytest.mark.parametrize('pkt, error', [
+    (AdminJoinPacket(password='wrong', name='admin', version='1'), NetworkErrorCode.NETWORK_ERROR_WRONG_PASSWORD),
+    (AdminRConPacket(command='help'), NetworkErrorCode.NETWORK_ERROR_NOT_EXPECTED),
+])
+def test_join_errors(server, pkt, error):
+    session = make_session(server)
+    session.connect()
+    session.send_packet(pkt)
+    assert session.wait_for_packet(PT.ADMIN_PACKET_SERVER_ERROR, timeout_s=2).error == error
+    wait_until(lambda: len(server.connections) == 0)
+    session.disconnect()
+
+
+@pytest.mark.parametrize('raw_data', [b'\x04\x00\x00\x00', b'\x00\x00'], ids=['empty join', 'size 0'])
+def test_malformed_packet(server, raw_data):
+    session = make_session(server)
+    session.connect()
+    session.send_frame(raw_data)
+    error = session.wait_for_packet(PT.ADMIN_PACKET_SERVER_ERROR, timeout_s=2).error
+    assert error == NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET
+    wait_until(lambda: len(server.connections) == 0)
+    session.disconnect()
+    # the server still serves the other admins
+    other = make_session(server)
+    other.join_server()
+    assert other.send_rcon('help') == ['line 1', 'line 2']
+    other.quit_server()
+
+
+def test_poll_clients(server):
+    server.add_clients(3)
+    session = make_session(server)
+    session.join_server()
+    session.send_packet(AdminPollPacket(update_type=AUT.ADMIN_UPDATE_CLIENT_INFO, d1=POLL_ALL))
+    pkts = receive(session, PT.ADMIN_PACKET_SERVER_CLIENT_INFO, 4)
+    assert sorted(pkt.client_id for pkt in pkts) == [1, 2, 3, 4]
+    session.quit_server()
+
+
+def test_client_joins_are_pushed(server):
+    session = make_session(server, update_frequencies={AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_AUTOMATIC})
+    session.join_server()
+    # the update frequency packet is processed before the scenario
+    session.send_packet(AdminPingPacket(data=1))
+    session.wait_for_packet(PT.ADMIN_PACKET_SERVER_PONG, timeout_s=2)
+    server.add_clients(2)
+    pkts = receive(session, PT.ADMIN_PACKET_SERVER_CLIENT_JOIN, 2)
+    assert [pkt.client_id for pkt in pkts] == [2, 3]
+    session.quit_server()
+
+
+def test_game_speed(server):
+    session = make_session(server, update_frequencies={AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY})
+    session.join_server()
+    session.send_packet(AdminPingPacket(data=1))
+    session.wait_for_packet(PT.ADMIN_PACKET_SERVER_PONG, timeout_s=2)
+    server.set_game_speed(0.001)
+    pkts = receive(session, PT.ADMIN_PACKET_SERVER_DATE, 10)
+    assert [pkt.date for pkt in pkts] == [date(1950, 1, n) for n in range(2, 12)]
+    session.quit_server()
+
+
+def test_unsupported_update_frequency(server):
+    session = make_session(server)
+    session.join_server()
+    session.send_packet(AdminPollPacket(update_type=AUT.ADMIN_UPDATE_CHAT, d1=0))
+    pkt = session.wait_for_packet(PT.ADMIN_PACKET_SERVER_ERROR, timeout_s=2)
+    assert pkt.error == NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET
+    wait_until(lambda: len(server.connections) == 0)
+    session.disconnect()
+
+
+def test_shutdown(server):
+    session = make_session(server)
+    session.join_server()
+    server.shutdown()
+    session.wait_for_packet(PT.ADMIN_PACKET_SERVER_SHUTDOWN, timeout_s=2)
+    assert session.stop
+    session.disconnect()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import math
+import socket
+
+# related
+import pytest
+
+# project
+from ottd_ctrl.admin_client import AdminClient
+from ottd_ctrl.outbound import OutboundPriority, OutboundQueue
+from ottd_ctrl.packet import AdminChatPacket, AdminPingPacket, AdminPollPacket, AdminRConPacket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def chat(msg):
+    return AdminChatPacket(network_action=3, destination_type=0, destination=0, message=msg)
+
+
+def test_control_packets_not_delayed_by_chat():
+    queue = OutboundQueue(rates={OutboundPriority.CHAT: (1, 2)}, clock=FakeClock())
+    for i in range(5):
+        queue.push(chat(str(i)))
+    ping = AdminPingPacket(data=1)
+    queue.push(ping)
+    ready = queue.pop_ready()
+    assert ready[0] is ping
+    assert [p.message for p in ready[1:]] == ['0', '1']
+    assert len(queue) == 3
+
+
+def test_rate_limit():
+    clock = FakeClock()
+    queue = OutboundQueue(rates={OutboundPriority.REQUEST: (2, 2)}, clock=clock)
+    assert queue.time_until_ready() == math.inf
+    for d1 in range(4):
+        queue.push(AdminPollPacket(update_type=0, d1=d1))
+    assert len(queue.pop_ready()) == 2
+    assert queue.time_until_ready() == pytest.approx(0.5)
+    assert queue.pop_ready() == []
+    clock.now = 0.5
+    assert [p.d1 for p in queue.pop_ready()] == [2]
+    assert queue.stats()['REQUEST'] == {'sent': 3, 'queued': 1}
+
+
+def test_admin_client_outbound_scheduler():
+    ac = AdminClient('host', 1111)
+    ac.enable_outbound_scheduler(rates={OutboundPriority.CHAT: (1, 1)})
+    ac.socket, server_socket = socket.socketpair()
+    ac.send_packet(chat('a'))
+    ac.send_packet(chat('b'))
+    rcon = AdminRConPacket(command='x')
+    ac.send_packet(rcon)
+    expected = chat('a').encoded() + rcon.encoded()
+    assert server_socket.recv(4096) == expected
+    assert len(ac.outbound_queue) == 1
+    assert 0 < ac.flush_outbound() <= 1
+
+
+def test_packets_kept_while_not_connected():
+    clock = FakeClock()
+    ac = AdminClient('host', 1111)
+    ac.outbound_queue = OutboundQueue(rates={OutboundPriority.CHAT: (1, 1)}, clock=clock)
+    ac.socket, server_socket = socket.socketpair()
+    ac.send_packets([chat('a'), chat('b')])
+    assert server_socket.recv(4096) == chat('a').encoded()
+    # e.g. the connection was closed by the server, not yet disconnected
+    ac.socket.close()
+    ac.socket = None
+    clock.now = 1
+    assert ac.flush_outbound() == math.inf
+    assert len(ac.outbound_queue) == 1
+    ac.socket, server_socket = socket.socketpair()
+    ac.flush_outbound()
+    assert server_socket.recv(4096) == chat('b').encoded()
+    assert len(ac.outbound_queue) == 0
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 # standard library
+from datetime import date
 
 # related
 import pytest
@@ -86,6 +87,30 @@ def test_admin_packet_magic_encode():
 
 # TODO test_admin_packet_encode
 
+@pytest.mark.parametrize('class_, values', [
+    (packet.ServerDatePacket, {'date': date(1950, 3, 4)}),
+    (packet.ServerPongPacket, {'data': 1234}),
+    (packet.ServerClientInfoPacket, {'client_id': 5, 'client_address': '10.0.0.5', 'client_name': 'üser',
+                                     'client_lang': 0, 'join_date': date(1950, 1, 1), 'client_play_as': 255}),
+    (packet.ServerProtocolPacket, {'version': 1, 'supported_update_freqs': {0: 0x3f, 1: 0x41}}),
+    (packet.ServerCompanyInfoPacket, {'company_id': 1, 'company_name': 'Co', 'manager_name': 'Mgr', 'colour': 3,
+                                      'is_passworded': False, 'inaugurated_year': 1950, 'is_ai': True,
+                                      'months_of_bankruptcy': 0, 'share_owners': [255, 255, 1, 255]}),
+    (packet.ServerShutdownPacket, {}),
+])
+def test_server_packet_encode(class_, values):
+    raw_data = class_.encode(**values)
+    assert packet.size_fmt.unpack_from(raw_data)[0] == len(raw_data)
+    pkt = packet.ServerPacket.decode(len(raw_data), raw_data)
+    assert type(pkt) is class_
+    for name, value in values.items():
+        assert getattr(pkt, name) == value
+
+
+def test_server_packet_encode_missing_field():
+    with pytest.raises(packet.PacketEncodeError):
+        packet.ServerDatePacket.encode()
+
 # TODO test_server_packet_decode
 
 # TODO test_server_packet_magic_decode
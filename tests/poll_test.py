@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+# related
+import pytest
+
+# project
+from ottd_ctrl.const import AdminUpdateType as AUT, PacketTypes as PT
+from ottd_ctrl.packet import ServerClientInfoPacket, ServerClientJoinPacket, ServerClientUpdatePacket
+from ottd_ctrl.packet import size_len, type_len
+from ottd_ctrl.poll import POLL_ALL, PollScheduler
+from ottd_ctrl.ratelimit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(2, burst=2, clock=clock)
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+    assert bucket.time_until_available() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.consume()
+    assert not bucket.consume()
+
+
+def payload(frame):
+    """Returns packet type and payload of a raw packet, as given to PollScheduler.on_frame()"""
+    return frame[size_len], frame[size_len + type_len:]
+
+
+def client_info(client_id, name='a'):
+    return payload(ServerClientInfoPacket.encode(client_id=client_id, client_address='', client_name=name,
+                                                 client_lang=0, join_date=date(1950, 1, 1), client_play_as=255))
+
+
+def client_join(client_id):
+    return payload(ServerClientJoinPacket.encode(client_id=client_id))
+
+
+def client_update(client_id, name):
+    return payload(ServerClientUpdatePacket.encode(client_id=client_id, client_name=name, client_play_as=1))
+
+
+class TestPollScheduler:
+
+    def _scheduler(self, clock, **kwargs):
+        sent = []
+        return PollScheduler(sent.append, clock=clock, **kwargs), sent
+
+    def test_poll_sent_when_due(self, clock):
+        scheduler, sent = self._scheduler(clock)
+        scheduler.schedule(AUT.ADMIN_UPDATE_DATE, d1=0, min_interval_s=1, max_interval_s=10)
+        assert scheduler.run() == 1
+        assert len(sent) == 1
+        assert (sent[0].update_type, sent[0].d1) == (AUT.ADMIN_UPDATE_DATE, 0)
+        clock.now = 0.5
+        scheduler.on_frame(PT.ADMIN_PACKET_SERVER_DATE, b'1')
+        scheduler.run()
+        assert len(sent) == 1, 'Poll sent before being due'
+
+    @pytest.mark.parametrize('responses_expected', [
+        ([b'1', b'1', b'1', b'1'], 'slower'),
+        ([b'1', b'2', b'3', b'4'], 'min'),
+    ])
+    def test_interval_adapts_to_changes(self, clock, responses_expected):
+        responses, expected = responses_expected
+        scheduler, sent = self._scheduler(clock)
+        job = scheduler.schedule(AUT.ADMIN_UPDATE_DATE, d1=0, min_interval_s=1, max_interval_s=10)
+        for response in responses:
+            clock.now += scheduler.run()
+            scheduler.run()
+            scheduler.on_frame(PT.ADMIN_PACKET_SERVER_DATE, response)
+        clock.now += scheduler.run()
+        scheduler.run()
+        if expected == 'min':
+            assert job.interval_s == 1
+        else:
+            assert job.interval_s > 3
+        assert job.nb_changes == (0 if expected == 'slower' else len(responses) - 1)
+
+    def test_in_flight_poll_not_repeated(self, clock):
+        scheduler, sent = self._scheduler(clock, response_timeout_s=5)
+        scheduler.schedule(AUT.ADMIN_UPDATE_CLIENT_INFO, min_interval_s=1)
+        scheduler.schedule(AUT.ADMIN_UPDATE_CLIENT_INFO, d1=3, min_interval_s=1)
+        scheduler.run()
+        assert len(sent) == 1, 'Poll for a single client sent while polling all clients'
+        clock.now = 2
+        scheduler.run()
+        assert len(sent) == 1, 'Poll sent again while waiting for the response'
+        clock.now = 5
+        scheduler.run()
+        assert [pkt.d1 for pkt in sent] == [POLL_ALL, POLL_ALL], 'Poll not sent again after timeout'
+        scheduler.on_frame(PT.ADMIN_PACKET_SERVER_CLIENT_INFO, b'1')
+        scheduler.unschedule(AUT.ADMIN_UPDATE_CLIENT_INFO)
+        clock.now = 6
+        scheduler.run()
+        assert sent[-1].d1 == 3
+
+    def test_packet_budget(self, clock):
+        scheduler, sent = self._scheduler(clock, max_packets_per_s=2)
+        for d1 in range(5):
+            scheduler.schedule(AUT.ADMIN_UPDATE_COMPANY_INFO, d1=d1, min_interval_s=1)
+        wait_s = scheduler.run()
+        assert len(sent) == 2
+        assert wait_s == pytest.approx(0.5)
+
+    def test_automatic_updates_not_responses(self, clock):
+        scheduler, sent = self._scheduler(clock)
+        job = scheduler.schedule(AUT.ADMIN_UPDATE_CLIENT_INFO, min_interval_s=1, max_interval_s=10)
+        for i in range(5):
+            clock.now += scheduler.run()
+            scheduler.run()
+            # automatic updates received before, within and after the responses
+            scheduler.on_frame(*client_update(2, 'name %s' % i))
+            assert job.in_flight
+            scheduler.on_frame(*client_info(1))
+            scheduler.on_frame(*client_info(2))
+            scheduler.on_frame(*client_join(3 + i))
+            scheduler.on_frame(*client_info(3 + i, 'new'))
+            assert job._responses == [client_info(1)[1], client_info(2)[1]]
+        clock.now += scheduler.run()
+        scheduler.run()
+        assert job.nb_changes == 0
+        assert job.interval_s > 3
+
+    def test_responses_matched_to_d1(self, clock):
+        scheduler, sent = self._scheduler(clock)
+        job = scheduler.schedule(AUT.ADMIN_UPDATE_CLIENT_INFO, d1=3)
+        scheduler.run()
+        scheduler.on_frame(*client_info(2))
+        assert job.in_flight
+        scheduler.on_frame(*client_info(3))
+        assert not job.in_flight
+        scheduler.on_frame(*client_info(3, 'again'))
+        assert job._responses == [client_info(3)[1]]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import logging
+# related
+import pytest
+# project
+from ottd_ctrl.admin_client import AdminClient
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.packet import ServerCompanyNewPacket
+from ottd_ctrl.profiler import CallbackProfiler, callback_name
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Plugin:
+    def on_company_new(self, pkt):
+        pass
+
+
+def slow(pkt):
+    pass
+
+
+def test_callback_name():
+    assert callback_name(Plugin().on_company_new) == '%s.Plugin.on_company_new' % __name__
+    assert callback_name(slow) == '%s.slow' % __name__
+
+
+def test_record_and_top():
+    profiler = CallbackProfiler(slow_threshold_s=1)
+    plugin = Plugin()
+    for elapsed_ns in (10, 20, 30):
+        profiler.record(plugin.on_company_new, PT.ADMIN_PACKET_SERVER_COMPANY_NEW, elapsed_ns)
+    profiler.record(slow, PT.ADMIN_PACKET_SERVER_COMPANY_NEW, 50)
+    profiler.record(slow, PT.ADMIN_PACKET_SERVER_CHAT, 5)
+    (name, packet_type, stats), = profiler.top(1)
+    assert (name, packet_type) == (callback_name(plugin.on_company_new), PT.ADMIN_PACKET_SERVER_COMPANY_NEW)
+    assert (stats.count, stats.total_ns, stats.max_ns, stats.mean_ns) == (3, 60, 30, 20)
+    assert [(n, t) for n, t, s in profiler.top(2, order='max')] == [
+        (callback_name(slow), PT.ADMIN_PACKET_SERVER_COMPANY_NEW),
+        (callback_name(plugin.on_company_new), PT.ADMIN_PACKET_SERVER_COMPANY_NEW)]
+    assert len(profiler.report(nb=10).splitlines()) == 4
+    with pytest.raises(Exception):
+        profiler.top(order='median')
+
+
+def test_slow_warnings_are_rate_limited(caplog):
+    clock = FakeClock()
+    profiler = CallbackProfiler(slow_threshold_s=0.01, warning_interval_s=60, clock=clock)
+    with caplog.at_level(logging.WARNING, logger='profiler'):
+        for now in (0, 1, 2, 61):
+            clock.now = now
+            profiler.record(slow, PT.ADMIN_PACKET_SERVER_CHAT, 20000000)
+        profiler.record(slow, PT.ADMIN_PACKET_SERVER_CHAT, 1000)
+    messages = [r.getMessage() for r in caplog.records]
+    assert len(messages) == 2
+    assert '2 slow calls not reported' in messages[1]
+    assert profiler.stats[(callback_name(slow), PT.ADMIN_PACKET_SERVER_CHAT)].nb_slow == 4
+
+
+def test_admin_client_profiling():
+    ac = AdminClient('host', 1111)
+    profiler = ac.enable_profiling()
+    ac.register_callback(PT.ADMIN_PACKET_SERVER_COMPANY_NEW, [slow, lambda pkt: 1 / 0])
+    frame = ServerCompanyNewPacket.encode(company_id=1)
+    ac.process_frame(len(frame), frame)
+    ac.process_frame(len(frame), frame)
+    assert profiler.stats[(callback_name(slow), PT.ADMIN_PACKET_SERVER_COMPANY_NEW)].count == 2
+    assert sum(s.count for s in profiler.stats.values()) == 4
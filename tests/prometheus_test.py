@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import subprocess
+import sys
+from urllib.request import urlopen
+# project
+from ottd_ctrl.packet import ServerClientJoinPacket, ServerDatePacket
+from ottd_ctrl.prometheus import MetricsExporter, render
+from ottd_ctrl.session import Session
+from tests.helpers import feed
+
+
+dummy_session_args = ('name', 'pass', 1, 'host', 1)
+
+
+def samples(text):
+    """Returns {'name{labels}': value, ...} of the samples of a text exposition"""
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if line and not line.startswith('#')}
+
+
+def test_render():
+    session = Session(*dummy_session_args)
+    session.enable_metrics()
+    feed(session,
+         ServerDatePacket.encode(date=date(1970, 1, 2)),
+         ServerClientJoinPacket.encode(client_id=2),
+         ServerClientJoinPacket.encode(client_id=3))
+    session.rcon_latency_ns.observe(3000000)
+    res = samples(render(session))
+    assert res['ottd_ctrl_connected'] == 0
+    assert res['ottd_ctrl_clients'] == 2
+    assert res['ottd_ctrl_game_date_seconds'] == 86400
+    assert res['ottd_ctrl_packets_total{direction="received",type="ADMIN_PACKET_SERVER_CLIENT_JOIN"}'] == 2
+    assert res['ottd_ctrl_rcon_latency_seconds_bucket{le="0.002"}'] == 0
+    assert res['ottd_ctrl_rcon_latency_seconds_bucket{le="0.005"}'] == 1
+    assert res['ottd_ctrl_rcon_latency_seconds_bucket{le="+Inf"}'] == 1
+    assert res['ottd_ctrl_rcon_latency_seconds_count'] == 1
+    assert 'ottd_ctrl_ping_rtt_last_seconds' not in res
+    assert res['ottd_ctrl_server_lagging'] == 0
+    assert not any(name.startswith('ottd_ctrl_game_seconds_per_day') for name in res)
+
+
+def test_render_without_metrics():
+    res = samples(render(Session(*dummy_session_args)))
+    assert res['ottd_ctrl_joins_total'] == 0
+    assert not any(name.startswith('ottd_ctrl_packets_total') for name in res)
+
+
+def test_exporter_serves_cached_text():
+    session = Session(*dummy_session_args)
+    session.enable_metrics()
+    exporter = MetricsExporter(session, port=0, refresh_interval_s=3600).start()
+    try:
+        url = 'http://%s:%s/metrics' % exporter.address[:2]
+        feed(session, ServerClientJoinPacket.encode(client_id=2))
+        with urlopen(url) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert samples(response.read().decode('utf-8'))['ottd_ctrl_clients'] == 0
+        exporter.refresh()
+        with urlopen(url) as response:
+            assert samples(response.read().decode('utf-8'))['ottd_ctrl_clients'] == 1
+    finally:
+        exporter.stop()
+
+
+def test_http_server_imported_on_demand():
+    code = "import sys, ottd_ctrl.session; assert 'http.server' not in sys.modules"
+    subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import os.path
+import socket
+# related
+import pytest
+# project
+from ottd_ctrl.admin_client import ConnectionClosedByPeer
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.const import NetworkErrorCode, PacketTypes as PT
+from ottd_ctrl.mock_server import MockAdminServer
+from ottd_ctrl.packet import AdminJoinPacket, AdminPollPacket, ServerPacket
+from ottd_ctrl.poll import POLL_ALL
+from ottd_ctrl.proxy import AdminProxy
+from ottd_ctrl.session import Session
+from tests.helpers import wait_until
+
+
+@pytest.fixture
+def server():
+    server = MockAdminServer(password='secret', start_date=date(1950, 1, 1),
+                             rcon_handler=lambda command: ['result of %s' % command])
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def proxy(server, tmpdir):
+    host, port = server.address
+    upstream = Session('proxy', 'secret', '1', host, port, timeout_s=2)
+    proxy = AdminProxy(upstream, os.path.join(str(tmpdir), 'admin.sock')).start()
+    yield proxy
+    proxy.stop()
+    upstream.disconnect()
+
+
+def bot(proxy, name, update_frequencies=None):
+    session = Session(name, 'secret', '1', proxy.path, None, timeout_s=2, update_frequencies=update_frequencies)
+    session.join_server()
+    return session
+
+
+def test_single_upstream_connection(server, proxy):
+    bots = [bot(proxy, 'bot %s' % i) for i in range(3)]
+    assert all(b.server_name == server.server_name for b in bots)
+    assert bots[0].supported_update_frequencies == server.supported_update_freqs
+    assert len(server.connections) == 1
+    for b in bots:
+        b.quit_server()
+    wait_until(lambda: len(proxy.clients) == 0)
+
+
+def test_updates_routed_to_subscribers(server, proxy):
+    chat_bot = bot(proxy, 'chat', {AUT.ADMIN_UPDATE_CHAT: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                                   AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_MONTHLY})
+    other_bot = bot(proxy, 'other', {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY})
+    wait_until(lambda: server.connections[0].update_frequencies.get(AUT.ADMIN_UPDATE_CHAT))
+    server.chat(1, 'hello')
+    assert chat_bot.wait_for_packet(PT.ADMIN_PACKET_SERVER_CHAT, timeout_s=2).message == 'hello'
+    server.advance_days(31)
+    dates = [other_bot.wait_for_packet(PT.ADMIN_PACKET_SERVER_DATE, timeout_s=2).date for _ in range(31)]
+    assert dates[-1] == date(1950, 2, 1)
+    # only the first day of the month
+    assert chat_bot.wait_for_packet(PT.ADMIN_PACKET_SERVER_DATE, timeout_s=2).date == date(1950, 2, 1)
+    chat_bot.quit_server()
+    wait_until(lambda: server.connections[0].update_frequencies.get(AUT.ADMIN_UPDATE_CHAT) == 0)
+    other_bot.quit_server()
+
+
+def test_periodic_updates_routed_by_frequency(server, proxy):
+    server.add_company('Company')
+    weekly_bot = bot(proxy, 'weekly', {AUT.ADMIN_UPDATE_COMPANY_ECONOMY: AUF.ADMIN_FREQUENCY_WEEKLY})
+    quarterly_bot = bot(proxy, 'quarterly', {AUT.ADMIN_UPDATE_COMPANY_ECONOMY: AUF.ADMIN_FREQUENCY_QUARTERLY})
+    received = {weekly_bot: [], quarterly_bot: []}
+    for b, packets in received.items():
+        b.register_callback(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, packets.append)
+    wait_until(lambda: server.connections[0].update_frequencies.get(AUT.ADMIN_UPDATE_COMPANY_ECONOMY) ==
+               AUF.ADMIN_FREQUENCY_WEEKLY | AUF.ADMIN_FREQUENCY_QUARTERLY)
+    # from 1950-01-02 to 1950-04-01: 13 Mondays and the first day of a quarter
+    server.advance_days(90)
+    for b, nb_expected in ((weekly_bot, 13), (quarterly_bot, 1)):
+        while len(received[b]) < nb_expected:
+            b.wait_for_packet(PT.ADMIN_PACKET_SERVER_COMPANY_ECONOMY, timeout_s=2)
+        # and no other one
+        b.receive_packets(timeout_s=0.1)
+        assert len(received[b]) == nb_expected
+        b.quit_server()
+
+
+def test_requests_answered_to_requester(server, proxy):
+    bots = [bot(proxy, 'bot %s' % i) for i in range(2)]
+    server.add_clients(2)
+    assert bots[0].send_rcon('a') == ['result of a']
+    assert bots[1].send_rcon('b') == ['result of b']
+    bots[1].send_ping()
+    bots[1].wait_for_packet(PT.ADMIN_PACKET_SERVER_PONG, timeout_s=2)
+    assert bots[1].rtt_s is not None
+    bots[0].send_packet(AdminPollPacket(update_type=AUT.ADMIN_UPDATE_CLIENT_INFO, d1=POLL_ALL))
+    infos = [bots[0].wait_for_packet(PT.ADMIN_PACKET_SERVER_CLIENT_INFO, timeout_s=2) for _ in range(3)]
+    assert sorted(pkt.client_id for pkt in infos) == [1, 2, 3]
+    # the other bot did not subscribe to client info
+    bots[1].receive_packets(timeout_s=0.1)
+    assert bots[1].clients == {}
+    for b in bots:
+        b.quit_server()
+
+
+def test_poll_responses_not_sent_to_subscribers(server, proxy):
+    server.add_clients(2)
+    poller = bot(proxy, 'poller')
+    subscriber = bot(proxy, 'subscriber', {AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_AUTOMATIC})
+    wait_until(lambda: server.connections[0].update_frequencies.get(AUT.ADMIN_UPDATE_CLIENT_INFO))
+    subscriber.receive_packets(timeout_s=0.1)
+    received = []
+    subscriber.register_callback(PT.ADMIN_PACKET_SERVER_CLIENT_INFO, received.append)
+    poller.send_packet(AdminPollPacket(update_type=AUT.ADMIN_UPDATE_CLIENT_INFO, d1=POLL_ALL))
+    infos = [poller.wait_for_packet(PT.ADMIN_PACKET_SERVER_CLIENT_INFO, timeout_s=2) for _ in range(3)]
+    assert sorted(pkt.client_id for pkt in infos) == [1, 2, 3]
+    wait_until(lambda: proxy._pending_polls[AUT.ADMIN_UPDATE_CLIENT_INFO] == 0)
+    subscriber.receive_packets(timeout_s=0.1)
+    assert received == []
+    # automatic updates still reach the subscriber, not the poller
+    server.add_clients(1)
+    assert subscriber.wait_for_packet(PT.ADMIN_PACKET_SERVER_CLIENT_INFO, timeout_s=2).client_id == 4
+    poller.receive_packets(timeout_s=0.1)
+    assert 4 not in poller.clients
+    poller.quit_server()
+    subscriber.quit_server()
+
+
+@pytest.mark.parametrize('error', [socket.timeout, ConnectionResetError])
+def test_upstream_error_closes_clients(server, proxy, error):
+    b = bot(proxy, 'bot', {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY})
+
+    def receive_frame():
+        raise error()
+    proxy.upstream.receive_frame = receive_frame
+    server.advance_days(1)
+    with pytest.raises(ConnectionClosedByPeer):
+        b.receive_packets(timeout_s=2)
+    wait_until(lambda: not proxy._thread.is_alive())
+    assert proxy.clients == []
+    assert not proxy.upstream.is_connected
+
+
+def test_wrong_password(proxy):
+    session = Session('bot', 'wrong', '1', proxy.path, None, timeout_s=2)
+    session.connect()
+    session.send_packet(AdminJoinPacket(password='wrong', name='bot', version='1'))
+    error = session.wait_for_packet(PT.ADMIN_PACKET_SERVER_ERROR, timeout_s=2).error
+    assert error == NetworkErrorCode.NETWORK_ERROR_WRONG_PASSWORD
+    session.disconnect()
+
+
+def raw_client(proxy, data):
+    """Sends raw data to the proxy, returns the packet answered before the proxy closed the connection"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(2)
+    sock.connect(proxy.path)
+    sock.sendall(data)
+    received = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        received += chunk
+    sock.close()
+    return ServerPacket.decode(len(received), received)
+
+
+@pytest.mark.parametrize('data', [b'\x00\x00', b'\x02\x00'], ids=['size 0', 'size without type'])
+def test_malformed_frame_closes_client(server, proxy, data):
+    other_bot = bot(proxy, 'other')
+    pkt = raw_client(proxy, data)
+    assert pkt.type_ == PT.ADMIN_PACKET_SERVER_ERROR
+    assert pkt.error == NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET
+    wait_until(lambda: len(proxy.clients) == 1)
+    # the proxy still serves the other clients
+    assert other_bot.send_rcon('a') == ['result of a']
+    other_bot.quit_server()
+
+
+def test_undecodable_packet_answered_with_error(server, proxy):
+    other_bot = bot(proxy, 'other')
+    # a join without any of its strings
+    pkt = raw_client(proxy, b'\x03\x00' + bytes([PT.ADMIN_PACKET_ADMIN_JOIN]))
+    assert pkt.type_ == PT.ADMIN_PACKET_SERVER_ERROR
+    assert pkt.error == NetworkErrorCode.NETWORK_ERROR_ILLEGAL_PACKET
+    wait_until(lambda: len(proxy.clients) == 1)
+    assert other_bot.send_rcon('a') == ['result of a']
+    other_bot.quit_server()
+
+
+@pytest.mark.parametrize('enable', [
+    lambda s: s.enable_priority_dispatch(),
+    lambda s: s.enable_outbound_scheduler(),
+    lambda s: s.set_socket_options(nonblocking=True),
+], ids=['priority dispatch', 'outbound scheduler', 'nonblocking'])
+def test_unsupported_upstream_modes(server, tmpdir, enable):
+    host, port = server.address
+    upstream = Session('proxy', 'secret', '1', host, port, timeout_s=2)
+    enable(upstream)
+    path = os.path.join(str(tmpdir), 'admin.sock')
+    with pytest.raises(Exception, match='must not dispatch by priority'):
+        AdminProxy(upstream, path)
+    assert not os.path.exists(path)
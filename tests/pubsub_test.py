@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import json
+import os.path
+import socket
+import threading
+# related
+import pytest
+# project
+from ottd_ctrl.packet import ServerChatPacket, ServerDatePacket
+from ottd_ctrl.pubsub import EventPublisher, encode_event, iter_events
+from ottd_ctrl.session import Session
+from tests.helpers import feed, wait_until
+
+
+def chat_frame(message):
+    return ServerChatPacket.encode(network_action=3, destination_type=0, client_id=2, message=message, data=0)
+
+
+def test_encode_event():
+    frame = ServerDatePacket.encode(date=date(1950, 1, 2))
+    pkt = ServerDatePacket.decode(len(frame), frame)
+    line = encode_event(pkt, date(1950, 1, 2))
+    assert line.endswith(b'\n')
+    assert json.loads(line.decode('utf-8')) == {'type': 'ADMIN_PACKET_SERVER_DATE', 'date': '1950-01-02',
+                                                'fields': {'date': '1950-01-02'}}
+
+
+def subscribe(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(2)
+    sock.connect(path)
+    return sock
+
+
+def read_events(sock, nb):
+    data = b''
+    while data.count(b'\n') < nb:
+        data += sock.recv(4096)
+    return [json.loads(line.decode('utf-8')) for line in data.splitlines()]
+
+
+@pytest.fixture
+def path(tmpdir):
+    return os.path.join(str(tmpdir), 'events.sock')
+
+
+def test_session_fan_out(path):
+    session = Session('name', 'pass', 1, 'host', 1)
+    publisher = session.start_publisher(path)
+    try:
+        subscribers = [subscribe(path) for _ in range(3)]
+        wait_until(lambda: len(publisher.subscribers) == 3)
+        feed(session, ServerDatePacket.encode(date=date(1950, 1, 1)), chat_frame('hello'))
+        for sock in subscribers:
+            date_event, chat_event = read_events(sock, 2)
+            assert date_event['date'] == '1950-01-01'
+            assert chat_event['type'] == 'ADMIN_PACKET_SERVER_CHAT'
+            assert chat_event['date'] == '1950-01-01'
+            assert chat_event['fields']['message'] == 'hello'
+        assert publisher.nb_published == 2
+        subscribers[0].close()
+        wait_until(lambda: len(publisher.subscribers) == 2)
+    finally:
+        session.stop_publisher()
+    assert not os.path.exists(path)
+    # the publisher callback is unregistered
+    feed(session, chat_frame('nobody listens'))
+
+
+def test_iter_events(path):
+    publisher = EventPublisher(path).start()
+    try:
+        events = iter_events(path, timeout_s=2)
+        frame = chat_frame('hello')
+        pkt = ServerChatPacket.decode(len(frame), frame)
+
+        def publish():
+            wait_until(lambda: len(publisher.subscribers) == 1)
+            publisher.publish(pkt)
+        threading.Thread(target=publish).start()
+        assert next(events)['fields']['message'] == 'hello'
+        events.close()
+    finally:
+        publisher.stop()
+
+
+def test_slow_subscriber_disconnected(path):
+    publisher = EventPublisher(path, max_buffered_bytes=4096).start()
+    slow = subscribe(path)
+    fast = subscribe(path)
+    try:
+        wait_until(lambda: len(publisher.subscribers) == 2)
+        frame = chat_frame('x' * 500)
+        pkt = ServerChatPacket.decode(len(frame), frame)
+        line_size = len(encode_event(pkt))
+        nb_published = 0
+        while publisher.nb_slow_disconnected == 0:
+            assert nb_published < 10000
+            publisher.publish(pkt)
+            nb_published += 1
+            # the fast subscriber reads each event as soon as it is published
+            data = b''
+            while len(data) < line_size:
+                data += fast.recv(line_size - len(data))
+        wait_until(lambda: len(publisher.subscribers) == 1)
+        publisher.publish(pkt)
+        assert len(read_events(fast, 1)) == 1
+        assert publisher.nb_slow_disconnected == 1
+    finally:
+        publisher.stop()
+        slow.close()
+        fast.close()
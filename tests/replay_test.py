@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import os.path
+
+# related
+import pytest
+
+# project
+from ottd_ctrl.capture import DIRECTION_RECEIVED, DIRECTION_SENT, CaptureRecorder
+from ottd_ctrl.const import PacketTypes as PT
+from ottd_ctrl.packet import PacketDecodeError, size_fmt, type_fmt
+from ottd_ctrl.protocol import Date, UInt32
+from ottd_ctrl.replay import CaptureReplayer
+from ottd_ctrl.session import Session
+
+
+def frame(packet_type, payload):
+    return size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) + type_fmt.pack(packet_type) + payload
+
+
+def write_capture(prefix, compression, nb_days):
+    recorder = CaptureRecorder(prefix, compression=compression, max_segment_size=1000)
+    recorder.record(DIRECTION_SENT, frame(PT.ADMIN_PACKET_ADMIN_PING, UInt32(1).raw_data))
+    for day in range(1, nb_days + 1):
+        recorder.record(DIRECTION_RECEIVED, frame(PT.ADMIN_PACKET_SERVER_DATE,
+                                                  Date(date.fromordinal(day + 700000)).raw_data))
+        recorder.record(DIRECTION_RECEIVED, frame(PT.ADMIN_PACKET_SERVER_CLIENT_JOIN, UInt32(day).raw_data))
+    recorder.close()
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_replay_into_session(tmpdir, compression):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    write_capture(prefix, compression, 100)
+    new_days = []
+
+    class MySession(Session):
+        def on_new_day(self, date):
+            new_days.append(date)
+
+    session = MySession('name', 'pass', '1', 'host', 1, client_welcome_message=['hello'])
+    stats = CaptureReplayer(prefix).replay(session)
+    assert stats.nb_packets == 200
+    assert stats.by_type[PT.ADMIN_PACKET_SERVER_DATE].count == 100
+    assert len(new_days) == 99
+    assert session.current_date == date.fromordinal(100 + 700000)
+    # welcome messages sent to the joining clients
+    assert len(session.socket.sent) == 100 * 3
+    assert 'ADMIN_PACKET_SERVER_CLIENT_JOIN' in stats.report()
+
+
+def test_replay_max_packets(tmpdir):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    write_capture(prefix, None, 10)
+    session = Session('name', 'pass', '1', 'host', 1)
+    stats = CaptureReplayer(prefix).replay(session, max_packets=5)
+    assert stats.nb_packets == 5
+
+
+@pytest.mark.parametrize('data', [b'\x00\x00', b'\x02\x00', b'\x09\x00\x0a', b'\x09'],
+                         ids=['size 0', 'size without type', 'size past the record', 'truncated size'])
+def test_replay_corrupted_record(tmpdir, data):
+    prefix = os.path.join(str(tmpdir), 'capture')
+    recorder = CaptureRecorder(prefix)
+    recorder.record(DIRECTION_RECEIVED, frame(PT.ADMIN_PACKET_SERVER_CLIENT_JOIN, UInt32(1).raw_data) + data)
+    recorder.close()
+    frames = CaptureReplayer(prefix).iter_frames()
+    assert next(frames)[1] == 7
+    with pytest.raises(PacketDecodeError):
+        next(frames)
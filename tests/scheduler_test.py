@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date, timedelta
+import math
+# related
+import pytest
+# project
+from ottd_ctrl.packet import ServerDatePacket
+from ottd_ctrl.scheduler import DateScheduler, TimerScheduler
+from ottd_ctrl.session import Session
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timers():
+    return TimerScheduler(clock=FakeClock())
+
+
+def test_call_later(timers):
+    calls = []
+    timers.call_later(5, calls.append, 'b')
+    timers.call_later(2, calls.append, 'a')
+    assert timers.run() == 2
+    timers.clock.now = 2
+    assert timers.run() == 3
+    assert calls == ['a']
+    timers.clock.now = 10
+    assert timers.run() == math.inf
+    assert calls == ['a', 'b']
+    assert len(timers) == 0
+
+
+def test_call_every(timers):
+    calls = []
+    timer = timers.call_every(10, lambda: calls.append(timers.clock.now), first_delay_s=0)
+    timers.run()
+    timers.clock.now = 10
+    assert timers.run() == 10
+    # late, the missed calls are not made up for
+    timers.clock.now = 35
+    assert timers.run() == 10
+    assert calls == [0, 10, 35]
+    timer.cancel()
+    assert timers.run() == math.inf
+    with pytest.raises(Exception):
+        timers.call_every(0, print)
+
+
+def test_timer_error_logged(timers, caplog):
+    def fail():
+        raise ValueError('boom')
+    calls = []
+    timers.call_later(0, fail)
+    timers.call_later(0, calls.append, 1)
+    timers.run()
+    assert calls == [1]
+    assert 'boom' in caplog.text
+
+
+def feed_dates(scheduler, start, nb_days):
+    for i in range(nb_days):
+        scheduler.run(start + timedelta(days=i))
+
+
+def test_every_days():
+    scheduler = DateScheduler()
+    calls = []
+    scheduler.every_days(7, calls.append)
+    feed_dates(scheduler, date(1950, 1, 1), 15)
+    assert calls == [date(1950, 1, 8), date(1950, 1, 15)]
+
+
+def test_every_quarter():
+    scheduler = DateScheduler()
+    calls = []
+    scheduler.every_quarter(calls.append)
+    feed_dates(scheduler, date(1950, 1, 1), 366)
+    assert calls == [date(1950, 1, 1), date(1950, 4, 1), date(1950, 7, 1), date(1950, 10, 1), date(1951, 1, 1)]
+
+
+def test_at_and_cancel():
+    scheduler = DateScheduler()
+    calls = []
+    scheduler.at(date(1950, 1, 3), calls.append)
+    scheduler.at(date(1900, 1, 1), calls.append)
+    scheduler.every_days(1, calls.append).cancel()
+    assert len(scheduler) == 2
+    feed_dates(scheduler, date(1950, 1, 1), 5)
+    assert calls == [date(1950, 1, 1), date(1950, 1, 3)]
+    assert len(scheduler) == 0
+
+
+def test_new_game_resets():
+    scheduler = DateScheduler()
+    calls = []
+    scheduler.every_days(10, calls.append)
+    feed_dates(scheduler, date(1960, 1, 1), 5)
+    feed_dates(scheduler, date(1950, 1, 1), 11)
+    assert calls == [date(1950, 1, 11)]
+
+
+def test_session_date_triggers():
+    s = Session('name', 'pass', 1, 'host', 1)
+    calls = []
+    s.date_triggers.every_days(1, calls.append)
+    for i in range(3):
+        frame = ServerDatePacket.encode(date=date(1950, 1, 1) + timedelta(days=i))
+        s.process_frame(len(frame), frame)
+    assert calls == [date(1950, 1, 2), date(1950, 1, 3)]
@@ -2,13 +2,20 @@
 
 # standard library
 from datetime import date
+import socket
 # related
 import pytest
 # project
-from ottd_ctrl.const import DestType, NetworkAction
-from ottd_ctrl.packet import AdminChatPacket, AdminPacket, ServerDatePacket
-from ottd_ctrl.protocol import Date
-from ottd_ctrl.session import Session
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.const import DestType, NetworkAction, PacketTypes as PT
+from ottd_ctrl.packet import AdminChatPacket, AdminPacket, AdminUpdateFrequenciesPacket
+from ottd_ctrl.packet import ServerDatePacket, ServerPongPacket
+from ottd_ctrl.packet import ServerClientErrorPacket, ServerClientInfoPacket, ServerClientJoinPacket
+from ottd_ctrl.packet import ServerClientQuitPacket, ServerClientUpdatePacket
+from ottd_ctrl.packet import ServerCompanyNewPacket, ServerCompanyRemovePacket
+from ottd_ctrl.packet import size_fmt, type_fmt
+from ottd_ctrl.protocol import Boolean, Date, String, UInt8, UInt16, UInt32
+from ottd_ctrl.session import Session, UnsupportedUpdateFrequency
 
 
 dummy_session_args = ('name', 'pass', 1, 'host', 1)
@@ -21,6 +28,33 @@ def date_pkt(date):
     return pkt
 
 
+def server_frame(packet_type, payload):
+    """Returns a raw server packet as sent over the wire"""
+    return size_fmt.pack(size_fmt.size + type_fmt.size + len(payload)) + type_fmt.pack(packet_type) + payload
+
+
+def protocol_frame(supported_update_freqs):
+    payload = UInt8(1).raw_data
+    for update_type, update_frequency in supported_update_freqs.items():
+        payload += UInt8(1).raw_data + UInt16(update_type).raw_data + UInt16(update_frequency).raw_data
+    payload += UInt8(0).raw_data
+    return server_frame(PT.ADMIN_PACKET_SERVER_PROTOCOL, payload)
+
+
+def welcome_frame(server_name='server'):
+    payload = (String(server_name).raw_data + String('1.0').raw_data + Boolean(True).raw_data +
+               String('map').raw_data + UInt32(1).raw_data + UInt8(0).raw_data +
+               Date(date(1950, 1, 1)).raw_data + UInt16(256).raw_data + UInt16(256).raw_data)
+    return server_frame(PT.ADMIN_PACKET_SERVER_WELCOME, payload)
+
+
+class SocketPairSession(Session):
+    """A session connected to one end of a socket pair, the other end plays the server"""
+    def connect(self):
+        self.socket, self.server_socket = socket.socketpair()
+        self.server_socket.sendall(self.server_frames)
+
+
 def chat_pkt(dest_type, dest, msg):
     return AdminChatPacket(network_action=NetworkAction.NETWORK_ACTION_CHAT,
                            destination_type=dest_type,
@@ -247,4 +281,197 @@ class TestSendChat:
     def test_send_company_chat(self, attrs_expected):
         (company_id, msg), expected_packets = attrs_expected
         s = self.MySession(expected_packets, *dummy_session_args)
-        s.send_client_chat(msg, company_id)
\ No newline at end of file
+        s.send_client_chat(msg, company_id)
+
+@pytest.mark.parametrize('welcome_message, expected', [
+    ('Welcome!', ['Welcome!']),
+    (['Welcome!', 'Have fun'], ['Welcome!', 'Have fun']),
+])
+def test_welcome_message_lines(welcome_message, expected):
+    s = Session(*dummy_session_args, client_welcome_message=welcome_message)
+    assert s._format_company_welcome_msg() == ['-' * 20] + expected + ['-' * 20]
+
+
+class TestJoinServer:
+    """Testing join_server() in normal and pipelined mode"""
+    supported = {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_DAILY,
+                 AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_AUTOMATIC}
+
+    def _session(self, update_frequencies):
+        s = SocketPairSession('name', 'pass', '1', 'host', 1,
+                              update_frequencies=update_frequencies,
+                              initial_polls=[(AUT.ADMIN_UPDATE_CLIENT_INFO, 0xFFFFFFFF)])
+        s.server_frames = protocol_frame(self.supported) + welcome_frame('my server')
+        return s
+
+    @pytest.mark.parametrize('pipelined', [False, True])
+    def test_join_server(self, pipelined):
+        s = self._session({AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY})
+        s.join_server(pipelined=pipelined)
+        assert s.server_name == 'my server'
+        assert s.supported_update_frequencies == self.supported
+        assert s._server_joined
+        assert s.time_to_ready_s is not None
+        expected = b''.join(p.encoded() for p in s._bootstrap_packets(s._update_frequencies))
+        received = b''
+        while len(received) < len(expected):
+            received += s.server_socket.recv(4096)
+        assert received == expected, 'Join, frequencies and polls not sent in order'
+
+    def test_pipelined_join_unsupported_frequency(self):
+        s = self._session({AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_AUTOMATIC})
+        with pytest.raises(UnsupportedUpdateFrequency, match='AUTOMATIC not supported for type .*DATE'):
+            s.join_server(pipelined=True)
+        assert not s.is_connected
+        assert not s._server_joined
+
+
+class TestAutoSubscribe:
+    """Testing update types derived from hooks and callbacks"""
+    supported = {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_DAILY,
+                 AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                 AUT.ADMIN_UPDATE_COMPANY_ECONOMY: AUF.ADMIN_FREQUENCY_POLL | AUF.ADMIN_FREQUENCY_MONTHLY,
+                 AUT.ADMIN_UPDATE_CONSOLE: AUF.ADMIN_FREQUENCY_AUTOMATIC,
+                 AUT.ADMIN_UPDATE_CHAT: AUF.ADMIN_FREQUENCY_AUTOMATIC}
+
+    class MySession(SocketPairSession):
+        def on_new_month(self, date):
+            pass
+
+        def on_company_economy(self, pkt):
+            pass
+
+    def test_required_update_types(self):
+        s = self.MySession(*dummy_session_args, auto_subscribe=True)
+        assert s.required_update_types() == {AUT.ADMIN_UPDATE_DATE, AUT.ADMIN_UPDATE_COMPANY_ECONOMY}
+        s.register_callback(PT.ADMIN_PACKET_SERVER_CHAT, lambda pkt: None)
+        assert AUT.ADMIN_UPDATE_CHAT in s.required_update_types()
+        assert Session(*dummy_session_args).required_update_types() == set()
+
+    def test_subscriptions(self):
+        s = self.MySession('name', 'pass', '1', 'host', 1, auto_subscribe=True)
+        s.server_frames = protocol_frame(self.supported) + welcome_frame()
+        s.join_server()
+        assert s._subscriptions == {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY,
+                                    AUT.ADMIN_UPDATE_COMPANY_ECONOMY: AUF.ADMIN_FREQUENCY_MONTHLY}
+
+        def on_console(pkt):
+            pass
+        s.register_callback(PT.ADMIN_PACKET_SERVER_CONSOLE, on_console)
+        assert s._subscriptions[AUT.ADMIN_UPDATE_CONSOLE] == AUF.ADMIN_FREQUENCY_AUTOMATIC
+        s.unregister_callback(PT.ADMIN_PACKET_SERVER_CONSOLE, on_console)
+        assert AUT.ADMIN_UPDATE_CONSOLE not in s._subscriptions
+
+    def test_pipelined_subscriptions(self):
+        s = self.MySession('name', 'pass', '1', 'host', 1, auto_subscribe=True)
+        s.server_frames = protocol_frame(self.supported) + welcome_frame()
+        s.join_server(pipelined=True)
+        # weekly guessed before the PROTOCOL packet, monthly is the supported one
+        assert s._subscriptions == {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY,
+                                    AUT.ADMIN_UPDATE_COMPANY_ECONOMY: AUF.ADMIN_FREQUENCY_MONTHLY}
+        expected = [AdminUpdateFrequenciesPacket(update_type=AUT.ADMIN_UPDATE_COMPANY_ECONOMY,
+                                                 update_frequency=AUF.ADMIN_FREQUENCY_WEEKLY).encoded(),
+                    AdminUpdateFrequenciesPacket(update_type=AUT.ADMIN_UPDATE_COMPANY_ECONOMY,
+                                                 update_frequency=AUF.ADMIN_FREQUENCY_MONTHLY).encoded()]
+        received = b''
+        while not received.endswith(expected[1]):
+            received += s.server_socket.recv(4096)
+        assert expected[0] in received
+        s.disconnect()
+
+    def test_unregister_unknown_keyed_callback(self):
+        s = self.MySession(*dummy_session_args, auto_subscribe=True)
+        with pytest.raises(ValueError):
+            s.unregister_keyed_callback(PT.ADMIN_PACKET_SERVER_CHAT, 1, print)
+        assert PT.ADMIN_PACKET_SERVER_CHAT not in s.keyed_callbacks
+        assert AUT.ADMIN_UPDATE_CHAT not in s.required_update_types()
+
+
+class TestGameState:
+    """Testing clients, companies and round trip times kept by the session"""
+
+    @staticmethod
+    def _feed(s, *frames):
+        for frame in frames:
+            s.process_frame(len(frame), frame)
+
+    def test_clients(self):
+        s = Session(*dummy_session_args)
+        self._feed(s,
+                   ServerClientJoinPacket.encode(client_id=2),
+                   ServerClientInfoPacket.encode(client_id=2, client_address='', client_name='a', client_lang=0,
+                                                 join_date=date(1950, 1, 1), client_play_as=255),
+                   ServerClientUpdatePacket.encode(client_id=2, client_name='b', client_play_as=1),
+                   ServerClientJoinPacket.encode(client_id=3))
+        assert s.clients[2].client_name == 'b'
+        assert s.clients[2].client_play_as == 1
+        assert s.clients[3] is None
+        self._feed(s, ServerClientQuitPacket.encode(client_id=2), ServerClientErrorPacket.encode(client_id=3, error=3))
+        assert s.clients == {}
+
+    def test_companies(self):
+        s = Session(*dummy_session_args)
+        self._feed(s,
+                   ServerCompanyNewPacket.encode(company_id=0),
+                   ServerCompanyNewPacket.encode(company_id=1),
+                   ServerCompanyRemovePacket.encode(company_id=0, remove_reason=0))
+        assert s.companies == {1: None}
+        self._feed(s, server_frame(PT.ADMIN_PACKET_SERVER_NEWGAME, b''))
+        assert s.companies == {}
+
+    def test_ping(self):
+        s = Session(*dummy_session_args)
+        s.socket, server_socket = socket.socketpair()
+        data = s.send_ping()
+        assert s.rtt_s is None
+        self._feed(s, ServerPongPacket.encode(data=data + 1))
+        assert s.rtt_s is None
+        self._feed(s, ServerPongPacket.encode(data=data))
+        assert s.rtt_s is not None
+        assert s.rtt_ns.count == 1
+        s.disconnect()
+
+
+class TestIterPackets:
+    """Testing the pull style packet stream"""
+
+    @pytest.fixture
+    def session(self):
+        s = Session(*dummy_session_args)
+        s.socket, s.server_socket = socket.socketpair()
+        s.server_socket.sendall(ServerDatePacket.encode(date=date(1950, 1, 1)) +
+                                ServerClientJoinPacket.encode(client_id=2) +
+                                ServerClientJoinPacket.encode(client_id=3) +
+                                ServerDatePacket.encode(date=date(1950, 1, 2)))
+        yield s
+        s.disconnect()
+        s.server_socket.close()
+
+    def test_iter_packets(self, session):
+        pkts = list(session.iter_packets(types=[PT.ADMIN_PACKET_SERVER_CLIENT_JOIN], timeout_s=0.1))
+        assert [pkt.client_id for pkt in pkts] == [2, 3]
+        # callbacks are called for all packets
+        assert session.current_date == date(1950, 1, 2)
+        assert set(session.clients) == {2, 3}
+
+    def test_predicate_and_early_stop(self, session):
+        it = session.iter_packets(predicate=lambda pkt: getattr(pkt, 'client_id', None) == 3, timeout_s=0.1)
+        assert next(it).client_id == 3
+        it.close()
+        # the packets after the one yielded are left on the socket
+        assert session.current_date == date(1950, 1, 1)
+        assert session.receive_packet().date == date(1950, 1, 2)
+
+    def test_stop(self, session):
+        def stop(pkt):
+            session.stop = True
+        session.register_callback(PT.ADMIN_PACKET_SERVER_CLIENT_JOIN, stop)
+        assert len(list(session.iter_packets())) == 2
+
+    def test_iter_frames(self, session):
+        frames = list(session.iter_frames(types=[PT.ADMIN_PACKET_SERVER_DATE], timeout_s=0.1))
+        assert frames == [(len(f), f) for f in (ServerDatePacket.encode(date=date(1950, 1, 1)),
+                                                ServerDatePacket.encode(date=date(1950, 1, 2)))]
+        # not decoded nor dispatched
+        assert session.current_date is None
+        assert session.clients == {}
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date, timedelta
+# related
+import pytest
+# project
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.packet import ServerDatePacket
+from ottd_ctrl.session import Session
+from ottd_ctrl.sim_speed import NORMAL_SECONDS_PER_DAY, SimSpeedMonitor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+START_DATE = date(1950, 1, 1)
+
+
+def feed_days(monitor, durations_s, nb_clients=0, start=START_DATE):
+    """Feeds one date per duration, returns the results of on_date()"""
+    res = [monitor.on_date(start, nb_clients)]
+    for i, duration_s in enumerate(durations_s, 1):
+        monitor.clock.now += duration_s
+        res.append(monitor.on_date(start + timedelta(days=i), nb_clients))
+    return res
+
+
+@pytest.fixture
+def monitor():
+    return SimSpeedMonitor(windows_days=(4, 8), clock=FakeClock())
+
+
+def test_seconds_per_day(monitor):
+    feed_days(monitor, [2] * 3)
+    assert monitor.seconds_per_day() is None
+    feed_days(monitor, [2] * 4, start=START_DATE + timedelta(days=3))
+    assert monitor.seconds_per_day() == 2
+    assert monitor.seconds_per_day(8) is None
+    assert monitor.speed_ratio == pytest.approx(NORMAL_SECONDS_PER_DAY / 2)
+
+
+def test_longer_frequency(monitor):
+    for i in range(3):
+        monitor.on_date(START_DATE + timedelta(days=7 * i))
+        monitor.clock.now += 14
+    assert monitor.seconds_per_day() == 2
+    assert monitor.seconds_per_day(8) == 2
+
+
+def test_lag_detection(monitor):
+    res = feed_days(monitor, [2.2] * 4 + [4] * 4 + [5] * 2 + [2.2] * 4)
+    assert res.count(True) == 1
+    assert res.index(True) == 6
+    assert monitor.nb_lags == 1
+    assert not monitor.lagging
+
+
+def test_pause_and_date_change_restart_measures(monitor):
+    feed_days(monitor, [2] * 4)
+    monitor.clock.now += 120
+    monitor.on_date(START_DATE + timedelta(days=5))
+    assert monitor.seconds_per_day() is None
+    feed_days(monitor, [2] * 4)
+    monitor.on_date(START_DATE)
+    assert len(monitor.samples) == 1
+
+
+def test_correlation(monitor):
+    for nb_clients, duration_s in ((1, 2), (2, 2.5), (3, 3), (4, 3.5)):
+        monitor.clock.now += duration_s
+        monitor.on_date(START_DATE + timedelta(days=nb_clients), nb_clients)
+    res = monitor.correlation()
+    assert res['clients'] == pytest.approx(1)
+    assert res['companies'] is None
+
+
+class LagSession(Session):
+    def on_server_lag(self, seconds_per_day):
+        self.lags.append(seconds_per_day)
+
+
+def test_session_on_server_lag():
+    s = LagSession('name', 'pass', 1, 'host', 1, auto_subscribe=True)
+    s.lags = []
+    s.sim_speed = SimSpeedMonitor(windows_days=(2,), clock=FakeClock())
+    for i in range(4):
+        s.sim_speed.clock.now += 10
+        frame = ServerDatePacket.encode(date=START_DATE + timedelta(days=i))
+        s.process_frame(len(frame), frame)
+    assert s.lags == [10]
+    assert s.required_update_frequencies() == {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY}
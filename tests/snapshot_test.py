@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import multiprocessing
+import os
+import threading
+# related
+import pytest
+# project
+from ottd_ctrl.packet import ServerClientInfoPacket, ServerClientQuitPacket, ServerCompanyEconomyPacket
+from ottd_ctrl.packet import ServerCompanyInfoPacket, ServerCompanyRemovePacket, ServerDatePacket
+from ottd_ctrl.session import Session
+from ottd_ctrl.snapshot import NAME_SIZE, SnapshotReader, SnapshotWriter
+from tests.helpers import feed
+
+
+def client_frame(client_id, name):
+    return ServerClientInfoPacket.encode(client_id=client_id, client_address='10.0.0.%s' % client_id,
+                                         client_name=name, client_lang=1, join_date=date(1950, 1, 1),
+                                         client_play_as=255)
+
+
+def company_frame(company_id, name):
+    return ServerCompanyInfoPacket.encode(company_id=company_id, company_name=name, manager_name='M',
+                                          colour=3, is_passworded=False, inaugurated_year=1950, is_ai=True,
+                                          months_of_bankruptcy=0, share_owners=[])
+
+
+def economy_frame(company_id, money):
+    return ServerCompanyEconomyPacket.encode(company_id=company_id, money=money, current_loan=300000,
+                                             income=-5, delivered_cargo=7, company_value_0=100,
+                                             performance_history_0=8, delivered_cargo_0=0,
+                                             company_value_1=0, performance_history_1=0, delivered_cargo_1=0)
+
+
+@pytest.fixture
+def name():
+    return 'ottd_snapshot_test_%s' % os.getpid()
+
+
+def test_session_snapshot(name):
+    session = Session('name', 'pass', 1, 'host', 1)
+    writer = session.start_snapshot(name, max_clients=4, max_companies=2)
+    try:
+        with SnapshotReader(name, track=True) as reader:
+            state = reader.read()
+            assert state['date'] is None
+            assert state['clients'] == [] and state['companies'] == []
+
+            feed(session, ServerDatePacket.encode(date=date(1950, 1, 2)),
+                 client_frame(2, 'alice'), client_frame(3, 'bob'),
+                 company_frame(0, 'Alice Transport'), economy_frame(0, -12345), company_frame(1, 'Bob Co'))
+            # written once per batch of packets, by the main loop
+            assert reader.read()['clients'] == []
+            assert session._run_jobs() > 0
+            session.write_snapshot()
+            assert writer.nb_writes == 2
+
+            state = reader.read()
+            assert state['date'] == date(1950, 1, 2)
+            assert [c['client_name'] for c in state['clients']] == ['alice', 'bob']
+            assert state['clients'][0] == {'client_id': 2, 'client_name': 'alice', 'client_address': '10.0.0.2',
+                                           'client_lang': 1, 'join_date': date(1950, 1, 1), 'client_play_as': 255}
+            alice, bob = state['companies']
+            assert alice['company_name'] == 'Alice Transport' and alice['is_ai'] is True
+            assert alice['economy'] == {'money': -12345, 'current_loan': 300000, 'income': -5,
+                                        'delivered_cargo': 7, 'company_value': 100, 'performance': 8}
+            assert bob['economy'] is None
+
+            feed(session, ServerClientQuitPacket.encode(client_id=2), ServerCompanyRemovePacket.encode(
+                company_id=0, remove_reason=0))
+            session.write_snapshot()
+            state = reader.read()
+            assert [c['client_id'] for c in state['clients']] == [3]
+            assert [c['company_id'] for c in state['companies']] == [1]
+            assert state['sequence'] % 2 == 0
+    finally:
+        session.stop_snapshot()
+    with pytest.raises(FileNotFoundError):
+        SnapshotReader(name)
+
+
+def test_limits_and_long_names(name):
+    writer = SnapshotWriter(name, max_clients=1, max_companies=1)
+    try:
+        session = Session('name', 'pass', 1, 'host', 1)
+        feed(session, client_frame(2, 'é' * NAME_SIZE), client_frame(3, 'b'))
+        writer.write(None, session.clients, session.companies)
+        with SnapshotReader(name, track=True) as reader:
+            clients = reader.read()['clients']
+        # truncated without splitting a character
+        assert clients[0]['client_name'] == 'é' * (NAME_SIZE // 2)
+        assert len(clients) == 1
+    finally:
+        writer.close()
+
+
+def test_stale_block_replaced(name):
+    stale = SnapshotWriter(name)
+    writer = SnapshotWriter(name, max_clients=2)
+    try:
+        with SnapshotReader(name, track=True) as reader:
+            assert reader.read()['sequence'] == 2
+    finally:
+        writer.close()
+        stale.shm.close()
+
+
+def test_reader_retries_while_writing(name):
+    writer = SnapshotWriter(name)
+    with SnapshotReader(name, track=True) as reader:
+        # odd sequence number, as in the middle of a write
+        writer.shm.buf[0] += 1
+        with pytest.raises(Exception):
+            reader.read(max_retries=3)
+        assert reader.nb_retries == 3
+        threading.Timer(0.05, lambda: writer.write(None, {}, {})).start()
+        assert reader.read(max_retries=10 ** 7)['sequence'] == 4
+    writer.close()
+
+
+def read_in_child(name, queue):
+    # the child shares the resource tracker of the writer
+    with SnapshotReader(name, track=True) as reader:
+        states = [reader.read() for _ in range(200)]
+    queue.put([(s['sequence'], [c['client_name'] for c in s['clients']]) for s in states])
+
+
+def test_reader_process(name):
+    """A reader in another process never sees a half written state"""
+    session = Session('name', 'pass', 1, 'host', 1)
+    session.start_snapshot(name)
+    try:
+        queue = multiprocessing.get_context('fork').Queue()
+        process = multiprocessing.get_context('fork').Process(target=read_in_child, args=(name, queue))
+        process.start()
+        for i in range(2000):
+            # all the clients have the same name in a consistent snapshot
+            feed(session, *[client_frame(client_id, 'name%s' % i) for client_id in range(2, 12)])
+            session.write_snapshot()
+        states = queue.get(timeout=10)
+        process.join(10)
+        assert process.exitcode == 0
+    finally:
+        session.stop_snapshot()
+    assert all(len(set(names)) <= 1 for _, names in states)
+    assert [sequence for sequence, _ in states] == sorted(sequence for sequence, _ in states)
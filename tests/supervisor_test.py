@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+from datetime import date
+import threading
+# related
+import pytest
+# project
+from ottd_ctrl.const import AdminUpdateFrequency as AUF, AdminUpdateType as AUT
+from ottd_ctrl.mock_server import MockAdminServer
+from ottd_ctrl.session import Session
+from ottd_ctrl.supervisor import Supervisor, session_summary
+from tests.helpers import wait_until
+
+
+class CrashingSession(Session):
+    """Fails once joined, in the worker process"""
+    def on_server_joined(self):
+        raise ValueError('crash')
+
+
+@pytest.fixture
+def servers():
+    servers = [MockAdminServer(password='secret', server_name='server %s' % i, start_date=date(1950, 1, 1))
+               for i in range(3)]
+    for server in servers:
+        server.start()
+        # the main loops wake up often, the workers stop quickly
+        server.set_game_speed(seconds_per_day=0.05)
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def session_kwargs(server):
+    host, port = server.address
+    return {'client_name': 'bot', 'password': 'secret', 'client_version': '1',
+            'server_host': host, 'server_port': port, 'timeout_s': 2,
+            'update_frequencies': {AUT.ADMIN_UPDATE_DATE: AUF.ADMIN_FREQUENCY_DAILY,
+                                   AUT.ADMIN_UPDATE_CLIENT_INFO: AUF.ADMIN_FREQUENCY_AUTOMATIC}}
+
+
+def test_session_summary():
+    summary = session_summary(Session('name', 'pass', 1, 'host', 1))
+    assert summary['connected'] is False
+    assert summary['date'] is None
+    assert summary['metrics'] is None
+
+
+def test_supervisor(servers):
+    supervisor = Supervisor([session_kwargs(s) for s in servers], servers_per_worker=2, summary_interval_s=0.1)
+    assert [len(worker.servers) for worker in supervisor.workers] == [2, 1]
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    try:
+        wait_until(lambda: supervisor.totals()['connected'] == 3, timeout_s=10, interval_s=0.05)
+        for server in servers:
+            server.add_clients(2)
+        wait_until(lambda: supervisor.totals()['clients'] == 6, timeout_s=10, interval_s=0.05)
+        state = supervisor.state()
+        assert sorted(s['server_name'] for s in state.values()) == ['server 0', 'server 1', 'server 2']
+        assert all(s['date'] > '1950-01-01' for s in state.values())
+    finally:
+        supervisor.stop()
+        thread.join(15)
+    assert not thread.is_alive()
+    assert all(not worker.is_alive for worker in supervisor.workers)
+    wait_until(lambda: all(len(server.connections) == 0 for server in servers), timeout_s=10, interval_s=0.05)
+
+
+def test_crashed_worker_restarted(servers, monkeypatch):
+    monkeypatch.setattr('ottd_ctrl.supervisor.RESTART_DELAYS_S', (0.1,))
+    supervisor = Supervisor([session_kwargs(servers[0])], session_factory=CrashingSession, summary_interval_s=0.1)
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    try:
+        wait_until(lambda: supervisor.workers[0].nb_starts >= 3, timeout_s=10, interval_s=0.05)
+        assert supervisor.totals()['worker_restarts'] >= 2
+    finally:
+        supervisor.stop()
+        thread.join(15)
+    assert not thread.is_alive()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# standard library
+import os.path
+import socket
+# related
+import pytest
+# project
+from ottd_ctrl.unix_server import UnixSocketServer
+from tests.helpers import wait_until
+
+
+class EchoServer(UnixSocketServer):
+    def _receive(self, peer):
+        data = peer.socket.recv(4096)
+        if not data:
+            return self._close(peer)
+        if data == b'bye':
+            peer.closing = True
+        self._queue(peer, data)
+        self._flush(peer)
+
+
+@pytest.fixture
+def path(tmpdir):
+    return os.path.join(str(tmpdir), 'echo.sock')
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(2)
+    sock.connect(path)
+    return sock
+
+
+def test_stale_socket_replaced(path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    with EchoServer(path).start():
+        sock = connect(path)
+        sock.sendall(b'hello')
+        assert sock.recv(4096) == b'hello'
+        sock.close()
+    assert not os.path.exists(path)
+
+
+def test_closing_peer_closed_once_flushed(path):
+    with EchoServer(path).start() as server:
+        sock = connect(path)
+        sock.sendall(b'bye')
+        assert sock.recv(4096) == b'bye'
+        assert sock.recv(4096) == b''
+        wait_until(lambda: len(server.peers) == 0)
+        sock.close()
+
+
+def test_slow_peer_disconnected(path):
+    with EchoServer(path, max_buffered_bytes=10).start() as server:
+        sock = connect(path)
+        wait_until(lambda: len(server.peers) == 1)
+        with server._lock:
+            peer = server.peers[0]
+            assert server._queue(peer, b'x' * 10)
+            assert not server._queue(peer, b'x')
+            assert peer.too_slow
+        server.wake()
+        wait_until(lambda: len(server.peers) == 0)
+        assert server.nb_slow_disconnected == 1
+        sock.close()